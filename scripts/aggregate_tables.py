@@ -0,0 +1,114 @@
+# ------------------------------------------------------------------------------
+# aggregate_tables.py
+# Materialized variant counts, kept in sync with the loaded tables
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# The recurring questions count variants by gene, assembly, type or
+# chromosome, which means a full scan and a GROUP BY every time. Those
+# counts are kept instead in small tables, one row per group with its
+# number of variants, so they are read with an index lookup. As with
+# the full-text indexes, triggers on the source table keep them in sync
+# with small changes, like those of an incremental update, while bulk
+# loads drop the triggers and rebuild the counts at the end. Each table
+# is declared as an (aggregate table, source table, [key columns],
+# condition) tuple, where the condition, or None, selects the counted
+# rows, written with {row} in place of the row being counted. A key
+# column is either a column of the source row or a (column, expression)
+# pair, the expression also written with {row}, for keys found in
+# another table, like those of the variant a gene2variant link hangs from
+
+AGGREGATE_TRIGGER_SUFFIXES = ["ai", "ad", "bu", "au"]
+
+def _key_values(key_columns, row):
+	"""
+		(column, value) pairs of the key columns, for a given row
+	"""
+	keys = [ key if isinstance(key, tuple) else (key, "{row}." + key)  for key in key_columns ]
+	return [ (column, expression.format(row=row))  for column, expression in keys ]
+
+def _key_match(key_columns, row):
+	return " AND ".join("{} IS {}".format(column, value) for column, value in _key_values(key_columns, row))
+
+def aggregate_trigger_decls(aggregate_spec):
+	aggregate_table, source_table, key_columns, condition = aggregate_spec
+	names = ", ".join(column for column, value in _key_values(key_columns, "new"))
+
+	# A missing group is added with no variants before being counted,
+	# and a group left with no variants is removed. Keys are matched
+	# with IS, as they may be NULL
+	def countRow(row, delta):
+		statements = []
+		if delta > 0:
+			statements.append("INSERT INTO {0}({1}, variants) SELECT {2}, 0 WHERE NOT EXISTS (SELECT 1 FROM {0} WHERE {3});".format(
+				aggregate_table, names, ", ".join(value for column, value in _key_values(key_columns, row)), _key_match(key_columns, row)))
+		statements.append("UPDATE {0} SET variants = variants {1} 1 WHERE {2};".format(
+			aggregate_table, "+" if delta > 0 else "-", _key_match(key_columns, row)))
+		if delta < 0:
+			statements.append("DELETE FROM {0} WHERE {1} AND variants <= 0;".format(aggregate_table, _key_match(key_columns, row)))
+		return " ".join(statements)
+
+	def when(row):
+		return " WHEN {}".format(condition.format(row=row)) if condition is not None else ""
+
+	return [
+		"CREATE TRIGGER IF NOT EXISTS {}_ai AFTER INSERT ON {}{} BEGIN {} END".format(aggregate_table, source_table, when("new"), countRow("new", 1)),
+		"CREATE TRIGGER IF NOT EXISTS {}_ad BEFORE DELETE ON {}{} BEGIN {} END".format(aggregate_table, source_table, when("old"), countRow("old", -1)),
+		"CREATE TRIGGER IF NOT EXISTS {}_bu BEFORE UPDATE ON {}{} BEGIN {} END".format(aggregate_table, source_table, when("old"), countRow("old", -1)),
+		"CREATE TRIGGER IF NOT EXISTS {}_au AFTER UPDATE ON {}{} BEGIN {} END".format(aggregate_table, source_table, when("new"), countRow("new", 1)),
+	]
+
+def drop_aggregate_triggers(db, aggregate_specs):
+	"""
+		Stops the maintenance of the counts, before a bulk load
+	"""
+	cur = db.cursor()
+	try:
+		for aggregate_spec in aggregate_specs:
+			aggregate_table = aggregate_spec[0]
+			for suffix in AGGREGATE_TRIGGER_SUFFIXES:
+				cur.execute("DROP TRIGGER IF EXISTS {}_{}".format(aggregate_table, suffix))
+	finally:
+		cur.close()
+
+def rebuild_aggregate(cur, aggregate_spec):
+	"""
+		Counts again all the groups of an aggregate table
+	"""
+	aggregate_table, source_table, key_columns, condition = aggregate_spec
+	keys = _key_values(key_columns, "src")
+	names = ", ".join(column for column, value in keys)
+	values = ", ".join(value for column, value in keys)
+	where = " WHERE {}".format(condition.format(row="src")) if condition is not None else ""
+
+	cur.execute("DELETE FROM {}".format(aggregate_table))
+	cur.execute("INSERT INTO {0}({1}, variants) SELECT {2}, COUNT(*) FROM {3} AS src{4} GROUP BY {2}".format(
+		aggregate_table, names, values, source_table, where))
+
+def sync_aggregates(db, aggregate_specs):
+	"""
+		Rebuilds the aggregate tables whose triggers are missing, or
+		watch another table than their source, and creates their
+		triggers back, so later changes are followed
+	"""
+	cur = db.cursor()
+	try:
+		for aggregate_spec in aggregate_specs:
+			aggregate_table, source_table = aggregate_spec[:2]
+			cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? AND name IN ({})".format(
+				",".join("?" * len(AGGREGATE_TRIGGER_SUFFIXES))), [source_table] + [ aggregate_table + "_" + suffix  for suffix in AGGREGATE_TRIGGER_SUFFIXES ])
+			if cur.fetchone()[0] < len(AGGREGATE_TRIGGER_SUFFIXES):
+				drop_aggregate_triggers(db,[aggregate_spec])
+				rebuild_aggregate(cur,aggregate_spec)
+				for triggerDecl in aggregate_trigger_decls(aggregate_spec):
+					cur.execute(triggerDecl)
+	finally:
+		cur.close()
@@ -0,0 +1,93 @@
+# ------------------------------------------------------------------------------
+# bench_decompression.py
+# Throughput of the decompression backends over a gzipped input file
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Each backend reads the whole file twice: line by line through a text
+# wrapper, as the serial loaders do, and in big binary blocks, as the
+# pipeline reader does. The plain backend reads a decompressed copy of
+# the file, which tells what is left for the loader once decompression
+# costs nothing
+
+import sys
+import os
+import argparse
+import io
+import shutil
+import tempfile
+import time
+
+from decompression import DECOMPRESSION_BACKENDS, select_backend, external_decompressor, open_decompressed
+from pipeline import PIPELINE_BLOCK_SIZE
+
+def read_lines(input_file, backend):
+	with io.TextIOWrapper(open_decompressed(input_file, backend), encoding="utf-8") as inF:
+		lines = 0
+		for _ in inF:
+			lines += 1
+	return lines
+
+def read_blocks(input_file, backend):
+	with open_decompressed(input_file, backend) as inF:
+		size = 0
+		while True:
+			block = inF.read(PIPELINE_BLOCK_SIZE)
+			if not block:
+				break
+			size += len(block)
+	return size
+
+def best_time(function, repeat):
+	"""
+		Fastest of repeat runs, and the result of the last one
+	"""
+	best = None
+	for _ in range(repeat):
+		started = time.perf_counter()
+		result = function()
+		elapsed = time.perf_counter() - started
+		if best is None or elapsed < best:
+			best = elapsed
+	return best, result
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Compares the decompression backends over a gzipped variant_summary, or any other gzipped input")
+	parser.add_argument("input_file", help="gzipped input file")
+	parser.add_argument("--backend", action="append", choices=[ backend  for backend in DECOMPRESSION_BACKENDS if backend != "auto" ], help="backend to measure, can be repeated (default: all those available)")
+	parser.add_argument("--repeat", type=int, default=3, help="runs of each measure, keeping the fastest (default: %(default)s)")
+	args = parser.parse_args()
+
+	backends = args.backend if args.backend else [ backend  for backend in DECOMPRESSION_BACKENDS if backend != "auto" ]
+	if "pipe" in backends and external_decompressor(args.input_file) is None:
+		print("No external decompressor found, the pipe backend is left out", file=sys.stderr)
+		backends.remove("pipe")
+
+	compressed_size = os.path.getsize(args.input_file)
+	work_dir = tempfile.mkdtemp(prefix="bench_decompression_")
+	try:
+		if "plain" in backends:
+			plain_file = os.path.join(work_dir, "plain")
+			with open_decompressed(args.input_file, "gzip") as inF, open(plain_file, "wb") as outF:
+				shutil.copyfileobj(inF, outF, PIPELINE_BLOCK_SIZE)
+
+		print("backend\tlines s\tlines MB/s\tblocks s\tblocks MB/s\tcompressed MB/s\tlines")
+		for backend in backends:
+			input_file = plain_file if backend == "plain" else args.input_file
+			lines_time, lines = best_time(lambda: read_lines(input_file, backend), args.repeat)
+			blocks_time, size = best_time(lambda: read_blocks(input_file, backend), args.repeat)
+			print("{}\t{:.2f}\t{:.0f}\t{:.2f}\t{:.0f}\t{:.1f}\t{}".format(
+				backend, lines_time, size / 1e6 / lines_time, blocks_time, size / 1e6 / blocks_time,
+				compressed_size / 1e6 / lines_time, lines))
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+	print("auto picks {} for this file on this machine".format(select_backend(args.input_file)), file=sys.stderr)
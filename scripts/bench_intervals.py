@@ -0,0 +1,98 @@
+# ------------------------------------------------------------------------------
+# bench_intervals.py
+# Regions per second of the interval engine, against one R*Tree query per region
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# The regions are random ones, spread over the chromosomes by their
+# length, like the targets of a panel or an exome. The engine answers
+# all of them in one batch, while the R*Tree coordinate indexes of the
+# database answer a sample of them one SQL query at a time, as the
+# batch would otherwise be run. The overlaps of the sample are checked
+# to be the same with both
+
+import sys
+import argparse
+import random
+import sqlite3
+import time
+
+from chromosome_lengths import CHROMOSOME_LENGTHS
+from column_snapshot import VariantSnapshot
+from coord_index import query_coord_index
+from interval_engine import IntervalEngine
+
+def random_regions(count, size, assembly, seed):
+	"""
+		Regions of a given size, as (chromosome, start, stop) tuples,
+		falling on each chromosome as often as its length says
+	"""
+	rng = random.Random(seed)
+	lengths = CHROMOSOME_LENGTHS[assembly]
+	weights = [ length  for chro, length in lengths ]
+	regions = []
+	for chro, length in rng.choices(lengths, weights, k=count):
+		start = rng.randint(1, max(length - size + 1, 1))
+		regions.append((chro, start, start + size - 1))
+	return regions
+
+def best_time(function, repeat):
+	"""
+		Fastest of repeat runs, and the result of the last one
+	"""
+	best = None
+	for _ in range(repeat):
+		started = time.perf_counter()
+		result = function()
+		elapsed = time.perf_counter() - started
+		if best is None or elapsed < best:
+			best = elapsed
+	return best, result
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmarks batch region overlaps with the interval engine against the R*Tree indexes")
+	parser.add_argument("snapshot_dir", help="snapshot written by column_snapshot.py or by the loaders")
+	parser.add_argument("db_file", metavar="database_file", nargs="?", help="database of the snapshot, whose R*Tree indexes are measured too")
+	parser.add_argument("--regions", type=int, default=20000, help="regions of the batch (default: %(default)s)")
+	parser.add_argument("--region-size", type=int, default=1000, help="bases of every region (default: %(default)s)")
+	parser.add_argument("--rtree-regions", type=int, default=1000, help="regions of the batch queried through the R*Tree indexes (default: %(default)s)")
+	parser.add_argument("--assembly", default="GRCh38", choices=sorted(CHROMOSOME_LENGTHS), help="assembly of the regions (default: %(default)s)")
+	parser.add_argument("--seed", type=int, default=1, help="random seed of the regions (default: %(default)s)")
+	parser.add_argument("--repeat", type=int, default=3, help="runs of each measure, keeping the fastest (default: %(default)s)")
+	args = parser.parse_args()
+
+	regions = random_regions(args.regions, args.region_size, args.assembly, args.seed)
+
+	started = time.perf_counter()
+	engine = IntervalEngine(VariantSnapshot(args.snapshot_dir))
+	print("{} loci loaded in {:.2f} s".format(engine.loci, time.perf_counter() - started), file=sys.stderr)
+
+	print("method\tregions\tseconds\tregions/s\toverlaps")
+	engine_time, pairs = best_time(lambda: list(engine.overlaps(args.assembly, regions)), args.repeat)
+	print("engine\t{}\t{:.3f}\t{:.0f}\t{}".format(len(regions), engine_time, len(regions) / engine_time, len(pairs)))
+
+	if args.db_file is not None:
+		sample = regions[:args.rtree_regions]
+		db = sqlite3.connect(args.db_file)
+		# The R*Tree indexes find the loci, and the engine the variants,
+		# which are the same thing for the single locus of the snapshot
+		def rtree_overlaps():
+			return [ (position, entry_id)  for position, (chro, start, stop) in enumerate(sample)
+				for entry_id, locus in query_coord_index(db, "variant", args.assembly, chro, start, stop) if locus == 0 ]
+		rtree_time, rtree_pairs = best_time(rtree_overlaps, args.repeat)
+		db.close()
+		print("rtree\t{}\t{:.3f}\t{:.0f}\t{}".format(len(sample), rtree_time, len(sample) / rtree_time, len(rtree_pairs)))
+
+		engine_pairs = sorted(engine.overlaps(args.assembly, sample))
+		if engine_pairs != sorted(rtree_pairs):
+			print("The engine and the R*Tree indexes disagree on the sample: {} and {} overlaps".format(len(engine_pairs), len(rtree_pairs)), file=sys.stderr)
+			sys.exit(1)
+		print("The engine and the R*Tree indexes agree on the {} regions of the sample".format(len(sample)), file=sys.stderr)
@@ -0,0 +1,187 @@
+# ------------------------------------------------------------------------------
+# bench_loaders.py
+# Throughput, memory and database size of the five loaders, against saved baselines
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Every loader runs in a fresh process, so its peak RSS is its own,
+# into a database of its own, so its size is too. The input files are
+# those of synthetic_data.py, either generated for the run or taken
+# from a directory. The figures can be saved as a baseline, and later
+# runs are compared against it, failing when a loader got slower or
+# bigger than the tolerance allows
+
+import sys
+import os
+import argparse
+import contextlib
+import gzip
+import importlib
+import json
+import multiprocessing
+import resource
+import shutil
+import tempfile
+import time
+
+from sqlite_tuning import LOAD_PROFILES, DEFAULT_LOAD_PROFILE
+from synthetic_data import RELEASE_FILES, generate_release
+
+# Benchmarked loaders, as (name, module, open function, store function,
+# input file kind, header lines of the input file)
+LOADER_BENCHMARKS = [
+	("clinvar", "clinvar_parser", "open_clinvar_db", "store_clinvar_file", "variant_summary", 1),
+	("reference", "clinvar_reference_parser", "open_clinvar_db", "store_clinvar_ref", "var_citations", 1),
+	("gene_stats", "clinvar_gene_stats_parser", "open_clinvar_db", "store_clinvar_stats", "gene_specific_summary", 2),
+	("civic_variant", "civic_parser", "open_civic_db", "store_civic_file", "civic_variants", 1),
+	("civic_evidence", "civic_evidence_parser", "open_civic_db", "store_civic_file", "civic_evidence", 1),
+]
+
+# Relative change tolerated before a figure counts as a regression
+DEFAULT_TOLERANCE = 0.15
+
+def count_data_rows(input_file, header_lines):
+	opener = gzip.open if input_file.endswith(".gz") else open
+	with opener(input_file, "rt", encoding="utf-8") as inF:
+		return sum(1 for _ in inF) - header_lines
+
+def _run_loader(queue, module_name, open_name, store_name, db_file, input_file, profile):
+	"""
+		Body of the benchmark process. The loaders report on stdout
+		and stderr, which are silenced
+	"""
+	try:
+		with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+			module = importlib.import_module(module_name)
+			db = getattr(module, open_name)(db_file, profile=profile)
+			start = time.perf_counter()
+			getattr(module, store_name)(db, input_file)
+			elapsed = time.perf_counter() - start
+			db.close()
+
+		# ru_maxrss is in KiB on Linux
+		queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, None))
+	except Exception as e:
+		queue.put((None, None, "{}: {}".format(type(e).__name__, e)))
+
+def run_benchmark(name, module_name, open_name, store_name, input_file, header_lines, work_dir, profile=DEFAULT_LOAD_PROFILE):
+	"""
+		Loads input_file into a new database with one of the loaders,
+		and returns its figures
+	"""
+	db_file = os.path.join(work_dir, "{}.db".format(name))
+	if os.path.exists(db_file):
+		os.unlink(db_file)
+
+	# A spawned process does not inherit the memory of this one
+	context = multiprocessing.get_context("spawn")
+	queue = context.Queue()
+	process = context.Process(target=_run_loader, args=(queue, module_name, open_name, store_name, db_file, input_file, profile))
+	process.start()
+	elapsed, peak_rss, error = queue.get()
+	process.join()
+	if error is not None:
+		raise RuntimeError("The {} loader failed: {}".format(name, error))
+
+	rows = count_data_rows(input_file, header_lines)
+	return {
+		"rows": rows,
+		"seconds": elapsed,
+		"rows_per_second": rows / elapsed if elapsed > 0 else 0.0,
+		"peak_rss_mb": peak_rss / 1e6,
+		"db_mb": os.path.getsize(db_file) / 1e6,
+	}
+
+def regressions(results, baseline, tolerance):
+	"""
+		Figures worse than the baseline beyond the tolerance, as
+		(loader, figure, baseline value, value) tuples
+	"""
+	found = []
+	for name, figures in results.items():
+		base = baseline.get(name)
+		if base is None:
+			continue
+		if figures["rows_per_second"] < base["rows_per_second"] * (1 - tolerance):
+			found.append((name, "rows_per_second", base["rows_per_second"], figures["rows_per_second"]))
+		for figure in ("peak_rss_mb", "db_mb"):
+			if figures[figure] > base[figure] * (1 + tolerance):
+				found.append((name, figure, base[figure], figures[figure]))
+
+	return found
+
+def print_results(results, baseline={}, file=sys.stdout):
+	print("loader\trows\tseconds\trows/s\tpeak RSS MB\tDB MB\trows/s vs baseline", file=file)
+	for name, figures in results.items():
+		base = baseline.get(name)
+		change = "{:+.1%}".format(figures["rows_per_second"] / base["rows_per_second"] - 1) if base is not None else "-"
+		print("{}\t{}\t{:.2f}\t{:.0f}\t{:.1f}\t{:.1f}\t{}".format(
+			name, figures["rows"], figures["seconds"], figures["rows_per_second"],
+			figures["peak_rss_mb"], figures["db_mb"], change), file=file)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmarks the loaders over synthetic release files")
+	parser.add_argument("--data-dir", help="directory with the files written by synthetic_data.py, instead of generating them")
+	parser.add_argument("--alleles", type=int, default=100000, help="ClinVar alleles of the generated files (default: %(default)s)")
+	parser.add_argument("--civic-variants", type=int, default=3000, help="CIViC variants of the generated files (default: %(default)s)")
+	parser.add_argument("--seed", type=int, default=1, help="random seed of the generated files (default: %(default)s)")
+	parser.add_argument("--loader", action="append", choices=[ benchmark[0]  for benchmark in LOADER_BENCHMARKS ], help="loader to benchmark, can be repeated (default: all)")
+	parser.add_argument("--repeat", type=int, default=1, help="runs of each loader, keeping the fastest (default: %(default)s)")
+	parser.add_argument("--profile", choices=sorted(LOAD_PROFILES), default=DEFAULT_LOAD_PROFILE, help="PRAGMA profile used while loading (default: %(default)s)")
+	parser.add_argument("--save-baseline", metavar="BASELINE_FILE", help="save the figures of this run as a baseline")
+	parser.add_argument("--baseline", metavar="BASELINE_FILE", help="compare against a saved baseline, failing on regressions")
+	parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="relative change tolerated against the baseline (default: %(default)s)")
+	parser.add_argument("--keep-dir", help="directory where the generated files and the databases are kept, instead of a temporary one")
+	args = parser.parse_args()
+
+	work_dir = args.keep_dir if args.keep_dir is not None else tempfile.mkdtemp(prefix="bench_loaders_")
+	os.makedirs(work_dir, exist_ok=True)
+
+	# The settings which make two runs comparable
+	settings = { "profile": args.profile }
+	try:
+		if args.data_dir is not None:
+			paths = { kind: os.path.join(args.data_dir, name)  for kind, name in RELEASE_FILES.items() }
+			settings["data_dir"] = os.path.abspath(args.data_dir)
+		else:
+			paths = generate_release(work_dir, args.alleles, args.civic_variants, seed=args.seed)
+			settings.update({ "alleles": args.alleles, "civic_variants": args.civic_variants, "seed": args.seed })
+
+		results = {}
+		for name, module_name, open_name, store_name, kind, header_lines in LOADER_BENCHMARKS:
+			if args.loader and name not in args.loader:
+				continue
+			# The fastest of the runs, as the slower ones measure the noise
+			runs = [ run_benchmark(name, module_name, open_name, store_name, paths[kind], header_lines, work_dir, profile=args.profile)  for _ in range(args.repeat) ]
+			results[name] = min(runs, key=lambda figures: figures["seconds"])
+	finally:
+		if args.keep_dir is None:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+	baseline = {}
+	if args.baseline is not None:
+		with open(args.baseline, "r", encoding="utf-8") as baseF:
+			saved = json.load(baseF)
+		if saved["settings"] != settings:
+			print("The baseline was taken with other settings: {}".format(saved["settings"]), file=sys.stderr)
+		baseline = saved["results"]
+
+	print_results(results, baseline)
+
+	if args.save_baseline is not None:
+		with open(args.save_baseline, "w", encoding="utf-8") as baseF:
+			json.dump({ "settings": settings, "results": results }, baseF, indent=1)
+
+	found = regressions(results, baseline, args.tolerance)
+	for name, figure, before, after in found:
+		print("Regression: {} {} went from {:.1f} to {:.1f}".format(name, figure, before, after), file=sys.stderr)
+	if found:
+		sys.exit(1)
@@ -0,0 +1,163 @@
+# ------------------------------------------------------------------------------
+# bench_text_store.py
+# Bytes saved by the text store, and its effect on the phenotype queries
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# The phenotype queries are run twice: against a plain copy of the
+# variant table, with the text inline as it used to be, and against
+# the deduplicated tables, matching each distinct text only once.
+# The sqlite3 module does not expose the page cache counters, so the
+# misses are measured as the bytes the process reads from the file,
+# with memory mapping off, and divided by the page size
+
+import sys
+import os
+import argparse
+import sqlite3
+import tempfile
+import time
+
+from clinvar_parser import CLINVAR_TEXT_REFERENCES
+from text_store import saved_bytes
+
+# Filters of the phenotype queries in MEMORIA.md
+PHENOTYPE_PATTERNS = [
+	"%breast%cancer%",
+	"%glioblastoma%",
+	"%infantile%liver%mtDNA%",
+]
+
+PLAIN_QUERY = "SELECT COUNT(*) FROM plain_variant WHERE phenotype_list LIKE ?"
+
+# Each distinct stored text is matched once, and the variants are
+# found by its text_id. Short texts are matched inline
+DEDUP_QUERY = """
+	SELECT COUNT(*) FROM variant_coded
+	WHERE phenotype_list_text_id IN (SELECT text_id FROM text_store WHERE content LIKE ?1)
+	OR phenotype_list_inline LIKE ?1
+"""
+
+def read_bytes():
+	"""
+		Bytes this process has read through read() calls, or None
+		where /proc is not available
+	"""
+	try:
+		with open("/proc/self/io") as io:
+			for line in io:
+				if line.startswith("rchar:"):
+					return int(line.split()[1])
+	except OSError:
+		pass
+
+	return None
+
+def connect(db_file, cache_pages):
+	db = sqlite3.connect(db_file)
+	db.execute("PRAGMA mmap_size = 0")
+	db.execute("PRAGMA cache_size = {}".format(cache_pages))
+
+	return db
+
+def table_pages(db, names):
+	"""
+		Pages used by the named tables and their indexes, or None
+		when SQLite was built without dbstat
+	"""
+	try:
+		placeholders = ",".join("?" * len(names))
+		return db.execute("SELECT COUNT(*) FROM dbstat WHERE name IN ({0}) OR name IN (SELECT name FROM sqlite_master WHERE tbl_name IN ({0}) AND type = 'index')".format(placeholders), names + names).fetchone()[0]
+	except sqlite3.OperationalError:
+		return None
+
+def run_query(db, query, pattern, page_size):
+	"""
+		Runs a query, and returns its result, its wall time and the
+		pages it had to read from the file
+	"""
+	before = read_bytes()
+	start = time.perf_counter()
+	result = db.execute(query, (pattern,)).fetchone()[0]
+	elapsed = time.perf_counter() - start
+	after = read_bytes()
+
+	misses = (after - before) // page_size if before is not None else None
+	return result, elapsed, misses
+
+def measure(db_file, query, cache_pages, page_size):
+	"""
+		Runs all the patterns twice on the same connection. The first
+		pass starts from an empty cache, and the second one shows how
+		much of the scanned pages stayed in it. Returns, per pass,
+		the results, the wall time and the pages read from the file
+	"""
+	db = connect(db_file, cache_pages)
+	passes = []
+	for _ in range(2):
+		results = []
+		elapsed = 0.0
+		misses = 0
+		for pattern in PHENOTYPE_PATTERNS:
+			result, queryElapsed, queryMisses = run_query(db, query, pattern, page_size)
+			results.append(result)
+			elapsed += queryElapsed
+			misses = None if misses is None or queryMisses is None else misses + queryMisses
+		passes.append((results, elapsed, misses))
+	db.close()
+
+	return passes
+
+def format_pages(pages):
+	return "n/a" if pages is None else str(pages)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Reports the space saved by the text store and its effect on the phenotype queries")
+	parser.add_argument("db_file", metavar="database_file", help="database loaded by clinvar_parser.py")
+	parser.add_argument("--cache-pages", type=int, default=2000, help="SQLite page cache size for the queries, in pages (default: %(default)s)")
+	args = parser.parse_args()
+
+	db = sqlite3.connect(args.db_file)
+	page_size = db.execute("PRAGMA page_size").fetchone()[0]
+
+	# Text the plain columns would hold, against what the store holds.
+	# Inline texts are the same either way, so they are left out
+	referenced = 0
+	for table, column in CLINVAR_TEXT_REFERENCES:
+		referenced += db.execute("SELECT TOTAL(LENGTH(CAST(t.content AS BLOB))) FROM {} x JOIN text_store t ON t.text_id = x.{}".format(table, column)).fetchone()[0]
+	stored, distinct = db.execute("SELECT TOTAL(LENGTH(CAST(content AS BLOB))), COUNT(*) FROM text_store").fetchone()
+	print("text referenced: {:.1f} MB, stored: {:.1f} MB in {} distinct texts, saved: {:.1f} MB".format(
+		referenced / 1e6, stored / 1e6, distinct, saved_bytes(referenced, stored, distinct) / 1e6))
+
+	# Plain copy of the variants, with the text inline
+	plainFile = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+	plainFile.close()
+	try:
+		db.execute("ATTACH DATABASE ? AS plain", (plainFile.name,))
+		db.execute("CREATE TABLE plain.plain_variant AS SELECT * FROM variant")
+		db.commit()
+		db.execute("DETACH DATABASE plain")
+
+		plain = sqlite3.connect(plainFile.name)
+		plainPages = table_pages(plain, ["plain_variant"])
+		plain.close()
+		dedupPages = table_pages(db, ["variant_coded", "text_store"])
+		db.close()
+
+		print("pages scanned: plain {}, deduplicated {}, page cache {}".format(
+			format_pages(plainPages), format_pages(dedupPages), args.cache_pages))
+
+		for label, db_file, query in [("plain", plainFile.name, PLAIN_QUERY), ("dedup", args.db_file, DEDUP_QUERY)]:
+			(results, coldElapsed, coldMisses), (_, warmElapsed, warmMisses) = measure(db_file, query, args.cache_pages, page_size)
+			print("{}: rows {}, first pass {:.1f} ms and {} pages read, second pass {:.1f} ms and {} pages read".format(
+				label, results, coldElapsed * 1000, format_pages(coldMisses), warmElapsed * 1000, format_pages(warmMisses)))
+	finally:
+		os.unlink(plainFile.name)
@@ -0,0 +1,89 @@
+# ------------------------------------------------------------------------------
+# bench_tsv_reader.py
+# Micro-benchmark of the per-row decoding cost of the loaders
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+import gzip
+import itertools
+import re
+import time
+
+from tsv_reader import CLINVAR_NULLS, header_columns, column_index, compile_row_decoder
+from clinvar_parser import CLINVAR_COLUMNS
+
+def legacy_decode(lines, headerMapping):
+	"""
+		The decoding loop the loaders used before tsv_reader: a
+		regular expression split, a null substitution over every
+		column and a dictionary lookup per extracted value
+	"""
+	names = [ name for name, converter in CLINVAR_COLUMNS ]
+	for line in lines:
+		wline = line.rstrip("\n")
+		columnValues = re.split(r"\t",wline)
+		for iCol, vCol in enumerate(columnValues):
+			if len(vCol) == 0 or vCol == "-":
+				columnValues[iCol] = None
+		row = []
+		for name in names:
+			if isinstance(name, tuple):
+				row.append(columnValues[column_index(headerMapping, name)])
+			else:
+				row.append(columnValues[headerMapping[name]])
+		# The two conversions the loaders did by hand
+		row[0] = int(row[0])
+		row[15] = int(row[15])
+
+def compiled_decode(lines, decode_row):
+	for line in lines:
+		decode_row(line)
+
+def time_per_row(func, lines, *args, repeat=3):
+	"""
+		Best wall time per row, in microseconds, of several runs
+	"""
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func(lines, *args)
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+
+	return best * 1e6 / len(lines)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Compares the per-row cost of the legacy and the compiled row decoders")
+	parser.add_argument("clinvar_file", metavar="compressed_clinvar_file", help="gzipped variant_summary file")
+	parser.add_argument("--rows", type=int, default=200000, help="data rows read from the file (default: %(default)s)")
+	args = parser.parse_args()
+
+	with gzip.open(args.clinvar_file,"rt",encoding="utf-8") as cf:
+		columnNames = header_columns(next(cf))
+		lines = list(itertools.islice(cf, args.rows))
+
+	if len(lines) == 0:
+		print("No data rows in {}".format(args.clinvar_file), file=sys.stderr)
+		sys.exit(1)
+
+	headerMapping = { columnName: columnId for columnId, columnName in enumerate(columnNames) }
+	decode_row = compile_row_decoder(columnNames, CLINVAR_COLUMNS, CLINVAR_NULLS)
+
+	legacy = time_per_row(legacy_decode, lines, headerMapping)
+	compiled = time_per_row(compiled_decode, lines, decode_row)
+
+	print("rows decoded: {}".format(len(lines)))
+	print("legacy:   {:.2f} us/row".format(legacy))
+	print("compiled: {:.2f} us/row".format(compiled))
+	print("speedup:  {:.1f}x".format(legacy / compiled))
@@ -0,0 +1,516 @@
+# ------------------------------------------------------------------------------
+# canonical_queries.py
+# The ten analysis queries of MEMORIA.md, run against one or more release databases
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Each query is declared once, with named parameters and their default
+# values, and only runs against the databases holding the tables of its
+# source. The counting ones read the aggregate tables of the ClinVar
+# loader, the gene ones its gene2variant links, which CROSS JOIN keeps
+# as the first table whatever the planner statistics, and the citation
+# one the variant_reference links of the reference loader. The text
+# ones first ask the full-text index of the loaders for the rows
+# holding every fragment of their LIKE pattern, as word prefixes, and
+# only check the LIKE itself on those, instead of scanning the table.
+# A fragment starting in the middle of a word escapes the full-text
+# index, so those rewritten queries keep a baseline, a plain scan
+# giving the same answer, which --check-baseline runs next to them to
+# prove they still do. Genes are matched within the ';' separated
+# symbols of a variant, as gene2variant splits them. Results are
+# cached on disk, keyed by the query, its parameters and a fingerprint
+# of the database, so a release which was not loaded again answers
+# without touching it. The sqlite3 module does not expose the scan
+# counters of a statement, so the work done by a query is measured in
+# virtual machine steps, counted with a progress handler
+
+import sys
+import os
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+
+from load_checkpoint import database_fingerprint
+from chromosome_lengths import chromosome_lengths_cte
+
+# Tables telling which loader filled a database, by query source
+QUERY_SOURCES = {
+	"clinvar": ["variant_hash", "variant_fts"],
+	"clinvar_reference": ["variant_hash", "variant_fts", "variant_reference"],
+	"civic": ["hgvs_expressions"],
+	"civic_evidence": ["hgvs_expressions", "evidence", "evidence_fts"],
+}
+
+# Chromosome lengths of both assemblies, used by query 10
+CHROMOSOME_LENGTHS_CTE = chromosome_lengths_cte()
+
+def like_match(column, param):
+	"""
+		FTS5 query, as an SQL expression, finding in column the rows
+		holding every fragment of the LIKE pattern in param as the
+		start of a word. '%breast%cancer%' becomes
+		'column : ("breast"* AND "cancer"*)'
+	"""
+	return """'{0} : ("' || replace(trim({1}, '%'), '%', '"* AND "') || '"*)'""".format(column, param)
+
+# Queries, as (name, source, description, SQL, default parameters)
+CANONICAL_QUERIES = [
+	("1-clinvar", "clinvar", "Variants of a gene in an assembly", """
+		SELECT gene_symbol, assembly, SUM(variants) AS count
+		FROM gene_type_counts
+		WHERE gene_symbol = :gene
+		AND assembly = :assembly
+		GROUP BY gene_symbol, assembly
+	""", { "gene": "TP53", "assembly": "GRCh38" }),
+	("1-civic", "civic", "Variants of a gene in an assembly", """
+		SELECT gene_symbol, ref_build, COUNT(*) AS count
+		FROM variant
+		WHERE gene_symbol = :gene
+		AND ref_build = :assembly
+		GROUP BY gene_symbol, ref_build
+	""", { "gene": "TP53", "assembly": "GRCh38" }),
+	("2-clinvar", "clinvar", "Single nucleotide changes of a base into two others", """
+		SELECT type, ref_allele, alt_allele, assembly, variants AS count
+		FROM snv_allele_counts
+		WHERE assembly = :assembly
+		AND type = 'single nucleotide variant'
+		AND ref_allele = :ref
+		AND alt_allele IN (:alt, :other_alt)
+		ORDER BY count DESC
+	""", { "assembly": "GRCh37", "ref": "G", "alt": "A", "other_alt": "T" }),
+	("2-civic", "civic", "Single nucleotide changes of a base into two others", """
+		SELECT ref_bases, var_bases, ref_build, COUNT(*) AS count
+		FROM variant
+		WHERE ref_build = :assembly
+		AND ref_bases = :ref
+		AND var_bases IN (:alt, :other_alt)
+		GROUP BY ref_bases, var_bases, ref_build
+		ORDER BY count DESC
+	""", { "assembly": "GRCh37", "ref": "G", "alt": "A", "other_alt": "T" }),
+	("3-clinvar", "clinvar", "Genes with the most insertions and deletions", """
+		SELECT gene_symbol, assembly, SUM(variants) AS count
+		FROM gene_type_counts
+		WHERE assembly = :assembly
+		AND type IN ('Insertion', 'Deletion')
+		GROUP BY gene_symbol, assembly
+		ORDER BY count DESC, gene_symbol
+		LIMIT :top
+	""", { "assembly": "GRCh37", "top": 3 }),
+	("4-clinvar", "clinvar", "Most common deletion of a phenotype", """
+		SELECT v.gene_symbol, v.ref_allele, v.alt_allele, v.assembly, COUNT(*) AS count
+		FROM variant_fts
+		CROSS JOIN variant v ON v.ventry_id = variant_fts.rowid
+		WHERE variant_fts MATCH """ + like_match("phenotype_list", ":phenotype") + """
+		AND v.phenotype_list LIKE :phenotype
+		AND v.type = 'Deletion'
+		GROUP BY v.gene_symbol, v.ref_allele, v.alt_allele, v.assembly
+		ORDER BY count DESC, v.gene_symbol, v.ref_allele, v.alt_allele, v.assembly
+		LIMIT 1
+	""", { "phenotype": "%breast%cancer%" }),
+	("4-civic", "civic_evidence", "Most common deletion of a disease", """
+		SELECT e.gene_symbol, e.disease, v.ref_bases, v.var_bases, v.ref_build, COUNT(*) AS count
+		FROM evidence_fts
+		CROSS JOIN evidence e ON e.evidence_id = evidence_fts.rowid
+		JOIN variant v ON v.variant_id = e.variant_id
+		WHERE evidence_fts MATCH """ + like_match("disease", ":disease") + """
+		AND e.disease LIKE :disease
+		AND v.ref_bases IS NOT NULL
+		AND v.var_bases IS NULL
+		GROUP BY e.gene_symbol, e.disease, v.ref_bases, v.var_bases, v.ref_build
+		ORDER BY count DESC, e.gene_symbol, e.disease, v.ref_bases, v.ref_build
+		LIMIT 1
+	""", { "disease": "%breast%" }),
+	("5-clinvar", "clinvar", "Coordinates of the variants of a phenotype", """
+		SELECT DISTINCT v.gene_id, v.gene_symbol, v.chro, v.chro_start, v.chro_stop, v.assembly
+		FROM variant_fts
+		CROSS JOIN variant v ON v.ventry_id = variant_fts.rowid
+		WHERE variant_fts MATCH """ + like_match("phenotype_list", ":phenotype") + """
+		AND v.phenotype_list LIKE :phenotype
+		AND v.assembly = :assembly
+	""", { "phenotype": "%infantile%liver%mtDNA%", "assembly": "GRCh38" }),
+	("6-clinvar", "clinvar", "Pathogenic variants of a gene", """
+		SELECT DISTINCT g.gene_symbol, v.chro, v.chro_start, v.chro_stop, v.ref_allele, v.alt_allele, v.assembly, s.significance
+		FROM gene2variant g
+		CROSS JOIN variant v ON v.ventry_id = g.ventry_id
+		JOIN clinical_sig s ON s.ventry_id = v.ventry_id
+		WHERE g.gene_symbol = :gene
+		AND v.assembly = :assembly
+		AND s.significance IN ('Pathogenic', 'Likely pathogenic')
+		ORDER BY s.significance, v.chro_start
+	""", { "gene": "HBB", "assembly": "GRCh37" }),
+	("7-clinvar", "clinvar", "Variants within a chromosome range", """
+		SELECT chro, assembly, COUNT(*) AS count
+		FROM variant
+		WHERE assembly = :assembly
+		AND chro = :chro
+		AND chro_start > :start
+		AND chro_stop < :stop
+		GROUP BY chro, assembly
+	""", { "assembly": "GRCh38", "chro": "13", "start": 10000000, "stop": 20000000 }),
+	("7-civic", "civic", "Variants within a chromosome range", """
+		SELECT :chro AS chro, ref_build, COUNT(*) AS count
+		FROM variant
+		WHERE ref_build = :assembly
+		AND ((chr_1 = :chro AND chr_start > :start AND chr_stop < :stop)
+		OR (chr_2 = :chro AND chr_2_start > :start AND chr_2_stop < :stop))
+		GROUP BY ref_build
+	""", { "assembly": "GRCh38", "chro": "13", "start": 10000000, "stop": 20000000 }),
+	("8-clinvar", "clinvar", "Variants of a gene with a certain significance", """
+		SELECT g.gene_symbol, v.assembly, COUNT(DISTINCT v.ventry_id) AS count
+		FROM gene2variant g
+		CROSS JOIN variant v ON v.ventry_id = g.ventry_id
+		JOIN clinical_sig s ON s.ventry_id = v.ventry_id
+		WHERE g.gene_symbol = :gene
+		AND v.assembly = :assembly
+		AND s.significance NOT LIKE :excluded
+		GROUP BY g.gene_symbol, v.assembly
+	""", { "gene": "BRCA2", "assembly": "GRCh37", "excluded": "%uncertain%" }),
+	("9-clinvar", "clinvar_reference", "Citations of the variants of a phenotype", """
+		SELECT DISTINCT v.variation_id, r.citation_source, r.citation_id
+		FROM variant_fts
+		CROSS JOIN variant v ON v.ventry_id = variant_fts.rowid
+		JOIN variant_reference vr ON vr.ventry_id = v.ventry_id
+		JOIN reference r ON r.ventry_id = vr.reference_id
+		WHERE variant_fts MATCH """ + like_match("phenotype_list", ":phenotype") + """
+		AND v.assembly = :assembly
+		AND v.phenotype_list LIKE :phenotype
+		ORDER BY v.variation_id, r.citation_source, r.citation_id
+	""", { "assembly": "GRCh38", "phenotype": "%glioblastoma%" }),
+	("10-clinvar", "clinvar", "Variant frequency of every chromosome, 1, 22 and X among them", """
+		WITH """ + CHROMOSOME_LENGTHS_CTE + """
+		SELECT c.chro, c.assembly, c.variants AS count, l.length AS chr_length, c.variants / l.length * 100 AS mut_frequency
+		FROM chro_counts c
+		JOIN chromosome_length l ON l.assembly = c.assembly AND l.chro = c.chro
+		ORDER BY mut_frequency DESC
+	""", {}),
+	("10-civic", "civic", "Variant frequency of every chromosome, 1, 22 and X among them", """
+		WITH """ + CHROMOSOME_LENGTHS_CTE + """
+		SELECT v.chr_1, v.ref_build, COUNT(*) AS count, l.length AS chr_length, COUNT(*) / l.length * 100 AS mut_frequency
+		FROM variant v
+		JOIN chromosome_length l ON l.assembly = v.ref_build AND l.chro = v.chr_1
+		GROUP BY v.chr_1, v.ref_build
+		ORDER BY mut_frequency DESC
+	""", {}),
+]
+
+# Plain scans answering the same as the queries reading the aggregate
+# tables, gene2variant or the full-text indexes, by query name. They
+# take the same parameters
+BASELINE_QUERIES = {
+	"1-clinvar": """
+		SELECT :gene AS gene_symbol, assembly, COUNT(*) AS count
+		FROM variant
+		WHERE instr(';' || gene_symbol || ';', ';' || :gene || ';') > 0
+		AND assembly = :assembly
+		GROUP BY assembly
+	""",
+	"2-clinvar": """
+		SELECT type, ref_allele, alt_allele, assembly, COUNT(*) AS count
+		FROM variant
+		WHERE assembly = :assembly
+		AND type = 'single nucleotide variant'
+		AND ref_allele = :ref
+		AND alt_allele IN (:alt, :other_alt)
+		GROUP BY type, ref_allele, alt_allele, assembly
+		ORDER BY count DESC
+	""",
+	"3-clinvar": """
+		WITH RECURSIVE variant_gene(ventry_id, gene_symbol, rest) AS (
+			SELECT ventry_id, '', gene_symbol || ';'
+			FROM variant
+			WHERE assembly = :assembly
+			AND type IN ('Insertion', 'Deletion')
+			UNION ALL
+			SELECT ventry_id, substr(rest, 1, instr(rest, ';') - 1), substr(rest, instr(rest, ';') + 1)
+			FROM variant_gene
+			WHERE rest <> ''
+		)
+		SELECT gene_symbol, :assembly AS assembly, COUNT(DISTINCT ventry_id) AS count
+		FROM variant_gene
+		WHERE gene_symbol <> ''
+		GROUP BY gene_symbol
+		ORDER BY count DESC, gene_symbol
+		LIMIT :top
+	""",
+	"4-clinvar": """
+		SELECT gene_symbol, ref_allele, alt_allele, assembly, COUNT(*) AS count
+		FROM variant
+		WHERE phenotype_list LIKE :phenotype
+		AND type = 'Deletion'
+		GROUP BY gene_symbol, ref_allele, alt_allele, assembly
+		ORDER BY count DESC, gene_symbol, ref_allele, alt_allele, assembly
+		LIMIT 1
+	""",
+	"4-civic": """
+		SELECT e.gene_symbol, e.disease, v.ref_bases, v.var_bases, v.ref_build, COUNT(*) AS count
+		FROM evidence e
+		JOIN variant v ON v.variant_id = e.variant_id
+		WHERE e.disease LIKE :disease
+		AND v.ref_bases IS NOT NULL
+		AND v.var_bases IS NULL
+		GROUP BY e.gene_symbol, e.disease, v.ref_bases, v.var_bases, v.ref_build
+		ORDER BY count DESC, e.gene_symbol, e.disease, v.ref_bases, v.ref_build
+		LIMIT 1
+	""",
+	"5-clinvar": """
+		SELECT DISTINCT gene_id, gene_symbol, chro, chro_start, chro_stop, assembly
+		FROM variant
+		WHERE phenotype_list LIKE :phenotype
+		AND assembly = :assembly
+	""",
+	"6-clinvar": """
+		SELECT DISTINCT :gene AS gene_symbol, v.chro, v.chro_start, v.chro_stop, v.ref_allele, v.alt_allele, v.assembly, s.significance
+		FROM variant v
+		JOIN clinical_sig s ON s.ventry_id = v.ventry_id
+		WHERE instr(';' || v.gene_symbol || ';', ';' || :gene || ';') > 0
+		AND v.assembly = :assembly
+		AND s.significance IN ('Pathogenic', 'Likely pathogenic')
+	""",
+	"8-clinvar": """
+		SELECT :gene AS gene_symbol, v.assembly, COUNT(DISTINCT v.ventry_id) AS count
+		FROM variant v
+		JOIN clinical_sig s ON s.ventry_id = v.ventry_id
+		WHERE instr(';' || v.gene_symbol || ';', ';' || :gene || ';') > 0
+		AND v.assembly = :assembly
+		AND s.significance NOT LIKE :excluded
+		GROUP BY v.assembly
+	""",
+	"9-clinvar": """
+		SELECT DISTINCT v.variation_id, r.citation_source, r.citation_id
+		FROM variant v
+		JOIN variant_reference vr ON vr.ventry_id = v.ventry_id
+		JOIN reference r ON r.ventry_id = vr.reference_id
+		WHERE v.assembly = :assembly
+		AND v.phenotype_list LIKE :phenotype
+	""",
+	"10-clinvar": """
+		WITH """ + CHROMOSOME_LENGTHS_CTE + """
+		SELECT v.chro, v.assembly, COUNT(*) AS count, l.length AS chr_length, COUNT(*) / l.length * 100 AS mut_frequency
+		FROM variant v
+		JOIN chromosome_length l ON l.assembly = v.assembly AND l.chro = v.chro
+		GROUP BY v.chro, v.assembly
+	""",
+}
+
+# Virtual machine steps between two calls of the progress handler
+PROGRESS_STEPS = 100
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "canonical_queries")
+
+def select_queries(names):
+	"""
+		Queries matching the given names, or their numbers, in the
+		order they are declared. No names means all of them
+	"""
+	if not names:
+		return list(CANONICAL_QUERIES)
+
+	selected = [ query  for query in CANONICAL_QUERIES  if query[0] in names or query[0].split("-")[0] in names ]
+	known = { query[0]  for query in CANONICAL_QUERIES } | { query[0].split("-")[0]  for query in CANONICAL_QUERIES }
+	unknown = [ name  for name in names  if name not in known ]
+	if unknown:
+		raise ValueError("Unknown queries: {}".format(", ".join(unknown)))
+
+	return selected
+
+def database_sources(db):
+	"""
+		Query sources whose tables are in the database
+	"""
+	cur = db.cursor()
+	try:
+		cur.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
+		names = { row[0]  for row in cur }
+	finally:
+		cur.close()
+
+	return { source  for source, tables in QUERY_SOURCES.items()  if all(table in names for table in tables) }
+
+def change_counter(db_file):
+	"""
+		File change counter of the SQLite header, bumped by every
+		commit, which covers the writers not keeping checkpoints
+	"""
+	with open(db_file, "rb") as dbF:
+		header = dbF.read(28)
+
+	return int.from_bytes(header[24:28], "big") if len(header) == 28 else 0
+
+def cache_key(sql, params, fingerprint):
+	digest = hashlib.blake2b(digest_size=16)
+	digest.update(sql.encode("utf-8"))
+	digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+	digest.update(fingerprint.encode("utf-8"))
+
+	return digest.hexdigest()
+
+def run_query(db, sql, params):
+	"""
+		Runs a query, and returns its columns, its rows, its wall
+		time and the virtual machine steps it took, roughly
+	"""
+	steps = [0]
+	def count_steps():
+		steps[0] += PROGRESS_STEPS
+		return 0
+
+	db.set_progress_handler(count_steps, PROGRESS_STEPS)
+	cur = db.cursor()
+	try:
+		start = time.perf_counter()
+		cur.execute(sql, params)
+		rows = cur.fetchall()
+		elapsed = time.perf_counter() - start
+		columns = [ description[0]  for description in cur.description ]
+	finally:
+		cur.close()
+		db.set_progress_handler(None, 0)
+
+	return columns, [ list(row)  for row in rows ], elapsed, steps[0]
+
+def query_database(db_file, queries, overrides={}, cache_dir=DEFAULT_CACHE_DIR, use_cache=True):
+	"""
+		Runs the queries of a database holding their tables, or takes
+		their results from the cache. Parameters in overrides replace
+		the defaults of any query using them. Returns a list of
+		(name, description, result, cached) tuples, where the result
+		is a dictionary with the columns, rows, elapsed time and steps
+	"""
+	if use_cache:
+		os.makedirs(cache_dir, exist_ok=True)
+
+	results = []
+	# Opened read only, so a missing file is not created
+	db = sqlite3.connect("file:{}?mode=ro".format(db_file), uri=True)
+	try:
+		sources = database_sources(db)
+		fingerprint = "{}:{}".format(database_fingerprint(db), change_counter(db_file))
+
+		for name, source, description, sql, defaults in queries:
+			if source not in sources:
+				continue
+			params = { key: overrides.get(key, value)  for key, value in defaults.items() }
+
+			cacheFile = os.path.join(cache_dir, cache_key(sql, params, fingerprint) + ".json")
+			cached = False
+			if use_cache and os.path.exists(cacheFile):
+				with open(cacheFile, "r", encoding="utf-8") as cacheF:
+					result = json.load(cacheF)
+				cached = True
+			else:
+				columns, rows, elapsed, steps = run_query(db, sql, params)
+				result = { "columns": columns, "rows": rows, "elapsed": elapsed, "steps": steps }
+				if use_cache:
+					with open(cacheFile, "w", encoding="utf-8") as cacheF:
+						json.dump(result, cacheF)
+
+			results.append((name, description, result, cached))
+	finally:
+		db.close()
+
+	return results
+
+def check_baselines(db_file, queries, overrides={}):
+	"""
+		Runs the queries having a baseline, along with it, against a
+		database holding their tables. Returns a list of (name, rows,
+		baseline rows) tuples, the rows being those of each one. Rows
+		are compared in any order, as ties may be listed either way
+	"""
+	checks = []
+	db = sqlite3.connect("file:{}?mode=ro".format(db_file), uri=True)
+	try:
+		sources = database_sources(db)
+		for name, source, description, sql, defaults in queries:
+			if source not in sources or name not in BASELINE_QUERIES:
+				continue
+			params = { key: overrides.get(key, value)  for key, value in defaults.items() }
+			rows = run_query(db, sql, params)[1]
+			baseline_rows = run_query(db, BASELINE_QUERIES[name], params)[1]
+			checks.append((name, sorted(rows, key=repr), sorted(baseline_rows, key=repr)))
+	finally:
+		db.close()
+
+	return checks
+
+def format_row(row):
+	return "\t".join("" if value is None else str(value) for value in row)
+
+def print_query_result(db_file, name, description, result, cached, file=sys.stdout):
+	print("# {} ({}) on {}: {} rows, {:.1f} ms, ~{} VM steps{}".format(
+		name, description, db_file, len(result["rows"]), result["elapsed"] * 1000, result["steps"],
+		", cached" if cached else ""), file=file)
+	print("\t".join(result["columns"]), file=file)
+	for row in result["rows"]:
+		print(format_row(row), file=file)
+
+def run_canonical_queries(db_files, queries, overrides={}, cache_dir=DEFAULT_CACHE_DIR, use_cache=True, file=sys.stdout):
+	"""
+		Runs the queries against every database holding their tables,
+		printing the results of each one with its wall time and steps
+	"""
+	for db_file in db_files:
+		for name, description, result, cached in query_database(db_file, queries, overrides, cache_dir, use_cache):
+			print_query_result(db_file, name, description, result, cached, file=file)
+
+def parse_param(text):
+	"""
+		name=value pairs from the command line. Integer values are
+		passed as such
+	"""
+	name, sep, value = text.partition("=")
+	if not sep:
+		raise argparse.ArgumentTypeError("expected name=value, got {}".format(text))
+	try:
+		value = int(value)
+	except ValueError:
+		pass
+
+	return name, value
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Runs the analysis queries of MEMORIA.md against release databases")
+	parser.add_argument("db_files", metavar="database_file", nargs="*", help="databases loaded by the ClinVar and CIViC loaders")
+	parser.add_argument("--query", action="append", default=[], help="query to run, by name or number, can be repeated (default: all)")
+	parser.add_argument("--param", action="append", type=parse_param, default=[], help="name=value replacing a default parameter, can be repeated")
+	parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="directory of the cached results (default: %(default)s)")
+	parser.add_argument("--no-cache", action="store_true", help="always run the queries, and do not store their results")
+	parser.add_argument("--list", action="store_true", help="list the queries and their parameters")
+	parser.add_argument("--check-baseline", action="store_true", help="check the queries having a baseline give the same rows as it, instead of printing them")
+	args = parser.parse_args()
+
+	if args.list:
+		for name, source, description, sql, defaults in CANONICAL_QUERIES:
+			print("{}\t{}\t{}\t{}".format(name, source, description, " ".join("{}={}".format(key, value) for key, value in defaults.items())))
+		sys.exit(0)
+
+	if not args.db_files:
+		parser.error("at least one database is needed")
+
+	try:
+		queries = select_queries(args.query)
+	except ValueError as e:
+		parser.error(str(e))
+
+	if args.check_baseline:
+		mismatches = 0
+		for db_file in args.db_files:
+			for name, rows, baseline_rows in check_baselines(db_file, queries, overrides=dict(args.param)):
+				matched = rows == baseline_rows
+				print("{} on {}: {} rows, {} baseline rows, {}".format(
+					name, db_file, len(rows), len(baseline_rows), "same" if matched else "DIFFERENT"), file=sys.stderr)
+				if not matched:
+					mismatches += 1
+		sys.exit(1 if mismatches > 0 else 0)
+
+	run_canonical_queries(args.db_files, queries, overrides=dict(args.param), cache_dir=args.cache_dir, use_cache=not args.no_cache)
@@ -0,0 +1,50 @@
+# ------------------------------------------------------------------------------
+# chromosome_lengths.py
+# Chromosome lengths of the GRCh37.p13 and GRCh38.p13 assemblies
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Lengths of the assembled chromosomes, as listed by the Genome
+# Reference Consortium at https://www.ncbi.nlm.nih.gov/grc/human/data,
+# named as ClinVar and CIViC name them. The mitochondrial genome of
+# both assemblies is the revised Cambridge Reference Sequence
+
+# Chromosome lengths by assembly, as (chromosome, length) pairs in
+# karyotype order
+CHROMOSOME_LENGTHS = {
+	"GRCh37": [
+		("1", 249250621), ("2", 243199373), ("3", 198022430), ("4", 191154276), ("5", 180915260),
+		("6", 171115067), ("7", 159138663), ("8", 146364022), ("9", 141213431), ("10", 135534747),
+		("11", 135006516), ("12", 133851895), ("13", 115169878), ("14", 107349540), ("15", 102531392),
+		("16", 90354753), ("17", 81195210), ("18", 78077248), ("19", 59128983), ("20", 63025520),
+		("21", 48129895), ("22", 51304566), ("X", 155270560), ("Y", 59373566), ("MT", 16569),
+	],
+	"GRCh38": [
+		("1", 248956422), ("2", 242193529), ("3", 198295559), ("4", 190214555), ("5", 181538259),
+		("6", 170805979), ("7", 159345973), ("8", 145138636), ("9", 138394717), ("10", 133797422),
+		("11", 135086622), ("12", 133275309), ("13", 114364328), ("14", 107043718), ("15", 101991189),
+		("16", 90338345), ("17", 83257441), ("18", 80373285), ("19", 58617616), ("20", 64444167),
+		("21", 46709983), ("22", 50818468), ("X", 156040895), ("Y", 57227415), ("MT", 16569),
+	],
+}
+
+def chromosome_lengths_cte(name="chromosome_length"):
+	"""
+		Common table expression of the lengths, with (assembly, chro,
+		length) columns, so the queries can join them in any database.
+		The lengths are REAL, so the frequencies are not truncated
+	"""
+	values = ",\n".join(
+		"\t\t('{}', '{}', {:.1f})".format(assembly, chro, length)
+		for assembly, lengths in CHROMOSOME_LENGTHS.items()
+		for chro, length in lengths
+	)
+	return "\n\t{}(assembly, chro, length) AS (VALUES\n{}\n\t)\n".format(name, values)
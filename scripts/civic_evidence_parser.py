@@ -13,12 +13,20 @@
 # -*- coding: utf-8 -*-
 
 import sys, os
+import argparse
 import sqlite3
-import re
+
+from sqlite_tuning import LOAD_PROFILES, DEFAULT_LOAD_PROFILE, apply_load_profile, restore_read_profile
+from sqlite_tuning import estimate_incoming_rows, should_rebuild_indexes
+from fts_index import create_fts_tables, drop_fts_triggers, sync_fts
+from text_store import TextStore, create_text_store, print_text_store_report
+from load_checkpoint import DEFAULT_CHECKPOINT_ROWS, start_checkpoint, save_checkpoint
+from load_stats import LoadStats, NULL_LOAD_STATS, open_text_input
+from tsv_reader import TEXT, INT, NULLABLE_INT, CIVIC_NULLS, read_tsv_rows
 
 CIVIC_EVIDENCE_DEFS = [
 """
-CREATE TABLE IF NOT EXISTS evidence (
+CREATE TABLE IF NOT EXISTS evidence_coded (
 	evidence_id INTEGER PRIMARY KEY,
 	variant_id INTEGER NOT NULL,
 	gene_symbol VARCHAR(16) NOT NULL,
@@ -29,7 +37,7 @@ CREATE TABLE IF NOT EXISTS evidence (
 	evidence_direction VARCHAR(32) NULL,
 	evidence_level VARCHAR(1) NOT NULL,
 	clinical_significance VARCHAR(32) NULL,
-	evidence_statement VARCHAR(512) NULL,
+	evidence_statement_text_id INTEGER NULL REFERENCES text_store(text_id),
 	rating INTEGER NULL
 )
 """
@@ -40,7 +48,7 @@ CREATE TABLE IF NOT EXISTS drugs (
 	variant_id INTEGER NOT NULL,
 	drugs VARCHAR(64) NULL,
 	drug_interaction_type VARCHAR(32) NULL,
-	FOREIGN KEY (evidence_id) REFERENCES evidence(evidence_id)
+	FOREIGN KEY (evidence_id) REFERENCES evidence_coded(evidence_id)
 		ON DELETE CASCADE ON UPDATE CASCADE
 )"""
 ,
@@ -53,30 +61,64 @@ CREATE TABLE IF NOT EXISTS citations (
 	asco_id INTEGER NULL,
 	citation VARCHAR(128) NOT NULL,
 	nct_ids VARCHAR(32) NULL,
-	FOREIGN KEY (evidence_id) REFERENCES evidence(evidence_id)
+	FOREIGN KEY (evidence_id) REFERENCES evidence_coded(evidence_id)
 		ON DELETE CASCADE ON UPDATE CASCADE
 )"""
+,
+# The statement is stored once in text_store, and the view joins it
+# back for the queries
+"""
+CREATE VIEW IF NOT EXISTS evidence AS
+SELECT
+	e.evidence_id, e.variant_id, e.gene_symbol, e.disease, e.doid, e.phenotypes,
+	e.evidence_type, e.evidence_direction, e.evidence_level, e.clinical_significance,
+	st.content AS evidence_statement,
+	e.rating
+FROM evidence_coded e
+LEFT JOIN text_store st ON st.text_id = e.evidence_statement_text_id
+"""
 ]
 
 
-def open_civic_db(db_file):
+# Full-text indexes, as (fts table, content table, key column,
+# [columns], physical table)
+CIVIC_EVIDENCE_FTS_DEFS = [
+	("evidence_fts", "evidence", "evidence_id", ["disease", "evidence_statement"], "evidence_coded"),
+]
+
+# Approximate size of a ClinicalEvidenceSummaries row, used to guess
+# how many rows a load will bring
+CIVIC_EVIDENCE_BYTES_PER_ROW = 700
+
+
+def open_civic_db(db_file,profile=DEFAULT_LOAD_PROFILE):
 	"""
 		This method creates a SQLITE3 database with the needed
 		tables to store civic data, or opens it if it already
-		exists
+		exists. The connection is tuned with the given load profile
 	"""
 	
 	db = sqlite3.connect(db_file)
+	apply_load_profile(db,profile)
 	
 	cur = db.cursor()
 	try:
 		# Let's enable the foreign keys integrity checks
 		cur.execute("PRAGMA FOREIGN_KEYS=ON")
 		
+		# Databases loaded before the text deduplication have a plain
+		# table where the view should be
+		cur.execute("SELECT type FROM sqlite_master WHERE name = 'evidence'")
+		found = cur.fetchone()
+		if found is not None and found[0] == "table":
+			raise ValueError("{} holds the plain CIViC evidence table, it has to be loaded from scratch".format(db_file))
+		
 		# And create the tables, in case they were not previously
 		# created in a previous use
+		create_text_store(db)
 		for tableDecl in CIVIC_EVIDENCE_DEFS:
 			cur.execute(tableDecl)
+		create_fts_tables(db,CIVIC_EVIDENCE_FTS_DEFS)
 	except sqlite3.Error as e:
 		print("An error occurred: {}".format(str(e)), file=sys.stderr)
 	finally:
@@ -84,113 +126,150 @@ def open_civic_db(db_file):
 	
 	return db
 	
-def store_civic_file(db,civic_file):
-	with open(civic_file,"rt",encoding="utf-8") as cf:
-		headerMapping = None
+# Columns of ClinicalEvidenceSummaries used by the loader. The first
+# ones follow the order of the evidence table
+CIVIC_EVIDENCE_COLUMNS = [
+	("evidence_id", INT),
+	("variant_id", INT),
+	("gene", TEXT),
+	("disease", TEXT),
+	("doid", NULLABLE_INT),
+	("phenotypes", TEXT),
+	("evidence_type", TEXT),
+	("evidence_direction", TEXT),
+	("evidence_level", TEXT),
+	("clinical_significance", TEXT),
+	("evidence_statement", TEXT),
+	("rating", NULLABLE_INT),
+	("drugs", TEXT),
+	("drug_interaction_type", TEXT),
+	("citation_id", INT),
+	("source_type", TEXT),
+	("asco_abstract_id", NULLABLE_INT),
+	("citation", TEXT),
+	("nct_ids", TEXT),
+]
+
+EVIDENCE_COLUMN_COUNT = 12
 
+def store_civic_file(db,civic_file,checkpoint_rows=DEFAULT_CHECKPOINT_ROWS,resume=False,stats=NULL_LOAD_STATS):
+	stats.begin(db,["evidence_coded","drugs","citations","text_store"])
+	line_offset, last_evidence_id = start_checkpoint(db,"evidence","evidence_id",civic_file,resume)
+	stats.count("skipped_rows",line_offset)
+	
+	with open_text_input(civic_file,stats) as cf:
 		cur = db.cursor()
 		
 		with db:
-			for line in cf:
-				wline = line.rstrip("\n")
-				if (headerMapping is None):
-					columnNames = re.split(r"\t",wline)
-					headerMapping = {}
-					for columnId, columnName in enumerate(columnNames):
-						headerMapping[columnName] = columnId
-				else:
-					columnValues = re.split(r"\t",wline)
-					
-					# As these values can contain "nulls", which are
-					# designed as 'N/A', substitute them for None
-					for iCol, vCol in enumerate(columnValues):
-						if len(vCol) == 0 or vCol == "N/A":
-							columnValues[iCol] = None
-					
-					# Table variation
-					#import pdb; pdb.set_trace()
-					evidence_id = int(columnValues[headerMapping["evidence_id"]])
-					variant_id = int(columnValues[headerMapping["variant_id"]])
-					gene_symbol = columnValues[headerMapping["gene"]]
-					disease = columnValues[headerMapping["disease"]]
-					doid = columnValues[headerMapping["doid"]]
-					phenotypes = columnValues[headerMapping["phenotypes"]]
-					evidence_type = columnValues[headerMapping["evidence_type"]]
-					evidence_direction = columnValues[headerMapping["evidence_direction"]]
-					evidence_level = columnValues[headerMapping["evidence_level"]]
-					clinical_significance = columnValues[headerMapping["clinical_significance"]]
-					evidence_statement = columnValues[headerMapping["evidence_statement"]]
-					rating = columnValues[headerMapping["rating"]]
-					
-					evidence_query = """
-						INSERT INTO evidence(
-							evidence_id, variant_id, gene_symbol, disease, doid, phenotypes,
-							evidence_type, evidence_direction, evidence_level, clinical_significance,
-							evidence_statement, rating)
-						VALUES(
-							?,?,?,?,?,?,?,?,?,?,?,?
-						)
-					"""
-					bindings = (
-						evidence_id,variant_id,gene_symbol,disease,doid,phenotypes,evidence_type,
-						evidence_direction,evidence_level,clinical_significance,evidence_statement,
-						rating
+			# The full-text index is rebuilt at the end of big loads,
+			# instead of following every insert
+			incoming_rows = estimate_incoming_rows(civic_file,CIVIC_EVIDENCE_BYTES_PER_ROW)
+			if should_rebuild_indexes(db,"evidence_coded",incoming_rows):
+				drop_fts_triggers(db,CIVIC_EVIDENCE_FTS_DEFS)
+			
+			texts = TextStore(db)
+			
+			# The rows are inserted one by one, so the loop is the
+			# insert stage, and only reading them is not
+			stats.switch("insert")
+			for row in stats.timed(read_tsv_rows(cf,CIVIC_EVIDENCE_COLUMNS,CIVIC_NULLS,skip=line_offset),"decode"):
+				# Table evidence
+				evidence_id = row[0]
+				last_evidence_id = evidence_id
+				variant_id = row[1]
+				
+				evidence_query = """
+					INSERT INTO evidence_coded(
+						evidence_id, variant_id, gene_symbol, disease, doid, phenotypes,
+						evidence_type, evidence_direction, evidence_level, clinical_significance,
+						evidence_statement_text_id, rating)
+					VALUES(
+						?,?,?,?,?,?,?,?,?,?,?,?
 					)
-
-					cur.execute(evidence_query,bindings)
-					
-					# Table drugs
-					evidence_id = int(columnValues[headerMapping["evidence_id"]])
-					variant_id = int(columnValues[headerMapping["variant_id"]])
-					drugs = columnValues[headerMapping["drugs"]]
-					drug_interaction_type = columnValues[headerMapping["drug_interaction_type"]]
-					
-					cur.execute("""
-					INSERT INTO drugs(
-						evidence_id,
-						variant_id,
-						drugs,
-						drug_interaction_type)
-					VALUES(?,?,?,?)
-					""", (evidence_id,variant_id,drugs,drug_interaction_type))
-					
-					
-					# Table citations
-					evidence_id = int(columnValues[headerMapping["evidence_id"]])
-					variant_id = int(columnValues[headerMapping["variant_id"]])
-					citation_id = int(columnValues[headerMapping["citation_id"]])
-					source = columnValues[headerMapping["source_type"]]
-					asco_id = columnValues[headerMapping["asco_abstract_id"]]
-					citation = columnValues[headerMapping["citation"]]
-					nct_ids = columnValues[headerMapping["nct_ids"]]
-					
-					cur.execute("""
-					INSERT INTO citations(
-						evidence_id,
-						variant_id,
-						citation_id,
-						source,
-						asco_id,
-						citation,
-						nct_ids)
-					VALUES(?,?,?,?,?,?,?)
-					""", (evidence_id,variant_id,citation_id,source,asco_id,citation,nct_ids))
+				"""
+				cur.execute(evidence_query,row[:10] + (texts.text_id(row[10]),) + row[11:EVIDENCE_COLUMN_COUNT])
+				
+				# Table drugs
+				drugs, drug_interaction_type = row[12:14]
+				
+				cur.execute("""
+				INSERT INTO drugs(
+					evidence_id,
+					variant_id,
+					drugs,
+					drug_interaction_type)
+				VALUES(?,?,?,?)
+				""", (evidence_id,variant_id,drugs,drug_interaction_type))
+				
+				
+				# Table citations
+				cur.execute("""
+				INSERT INTO citations(
+					evidence_id,
+					variant_id,
+					citation_id,
+					source,
+					asco_id,
+					citation,
+					nct_ids)
+				VALUES(?,?,?,?,?,?,?)
+				""", (evidence_id,variant_id) + row[14:])
+				
+				# Every so often, the work done so far is committed
+				line_offset += 1
+				if line_offset % checkpoint_rows == 0:
+					save_checkpoint(cur,"evidence",line_offset,last_evidence_id)
+					stats.commit(db)
+			
+			save_checkpoint(cur,"evidence",line_offset,last_evidence_id,completed=True)
+			stats.commit(db)
+		
+		print_text_store_report(texts)
+		
+		with db:
+			with stats.stage("index"):
+				sync_fts(db,CIVIC_EVIDENCE_FTS_DEFS)
+			stats.commit(db)
 
 		cur.close()
+	
+	stats.finish(db)
 
 if __name__ == '__main__':
-	if len(sys.argv) < 3:
-		print("Usage: {0} {{database_file}} {{civic_file}}".format(sys.argv[0]), file=sys.stderr)
-		sys.exit(1)
-
-	# Only the first and second parameters are considered
-	db_file = sys.argv[1]
-	civic_evidence_file = sys.argv[2]
+	parser = argparse.ArgumentParser(description="Loads a CIViC ClinicalEvidenceSummaries file into a SQLite database")
+	parser.add_argument("db_file", metavar="database_file", help="SQLite database to create or update")
+	parser.add_argument("civic_evidence_file", metavar="civic_evidence_file", help="tab separated CIViC release file")
+	parser.add_argument("--profile", choices=sorted(LOAD_PROFILES), default=DEFAULT_LOAD_PROFILE, help="PRAGMA profile used while loading (default: %(default)s)")
+	parser.add_argument("--checkpoint-rows", type=int, default=DEFAULT_CHECKPOINT_ROWS, help="rows committed at a time, each commit being a checkpoint (default: %(default)s)")
+	parser.add_argument("--resume", action="store_true", help="resume a broken load of the same file from its last checkpoint")
+	parser.add_argument("--stats-file", help="write the time per stage and the row counts of the load to this JSON file")
+	parser.add_argument("--snapshot-dir", help="write a columnar NumPy snapshot of its variants to this directory once loaded")
+	args = parser.parse_args()
 
 	# First, let's create or open the database
-	db = open_civic_db(db_file)
+	db = open_civic_db(args.db_file,profile=args.profile)
+
+	stats = LoadStats("civic_evidence",args.civic_evidence_file) if args.stats_file is not None else NULL_LOAD_STATS
 
 	# Second
-	store_civic_file(db,civic_evidence_file)
+	store_civic_file(db,args.civic_evidence_file,checkpoint_rows=args.checkpoint_rows,resume=args.resume,stats=stats)
+
+	# And back to safe settings for the readers
+	restore_read_profile(db)
+
+	# The columnar copy of the variants, for whole-table scans.
+	# NumPy is only needed when it is asked for
+	if args.snapshot_dir is not None:
+		from column_snapshot import write_snapshot
+		with stats.stage("snapshot"):
+			# The load is committed by now, so a failed export only
+			# leaves the snapshot to be written with column_snapshot.py
+			try:
+				write_snapshot(db,args.snapshot_dir,"civic")
+			except (ValueError,OSError) as e:
+				print("The snapshot could not be written, the load is kept: {}".format(str(e)), file=sys.stderr)
 
 	db.close()
+
+	if args.stats_file is not None:
+		stats.write_report(args.stats_file)
@@ -13,8 +13,17 @@
 # -*- coding: utf-8 -*-
 
 import sys, os
+import argparse
 import sqlite3
-import re
+
+from sqlite_tuning import LOAD_PROFILES, DEFAULT_LOAD_PROFILE, apply_load_profile, restore_read_profile
+from sqlite_tuning import estimate_incoming_rows, should_rebuild_indexes, drop_indexes, create_indexes
+from coord_index import rebuild_coord_index
+from fts_index import create_fts_tables, drop_fts_triggers, sync_fts
+from text_store import TextStore, create_text_store, print_text_store_report
+from load_checkpoint import DEFAULT_CHECKPOINT_ROWS, start_checkpoint, save_checkpoint
+from load_stats import LoadStats, NULL_LOAD_STATS, open_text_input
+from tsv_reader import TEXT, INT, NULLABLE_INT, FLOAT, CIVIC_NULLS, read_tsv_rows
 
 CIVIC_TABLE_DEFS = [
 """
@@ -26,21 +35,13 @@ CREATE TABLE IF NOT EXISTS gene (
 """
 ,
 """
-CREATE INDEX gene_entrez_id ON gene(entrez_id)
-"""
-,
-"""
-CREATE INDEX gene_sym ON gene(gene_symbol)
-"""
-,
-"""
-CREATE TABLE IF NOT EXISTS variant (
+CREATE TABLE IF NOT EXISTS variant_coded (
 	variant_id INTEGER PRIMARY KEY,
 	civic_url VARCHAR(40) NOT NULL,
 	gene_symbol VARCHAR(10) NULL,
 	entrez_id INTEGER NOT NULL,
 	variant VARCHAR(128) NOT NULL,
-	var_description VARCHAR (4096) NULL, 
+	var_description_text_id INTEGER NULL REFERENCES text_store(text_id),
 	var_groups VARCHAR(64) NULL,
 	var_types VARCHAR(64) NULL,
 	ref_bases VARCHAR(32) NULL,
@@ -66,52 +67,107 @@ CREATE TABLE IF NOT EXISTS variant (
 """
 ,
 """
-CREATE INDEX IF NOT EXISTS assembly_variant ON variant(ensemble, ref_build)
+CREATE TABLE IF NOT EXISTS hgvs_expressions (
+	ventry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+	variant_id INTEGER NULL,
+	hgvs_expression VARCHAR(64) NULL,
+	FOREIGN KEY (variant_id) REFERENCES gene(variant_id)
+		ON DELETE CASCADE ON UPDATE CASCADE,
+	FOREIGN KEY (variant_id) REFERENCES variant_coded(variant_id)
+		ON DELETE CASCADE ON UPDATE CASCADE
+)
 """
 ,
+# The description is stored once in text_store, and the view joins
+# it back for the queries
 """
-CREATE INDEX IF NOT EXISTS coords_variant ON variant(chr_start,chr_stop,chr_1,representative_transcript)
+CREATE VIEW IF NOT EXISTS variant AS
+SELECT
+	v.variant_id, v.civic_url, v.gene_symbol, v.entrez_id, v.variant,
+	dt.content AS var_description,
+	v.var_groups, v.var_types, v.ref_bases, v.var_bases, v.ensemble, v.ref_build,
+	v.chr_1, v.chr_start, v.chr_stop, v.representative_transcript, v.chr_2,
+	v.chr_2_start, v.chr_2_stop, v.representative_transcript_2, v.allele_registry_id,
+	v.civic_evidence_score, v.civic_assertion_id, v.civic_assertion_url,
+	v.civic_is_flagged, v.clinvar_ids, v.var_alias
+FROM variant_coded v
+LEFT JOIN text_store dt ON dt.text_id = v.var_description_text_id
+"""
+]
+
+# Indexes are declared apart, as they are built once the data is loaded
+CIVIC_INDEX_DEFS = [
+"""
+CREATE INDEX IF NOT EXISTS gene_entrez_id ON gene(entrez_id)
 """
 ,
 """
-CREATE INDEX IF NOT EXISTS coords_2_variant ON variant(chr_2_start,chr_2_stop,chr_2,representative_transcript_2)
+CREATE INDEX IF NOT EXISTS gene_sym ON gene(gene_symbol)
 """
 ,
 """
-CREATE INDEX IF NOT EXISTS gene_symbol_variant ON variant(gene_symbol)
+CREATE INDEX IF NOT EXISTS assembly_variant ON variant_coded(ensemble, ref_build)
 """
 ,
 """
-CREATE TABLE IF NOT EXISTS hgvs_expressions (
-	ventry_id INTEGER PRIMARY KEY AUTOINCREMENT,
-	variant_id INTEGER NULL,
-	hgvs_expression VARCHAR(64) NULL,
-	FOREIGN KEY (variant_id) REFERENCES gene(variant_id)
-		ON DELETE CASCADE ON UPDATE CASCADE,
-	FOREIGN KEY (variant_id) REFERENCES variant(variant_id)
-		ON DELETE CASCADE ON UPDATE CASCADE
-)
+CREATE INDEX IF NOT EXISTS coords_variant ON variant_coded(chr_start,chr_stop,chr_1,representative_transcript)
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS coords_2_variant ON variant_coded(chr_2_start,chr_2_stop,chr_2,representative_transcript_2)
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS gene_symbol_variant ON variant_coded(gene_symbol)
 """
 ]
 
-def open_civic_db(db_file):
+# Approximate size of a VariantSummaries row, used to guess how many
+# rows a load will bring
+CIVIC_BYTES_PER_ROW = 600
+
+# Full-text indexes, as (fts table, content table, key column,
+# [columns], physical table)
+CIVIC_FTS_DEFS = [
+	("variant_fts", "variant", "variant_id", ["var_description"], "variant_coded"),
+]
+
+# Loci kept in the R*Tree coordinate indexes, as (assembly,
+# chromosome, start, stop) columns of the variant table. The second
+# one is the fusion partner, if any
+CIVIC_COORD_LOCI = [
+	("ref_build", "chr_1", "chr_start", "chr_stop"),
+	("ref_build", "chr_2", "chr_2_start", "chr_2_stop"),
+]
+
+def open_civic_db(db_file,profile=DEFAULT_LOAD_PROFILE):
 	"""
 		This method creates a SQLITE3 database with the needed
 		tables to store civic data, or opens it if it already
-		exists
+		exists. The connection is tuned with the given load profile
 	"""
 	
 	db = sqlite3.connect(db_file)
+	apply_load_profile(db,profile)
 	
 	cur = db.cursor()
 	try:
 		# Let's enable the foreign keys integrity checks
 		cur.execute("PRAGMA FOREIGN_KEYS=ON")
 		
+		# Databases loaded before the text deduplication have a plain
+		# table where the view should be
+		cur.execute("SELECT type FROM sqlite_master WHERE name = 'variant'")
+		found = cur.fetchone()
+		if found is not None and found[0] == "table":
+			raise ValueError("{} holds the plain CIViC variant table, it has to be loaded from scratch".format(db_file))
+		
 		# And create the tables, in case they were not previously
 		# created in a previous use
+		create_text_store(db)
 		for tableDecl in CIVIC_TABLE_DEFS:
 			cur.execute(tableDecl)
+		create_fts_tables(db,CIVIC_FTS_DEFS)
 	except sqlite3.Error as e:
 		print("An error occurred: {}".format(str(e)), file=sys.stderr)
 	finally:
@@ -119,122 +175,163 @@ def open_civic_db(db_file):
 	
 	return db
 	
-def store_civic_file(db,civic_file):
-	with open(civic_file,"rt",encoding="utf-8") as cf:
-		headerMapping = None
+# Columns of VariantSummaries used by the loader. All but the last
+# one follow the order of the variant table
+CIVIC_VARIANT_COLUMNS = [
+	("variant_id", INT),
+	("variant_civic_url", TEXT),
+	("gene", TEXT),
+	("entrez_id", NULLABLE_INT),
+	("variant", TEXT),
+	("summary", TEXT),
+	("variant_groups", TEXT),
+	("variant_types", TEXT),
+	("reference_bases", TEXT),
+	("variant_bases", TEXT),
+	("ensembl_version", NULLABLE_INT),
+	("reference_build", TEXT),
+	("chromosome", TEXT),
+	("start", NULLABLE_INT),
+	("stop", NULLABLE_INT),
+	("representative_transcript", TEXT),
+	("chromosome2", TEXT),
+	("start2", NULLABLE_INT),
+	("stop2", NULLABLE_INT),
+	("representative_transcript2", TEXT),
+	("allele_registry_id", TEXT),
+	("civic_variant_evidence_score", FLOAT),
+	("assertion_ids", TEXT),
+	("assertion_civic_urls", TEXT),
+	("is_flagged", TEXT),
+	("clinvar_ids", TEXT),
+	("variant_aliases", TEXT),
+	("hgvs_expressions", TEXT),
+]
+
+VARIANT_COLUMN_COUNT = 27
 
+def store_civic_file(db,civic_file,checkpoint_rows=DEFAULT_CHECKPOINT_ROWS,resume=False,stats=NULL_LOAD_STATS):
+	stats.begin(db,["variant_coded","gene","hgvs_expressions","text_store"])
+	line_offset, last_variant_id = start_checkpoint(db,"variant","variant_id",civic_file,resume)
+	stats.count("skipped_rows",line_offset)
+	
+	with open_text_input(civic_file,stats) as cf:
 		cur = db.cursor()
 		
 		with db:
-			for line in cf:
-				wline = line.rstrip("\n")
-				if (headerMapping is None):
-					columnNames = re.split(r"\t",wline)
-					headerMapping = {}
-					for columnId, columnName in enumerate(columnNames):
-						headerMapping[columnName] = columnId
-				else:
-					columnValues = re.split(r"\t",wline)
-					
-					# As these values can contain "nulls", which are
-					# designed as 'N/A', substitute them for None
-					for iCol, vCol in enumerate(columnValues):
-						if len(vCol) == 0 or vCol == "N/A":
-							columnValues[iCol] = None
-					
-					# Table variation
-					#import pdb; pdb.set_trace()
-					variant_id = int(columnValues[headerMapping["variant_id"]])
-					civic_url = columnValues[headerMapping["variant_civic_url"]]
-					gene_symbol = columnValues[headerMapping["gene"]]
-					entrez_id = columnValues[headerMapping["entrez_id"]]
-					variant = columnValues[headerMapping["variant"]]
-					var_description = columnValues[headerMapping["summary"]]
-					var_groups = columnValues[headerMapping["variant_groups"]]
-					var_types = columnValues[headerMapping["variant_types"]]
-					ref_bases = columnValues[headerMapping["reference_bases"]]
-					var_bases = columnValues[headerMapping["variant_bases"]]
-					ensemble = columnValues[headerMapping["ensembl_version"]]
-					ref_build = columnValues[headerMapping["reference_build"]]
-					chr_1 = columnValues[headerMapping["chromosome"]]
-					chr_start = columnValues[headerMapping["start"]]
-					chr_stop = columnValues[headerMapping["stop"]]
-					representative_transcript = columnValues[headerMapping["representative_transcript"]]
-					chr_2 = columnValues[headerMapping["chromosome2"]]
-					chr_2_start = columnValues[headerMapping["start2"]]
-					chr_2_stop = columnValues[headerMapping["stop2"]]
-					representative_transcript_2 = columnValues[headerMapping["representative_transcript2"]]
-					allele_registry_id = columnValues[headerMapping["allele_registry_id"]]
-					civic_evidence_score = columnValues[headerMapping["civic_variant_evidence_score"]]
-					civic_assertion_id = columnValues[headerMapping["assertion_ids"]]
-					civic_assertion_url = columnValues[headerMapping["assertion_civic_urls"]]
-					civic_is_flagged = columnValues[headerMapping["is_flagged"]]
-					clinvar_ids = columnValues[headerMapping["clinvar_ids"]]
-					var_alias = columnValues[headerMapping["variant_aliases"]]
-										
-					variant_query = """
-						INSERT INTO variant(
-							variant_id, civic_url, gene_symbol, entrez_id, variant, var_description,
-							var_groups, var_types, ref_bases, var_bases, ensemble, ref_build,
-							chr_1, chr_start, chr_stop, representative_transcript, chr_2,
-							chr_2_start, chr_2_stop, representative_transcript_2, allele_registry_id,
-							civic_evidence_score, civic_assertion_id, civic_assertion_url,
-							civic_is_flagged, clinvar_ids, var_alias)
-						VALUES(
-							?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?
-						)
-					"""
-					bindings = (
-						variant_id,civic_url,gene_symbol,entrez_id,variant,var_description,
-						var_groups,var_types,ref_bases,var_bases,ensemble,ref_build,chr_1,chr_start,
-						chr_stop,representative_transcript,chr_2,chr_2_start,chr_2_stop,
-						representative_transcript_2,allele_registry_id,civic_assertion_url,
-						civic_evidence_score,civic_assertion_id,civic_is_flagged,clinvar_ids,var_alias
+			# Indexes are only kept during the load when it is a small
+			# append to a bigger table, otherwise they are rebuilt later
+			incoming_rows = estimate_incoming_rows(civic_file,CIVIC_BYTES_PER_ROW)
+			if should_rebuild_indexes(db,"variant_coded",incoming_rows):
+				drop_indexes(db,CIVIC_INDEX_DEFS)
+				drop_fts_triggers(db,CIVIC_FTS_DEFS)
+			
+			texts = TextStore(db)
+			
+			# The rows are inserted one by one, so the loop is the
+			# insert stage, and only reading them is not
+			stats.switch("insert")
+			for row in stats.timed(read_tsv_rows(cf,CIVIC_VARIANT_COLUMNS,CIVIC_NULLS,skip=line_offset),"decode"):
+				# Table variation, with the description in the text store
+				variant_query = """
+					INSERT INTO variant_coded(
+						variant_id, civic_url, gene_symbol, entrez_id, variant, var_description_text_id,
+						var_groups, var_types, ref_bases, var_bases, ensemble, ref_build,
+						chr_1, chr_start, chr_stop, representative_transcript, chr_2,
+						chr_2_start, chr_2_stop, representative_transcript_2, allele_registry_id,
+						civic_evidence_score, civic_assertion_id, civic_assertion_url,
+						civic_is_flagged, clinvar_ids, var_alias)
+					VALUES(
+						?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?
 					)
-
-					cur.execute(variant_query,bindings)
-					
-					# Table gene
-					variant_id = int(columnValues[headerMapping["variant_id"]])
-					gene_symbol = columnValues[headerMapping["gene"]]
-					entrez_id = columnValues[headerMapping["entrez_id"]]
-					
-					cur.execute("""
-					INSERT INTO gene(
-						variant_id,
-						gene_symbol,
-						entrez_id)
-					VALUES(?,?,?)
-					""", (variant_id,gene_symbol,entrez_id))
-					
-					
-					# HGVS
-					variant_id = int(columnValues[headerMapping["variant_id"]])
-					hgvs_expression = columnValues[headerMapping["hgvs_expressions"]]
-					if hgvs_expression is not None:
-						prep_hgvs = [ (variant_id, hgvs_expression) for hgvs_expression in re.split(r",",hgvs_expression) ]
-						cur.executemany("""
-							INSERT INTO hgvs_expressions(
-								variant_id,
-								hgvs_expression)
-							VALUES(?,?)
-						""", prep_hgvs)
+				"""
+				cur.execute(variant_query,row[:5] + (texts.text_id(row[5]),) + row[6:VARIANT_COLUMN_COUNT])
+				
+				# Table gene
+				variant_id = row[0]
+				last_variant_id = variant_id
+				gene_symbol = row[2]
+				entrez_id = row[3]
+				
+				cur.execute("""
+				INSERT INTO gene(
+					variant_id,
+					gene_symbol,
+					entrez_id)
+				VALUES(?,?,?)
+				""", (variant_id,gene_symbol,entrez_id))
+				
+				
+				# HGVS
+				hgvs_expression = row[VARIANT_COLUMN_COUNT]
+				if hgvs_expression is not None:
+					prep_hgvs = [ (variant_id, hgvs_expression) for hgvs_expression in hgvs_expression.split(",") ]
+					cur.executemany("""
+						INSERT INTO hgvs_expressions(
+							variant_id,
+							hgvs_expression)
+						VALUES(?,?)
+					""", prep_hgvs)
+				
+				# Every so often, the work done so far is committed
+				line_offset += 1
+				if line_offset % checkpoint_rows == 0:
+					save_checkpoint(cur,"variant",line_offset,last_variant_id)
+					stats.commit(db)
+			
+			save_checkpoint(cur,"variant",line_offset,last_variant_id,completed=True)
+			stats.commit(db)
+		
+		print_text_store_report(texts)
+		
+		# Now the data is in, the missing indexes are built in bulk,
+		# and so are the coordinate and full-text ones
+		with db:
+			with stats.stage("index"):
+				create_indexes(db,CIVIC_INDEX_DEFS)
+				sync_fts(db,CIVIC_FTS_DEFS)
+				rebuild_coord_index(db,"variant","variant_id",CIVIC_COORD_LOCI)
+			stats.commit(db)
 		
 		cur.close()
+	
+	stats.finish(db)
 
 if __name__ == '__main__':
-	if len(sys.argv) < 3:
-		print("Usage: {0} {{database_file}} {{civic_file}}".format(sys.argv[0]), file=sys.stderr)
-		sys.exit(1)
-
-	# Only the first and second parameters are considered
-	db_file = sys.argv[1]
-	civic_file = sys.argv[2]
+	parser = argparse.ArgumentParser(description="Loads a CIViC VariantSummaries file into a SQLite database")
+	parser.add_argument("db_file", metavar="database_file", help="SQLite database to create or update")
+	parser.add_argument("civic_file", metavar="civic_file", help="tab separated CIViC release file")
+	parser.add_argument("--profile", choices=sorted(LOAD_PROFILES), default=DEFAULT_LOAD_PROFILE, help="PRAGMA profile used while loading (default: %(default)s)")
+	parser.add_argument("--checkpoint-rows", type=int, default=DEFAULT_CHECKPOINT_ROWS, help="rows committed at a time, each commit being a checkpoint (default: %(default)s)")
+	parser.add_argument("--resume", action="store_true", help="resume a broken load of the same file from its last checkpoint")
+	parser.add_argument("--stats-file", help="write the time per stage and the row counts of the load to this JSON file")
+	parser.add_argument("--snapshot-dir", help="write a columnar NumPy snapshot of the variants to this directory once loaded")
+	args = parser.parse_args()
 
 	# First, let's create or open the database
-	db = open_civic_db(db_file)
+	db = open_civic_db(args.db_file,profile=args.profile)
+
+	stats = LoadStats("civic_variant",args.civic_file) if args.stats_file is not None else NULL_LOAD_STATS
 
 	# Second
-	store_civic_file(db,civic_file)
+	store_civic_file(db,args.civic_file,checkpoint_rows=args.checkpoint_rows,resume=args.resume,stats=stats)
+
+	# And back to safe settings for the readers
+	restore_read_profile(db)
+
+	# The columnar copy of the variants, for whole-table scans.
+	# NumPy is only needed when it is asked for
+	if args.snapshot_dir is not None:
+		from column_snapshot import write_snapshot
+		with stats.stage("snapshot"):
+			# The load is committed by now, so a failed export only
+			# leaves the snapshot to be written with column_snapshot.py
+			try:
+				write_snapshot(db,args.snapshot_dir,"civic")
+			except (ValueError,OSError) as e:
+				print("The snapshot could not be written, the load is kept: {}".format(str(e)), file=sys.stderr)
 
 	db.close()
+
+	if args.stats_file is not None:
+		stats.write_report(args.stats_file)
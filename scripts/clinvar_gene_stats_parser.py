@@ -15,9 +15,16 @@
 # Module import, left out os as it isn't used
 
 import sys
+import argparse
 import sqlite3
-import gzip
-import re
+
+from sqlite_tuning import LOAD_PROFILES, DEFAULT_LOAD_PROFILE, apply_load_profile, restore_read_profile
+from sqlite_tuning import estimate_incoming_rows, should_rebuild_indexes, drop_indexes, create_indexes
+from tsv_reader import TEXT, INT, NULLABLE_INT, CLINVAR_NULLS, header_columns, compile_row_decoder, read_tsv_rows
+from pipeline import run_pipeline, block_lines, print_pipeline_report
+from load_stats import LoadStats, NULL_LOAD_STATS, wrap_text_input
+from load_progress import start_progress
+from decompression import DECOMPRESSION_BACKENDS, DEFAULT_DECOMPRESSION, open_decompressed
 
 # SQL tables declaration
 # Different tables where used for different strata of information
@@ -37,21 +44,30 @@ CREATE TABLE IF NOT EXISTS gene_stats (
     uncertain_no INTEGER NULL,
     conflict_no INTEGER NULL
 )
-""",
 """
-CREATE INDEX gene_report ON gene_stats(submissions_reporting_gene)
+]
+
+# Indexes are declared apart, as they are built once the data is loaded
+CLINVAR_STATS_INDEX_DEFS = [
+"""
+CREATE INDEX IF NOT EXISTS gene_report ON gene_stats(submissions_reporting_gene)
 """,
 """
-CREATE INDEX all_patog ON gene_stats(allele_pathogenicity)
+CREATE INDEX IF NOT EXISTS all_patog ON gene_stats(allele_pathogenicity)
 """,
 """
-CREATE INDEX mim_number ON gene_stats(mim_no)
+CREATE INDEX IF NOT EXISTS mim_number ON gene_stats(mim_no)
 """
 ]
 
+# Approximate size of a gene_specific_summary row, once gzipped, used
+# to guess how many rows a load will bring
+STATS_GZ_BYTES_PER_ROW = 20
+
 # Clinvar file open function
-def open_clinvar_db(db_file):
+def open_clinvar_db(db_file, profile=DEFAULT_LOAD_PROFILE):
 	db = sqlite3.connect(db_file)
+	apply_load_profile(db, profile)
 
 	cur = db.cursor()
 	try:
@@ -65,67 +81,106 @@ def open_clinvar_db(db_file):
 
 	return db
 
-def store_clinvar_stats(db, stats_file):
-    with gzip.open(stats_file, "rt", encoding="utf-8") as sf:
-        headerMapping = None
+# Columns of gene_specific_summary used by the loader, in the order
+# of the gene_stats table
+STATS_COLUMNS = [
+    ("Symbol", TEXT),
+    ("GeneID", INT),
+    ("Total_submissions", INT),
+    ("Total_alleles", NULLABLE_INT),
+    ("Submissions_reporting_this_gene", NULLABLE_INT),
+    ("Alleles_reported_Pathogenic_Likely_pathogenic", NULLABLE_INT),
+    ("Gene_MIM_number", NULLABLE_INT),
+    ("Number_uncertain", NULLABLE_INT),
+    ("Number_with_conflicts", NULLABLE_INT),
+]
+
+INSERT_GENE_STATS = """
+    INSERT INTO gene_stats(
+        gene_symbol,
+        geneID,
+        total_submissions,
+        total_alleles,
+        submissions_reporting_gene,
+        allele_pathogenicity,
+        mim_no,
+        uncertain_no,
+        conflict_no)
+    VALUES(?,?,?,?,?,?,?,?,?)
+    """
+
+def store_clinvar_stats(db, stats_file, pipeline=False, stats=NULL_LOAD_STATS, progress=False, decompression=DEFAULT_DECOMPRESSION):
+    stats.begin(db, ["gene_stats"])
+
+    # The pipeline decodes the text itself, in big blocks
+    gz = open_decompressed(stats_file, decompression)
+    sf = gz if pipeline else wrap_text_input(gz, stats, "decompress")
+
+    with sf:
         # Skip first line from the file
         next(sf)
         cur = db.cursor()
+        tracker = start_progress("gene_specific_summary", stats_file, gz.compressed_position, stats, show=progress)
 
         with db:
-            for line in sf:
-                wline = line.rstrip("\n")
-                if (headerMapping is None) and (wline[0] == '#'):
-                    wline = wline.lstrip("#")
-                    columnNames = re.split(r"\t", wline)
-                    headerMapping = {}
-                    for columnId, columnName in enumerate(columnNames):
-                        headerMapping[columnName] = columnId
-
-                else:
-                    columnValues = re.split(r"\t", wline)
-                    for iCol, vCol in enumerate(columnValues):
-                        if len(vCol) == 0 or vCol == "-":
-                            columnValues[iCol] = None
-			        
-                    gene_symbol = columnValues[headerMapping["Symbol"]]
-                    geneID = int(columnValues[headerMapping["GeneID"]])
-                    total_submissions = int(columnValues[headerMapping["Total_submissions"]])
-                    total_alleles = columnValues[headerMapping["Total_alleles"]]
-                    submissions_reporting_gene = columnValues[headerMapping["Submissions_reporting_this_gene"]]
-                    allele_pathogenicity = columnValues[headerMapping["Alleles_reported_Pathogenic_Likely_pathogenic"]]
-                    mim_no = columnValues[headerMapping["Gene_MIM_number"]]
-                    uncertain_no = columnValues[headerMapping["Number_uncertain"]]
-                    conflict_no = columnValues[headerMapping["Number_with_conflicts"]]
-
-                    cur.execute("""
-                        INSERT INTO gene_stats(
-                            gene_symbol,
-                            geneID,
-                            total_submissions,
-                            total_alleles,
-                            submissions_reporting_gene,
-                            allele_pathogenicity,
-                            mim_no,
-                            uncertain_no,
-                            conflict_no)
-                        VALUES(?,?,?,?,?,?,?,?,?)
-                        """, (gene_symbol, geneID, total_submissions, total_alleles, \
-                            submissions_reporting_gene, allele_pathogenicity, mim_no, \
-                            uncertain_no, conflict_no)
-                    )
-
-                    ventry_id = cur.lastrowid
-
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("Usage: {0} {{database_file}} {{compressed_clinvar_stats_file}}".format(
-            sys.argv[0]), file=sys.stderr)
-        sys.exit(1)
+            incoming_rows = estimate_incoming_rows(stats_file, STATS_GZ_BYTES_PER_ROW)
+            if should_rebuild_indexes(db, "gene_stats", incoming_rows):
+                drop_indexes(db, CLINVAR_STATS_INDEX_DEFS)
+
+            if pipeline:
+                decode_row = compile_row_decoder(header_columns(next(sf).decode("utf-8")), STATS_COLUMNS, CLINVAR_NULLS)
+
+                def parse_block(block):
+                    return [ decode_row(line) for line in block_lines(block) ]
+
+                pipeline_stats = {}
+                loaded_rows = 0
+                for rows in stats.timed(run_pipeline(sf, parse_block, pipeline_stats), "parse"):
+                    with stats.stage("insert"):
+                        cur.executemany(INSERT_GENE_STATS, rows)
+                    loaded_rows += len(rows)
+                    tracker.update(loaded_rows, loaded_rows)
+                tracker.close(loaded_rows)
+                print_pipeline_report(pipeline_stats, loaded_rows)
+                stats.add_pipeline(pipeline_stats)
+            else:
+                # The decoded rows go straight to the database, so the
+                # time of executemany not spent decoding is the inserts
+                with stats.stage("insert"):
+                    cur.executemany(INSERT_GENE_STATS, tracker.counted(stats.timed(read_tsv_rows(sf, STATS_COLUMNS, CLINVAR_NULLS), "decode")))
+                tracker.close()
+            stats.commit(db)
+
+        # Missing indexes are built in bulk, once the data is in
+        with db:
+            with stats.stage("index"):
+                create_indexes(db, CLINVAR_STATS_INDEX_DEFS)
+            stats.commit(db)
 
-    db_file = sys.argv[1]
-    clinvar_file = sys.argv[2]
+    stats.finish(db)
 
-    db = open_clinvar_db(db_file)
-    store_clinvar_stats(db, clinvar_file)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Loads the ClinVar gene_specific_summary file into a SQLite database")
+    parser.add_argument("db_file", metavar="database_file", help="SQLite database to create or update")
+    parser.add_argument("clinvar_file", metavar="compressed_clinvar_stats_file", help="gzipped gene_specific_summary file")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="overlap decompression, parsing and inserts in threads, and report each stage")
+    parser.add_argument("--profile", choices=sorted(LOAD_PROFILES), default=DEFAULT_LOAD_PROFILE,
+                        help="PRAGMA profile used while loading (default: %(default)s)")
+    parser.add_argument("--decompression", choices=DECOMPRESSION_BACKENDS, default=DEFAULT_DECOMPRESSION,
+                        help="how the file is decompressed, auto picking the fastest backend available (default: %(default)s)")
+    parser.add_argument("--progress", action="store_true",
+                        help="show the rows loaded, their speed and the ETA while loading")
+    parser.add_argument("--stats-file",
+                        help="write the time per stage and the row counts of the load to this JSON file")
+    args = parser.parse_args()
+
+    stats = LoadStats("gene_stats", args.clinvar_file) if args.stats_file is not None else NULL_LOAD_STATS
+
+    db = open_clinvar_db(args.db_file, profile=args.profile)
+    store_clinvar_stats(db, args.clinvar_file, pipeline=args.pipeline, stats=stats, progress=args.progress, decompression=args.decompression)
+    restore_read_profile(db)
     db.close()
+
+    if args.stats_file is not None:
+        stats.write_report(args.stats_file)
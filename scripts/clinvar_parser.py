@@ -11,13 +11,30 @@
 #!/usr/bin/env python3.8
 # -*- coding: utf-8 -*-
 
-# Module import, left out os as it isn't used
+# Module import
 
 import sys
+import os
+import argparse
+import collections
+import hashlib
+import multiprocessing
 import sqlite3
-import gzip
 import re
 
+from sqlite_tuning import LOAD_PROFILES, DEFAULT_LOAD_PROFILE, apply_load_profile, restore_read_profile
+from sqlite_tuning import estimate_incoming_rows, should_rebuild_indexes, drop_indexes, create_indexes
+from tsv_reader import TEXT, INT, NULLABLE_INT, CLINVAR_NULLS, header_columns, compile_row_decoder
+from pipeline import run_pipeline, block_lines, print_pipeline_report
+from coord_index import rebuild_coord_index, update_coord_index
+from fts_index import create_fts_tables, drop_fts_triggers, sync_fts
+from aggregate_tables import drop_aggregate_triggers, sync_aggregates
+from text_store import TextStore, create_text_store, purge_unreferenced_texts, print_text_store_report
+from load_checkpoint import DEFAULT_CHECKPOINT_ROWS, start_checkpoint, save_checkpoint, skip_lines
+from load_stats import LoadStats, NULL_LOAD_STATS, wrap_text_input
+from load_progress import PROGRESS_CHECK_ROWS, start_progress
+from decompression import DECOMPRESSION_BACKENDS, DEFAULT_DECOMPRESSION, open_decompressed
+
 # SQL tables declaration
 # Different tables where used for different strata of information
 # Integrity mantainance
@@ -25,107 +42,446 @@ import re
 CLINVAR_TABLE_DEFS = [
 """
 CREATE TABLE IF NOT EXISTS gene (
-	gene_id INTEGER NOT NULL,
+	gene_id INTEGER NULL,
 	gene_symbol VARCHAR(64) NOT NULL,
-	HGNC_ID VARCHAR(64) NOT NULL,
+	HGNC_ID VARCHAR(64) NULL,
 	PRIMARY KEY (gene_symbol)
 )
 """
 ,
 """
-CREATE TABLE IF NOT EXISTS variant (
+CREATE TABLE IF NOT EXISTS assembly_code (
+	code INTEGER PRIMARY KEY,
+	assembly VARCHAR(16) NOT NULL UNIQUE
+)
+"""
+,
+"""
+CREATE TABLE IF NOT EXISTS type_code (
+	code INTEGER PRIMARY KEY,
+	type VARCHAR(256) NOT NULL UNIQUE
+)
+"""
+,
+"""
+CREATE TABLE IF NOT EXISTS chro_code (
+	code INTEGER PRIMARY KEY,
+	chro VARCHAR(16) NOT NULL UNIQUE
+)
+"""
+,
+"""
+CREATE TABLE IF NOT EXISTS significance_code (
+	code INTEGER PRIMARY KEY,
+	significance VARCHAR(64) NOT NULL UNIQUE
+)
+"""
+,
+"""
+CREATE TABLE IF NOT EXISTS status_code (
+	code INTEGER PRIMARY KEY,
+	status VARCHAR(64) NOT NULL UNIQUE
+)
+"""
+,
+"""
+CREATE TABLE IF NOT EXISTS phen_ns_code (
+	code INTEGER PRIMARY KEY,
+	phen_ns VARCHAR(64) NOT NULL UNIQUE
+)
+"""
+,
+"""
+CREATE TABLE IF NOT EXISTS variant_coded (
 	ventry_id INTEGER PRIMARY KEY AUTOINCREMENT,
 	allele_id INTEGER NOT NULL,
-	name VARCHAR(256),
-	type VARCHAR(256) NOT NULL,
+	name_text_id INTEGER REFERENCES text_store(text_id),
+	type_code INTEGER NOT NULL REFERENCES type_code(code),
 	dbSNP_id INTEGER NOT NULL,
-	phenotype_list VARCHAR(4096),
+	phenotype_list_text_id INTEGER REFERENCES text_store(text_id),
 	gene_id INTEGER,
 	gene_symbol VARCHAR(64),
 	HGNC_ID VARCHAR(64),
-	assembly VARCHAR(16),
-	chro VARCHAR(16) NOT NULL,
+	assembly_code INTEGER REFERENCES assembly_code(code),
+	chro_code INTEGER NOT NULL REFERENCES chro_code(code),
 	chro_start INTEGER NOT NULL,
 	chro_stop INTEGER NOT NULL,
 	ref_allele VARCHAR(4096),
 	alt_allele VARCHAR(4096),
 	cytogenetic VARCHAR(64),
-	variation_id INTEGER NOT NULL
+	variation_id INTEGER NOT NULL,
+	name_inline VARCHAR(64),
+	phenotype_list_inline VARCHAR(64)
 )
 """
 ,
 """
-CREATE INDEX coords_variant ON variant(chro_start,chro_stop,chro)
-"""
-,
-"""
-CREATE INDEX assembly_variant ON variant(assembly)
-"""
-,
-"""
-CREATE INDEX gene_symbol_variant ON variant(gene_symbol)
-"""
-,
-"""
 CREATE TABLE IF NOT EXISTS gene2variant (
 	gene_symbol VARCHAR(64) NOT NULL,
 	ventry_id INTEGER NOT NULL,
 	PRIMARY KEY (ventry_id, gene_symbol),
 	FOREIGN KEY (gene_symbol) REFERENCES gene(gene_symbol)
 		ON DELETE CASCADE ON UPDATE CASCADE,
-	FOREIGN KEY (ventry_id) REFERENCES variant(ventry_id)
+	FOREIGN KEY (ventry_id) REFERENCES variant_coded(ventry_id)
 		ON DELETE CASCADE ON UPDATE CASCADE
-)
+) WITHOUT ROWID
 """
 ,
+# The primary keys of the significances, review statuses and
+# phenotypes of a variant hold all their columns, so a value repeated
+# within a variant, like a significance written twice, is kept once.
+# The loader reports how many of those repeats it dropped
 """
-CREATE TABLE IF NOT EXISTS clinical_sig (
+CREATE TABLE IF NOT EXISTS clinical_sig_coded (
 	ventry_id INTEGER NOT NULL,
-	significance VARCHAR(64) NOT NULL,
-	FOREIGN KEY (ventry_id) REFERENCES variant(ventry_id)
+	significance_code INTEGER NOT NULL REFERENCES significance_code(code),
+	PRIMARY KEY (ventry_id, significance_code),
+	FOREIGN KEY (ventry_id) REFERENCES variant_coded(ventry_id)
 		ON DELETE CASCADE ON UPDATE CASCADE
-)
+) WITHOUT ROWID
 """
 ,
 """
-CREATE TABLE IF NOT EXISTS review_status (
+CREATE TABLE IF NOT EXISTS review_status_coded (
 	ventry_id INTEGER NOT NULL,
-	status VARCHAR(64) NOT NULL,
-	FOREIGN KEY (ventry_id) REFERENCES variant(ventry_id)
+	status_code INTEGER NOT NULL REFERENCES status_code(code),
+	PRIMARY KEY (ventry_id, status_code),
+	FOREIGN KEY (ventry_id) REFERENCES variant_coded(ventry_id)
 		ON DELETE CASCADE ON UPDATE CASCADE
-)
+) WITHOUT ROWID
 """
 ,
 """
-CREATE TABLE IF NOT EXISTS variant_phenotypes (
+CREATE TABLE IF NOT EXISTS variant_phenotypes_coded (
 	ventry_id INTEGER NOT NULL,
 	phen_group_id INTEGER NOT NULL,
-	phen_ns VARCHAR(64) NOT NULL,
+	phen_ns_code INTEGER NOT NULL REFERENCES phen_ns_code(code),
 	phen_id VARCHAR(64) NOT NULL,
-	FOREIGN KEY (ventry_id) REFERENCES variant(ventry_id)
+	PRIMARY KEY (ventry_id, phen_group_id, phen_ns_code, phen_id),
+	FOREIGN KEY (ventry_id) REFERENCES variant_coded(ventry_id)
 		ON DELETE CASCADE ON UPDATE CASCADE
+) WITHOUT ROWID
+"""
+,
+"""
+CREATE TABLE IF NOT EXISTS variant_hash (
+	ventry_id INTEGER PRIMARY KEY,
+	variation_id INTEGER NOT NULL,
+	allele_id INTEGER NOT NULL,
+	assembly VARCHAR(16),
+	occurrence INTEGER NOT NULL,
+	row_hash BLOB NOT NULL,
+	FOREIGN KEY (ventry_id) REFERENCES variant_coded(ventry_id)
+		ON DELETE CASCADE ON UPDATE CASCADE
+)
+"""
+,
+# Variant counts by group, kept by aggregate_tables.py. Key columns
+# may be NULL, so the UNIQUE constraints only serve the lookups, and
+# the triggers are the ones never adding a group twice. The genes are
+# those of gene2variant, so a variant spanning several genes counts
+# once for each of them, and one without genes is not counted
+"""
+CREATE TABLE IF NOT EXISTS gene_type_counts_coded (
+	gene_symbol VARCHAR(64),
+	assembly_code INTEGER REFERENCES assembly_code(code),
+	type_code INTEGER NOT NULL REFERENCES type_code(code),
+	variants INTEGER NOT NULL,
+	UNIQUE (gene_symbol, assembly_code, type_code)
 )
 """
+,
+"""
+CREATE TABLE IF NOT EXISTS chro_counts_coded (
+	assembly_code INTEGER REFERENCES assembly_code(code),
+	chro_code INTEGER NOT NULL REFERENCES chro_code(code),
+	variants INTEGER NOT NULL,
+	UNIQUE (assembly_code, chro_code)
+)
+"""
+,
+"""
+CREATE TABLE IF NOT EXISTS snv_allele_counts_coded (
+	assembly_code INTEGER REFERENCES assembly_code(code),
+	type_code INTEGER NOT NULL REFERENCES type_code(code),
+	ref_allele VARCHAR(64),
+	alt_allele VARCHAR(64),
+	variants INTEGER NOT NULL,
+	UNIQUE (assembly_code, type_code, ref_allele, alt_allele)
+)
+"""
+,
+# The views keep the original tables, with their text columns, for
+# the queries. SQLite flattens the views, so a filter on a text value
+# becomes a lookup of its code followed by an integer comparison.
+# Long texts are stored once, in the text_store table, and short ones
+# stay inline, so the variant view takes whichever of both is set
+"""
+CREATE VIEW IF NOT EXISTS variant AS
+SELECT
+	v.ventry_id,
+	v.allele_id,
+	COALESCE(v.name_inline, nt.content) AS name,
+	t.type,
+	v.dbSNP_id,
+	COALESCE(v.phenotype_list_inline, pt.content) AS phenotype_list,
+	v.gene_id,
+	v.gene_symbol,
+	v.HGNC_ID,
+	a.assembly,
+	c.chro,
+	v.chro_start,
+	v.chro_stop,
+	v.ref_allele,
+	v.alt_allele,
+	v.cytogenetic,
+	v.variation_id
+FROM variant_coded v
+JOIN type_code t ON t.code = v.type_code
+LEFT JOIN assembly_code a ON a.code = v.assembly_code
+JOIN chro_code c ON c.code = v.chro_code
+LEFT JOIN text_store nt ON nt.text_id = v.name_text_id
+LEFT JOIN text_store pt ON pt.text_id = v.phenotype_list_text_id
+"""
+,
+"""
+CREATE VIEW IF NOT EXISTS gene_type_counts AS
+SELECT g.gene_symbol, a.assembly, t.type, g.variants
+FROM gene_type_counts_coded g
+LEFT JOIN assembly_code a ON a.code = g.assembly_code
+JOIN type_code t ON t.code = g.type_code
+"""
+,
+"""
+CREATE VIEW IF NOT EXISTS chro_counts AS
+SELECT a.assembly, c.chro, cc.variants
+FROM chro_counts_coded cc
+LEFT JOIN assembly_code a ON a.code = cc.assembly_code
+JOIN chro_code c ON c.code = cc.chro_code
+"""
+,
+"""
+CREATE VIEW IF NOT EXISTS snv_allele_counts AS
+SELECT a.assembly, t.type, s.ref_allele, s.alt_allele, s.variants
+FROM snv_allele_counts_coded s
+LEFT JOIN assembly_code a ON a.code = s.assembly_code
+JOIN type_code t ON t.code = s.type_code
+"""
+,
+"""
+CREATE VIEW IF NOT EXISTS clinical_sig AS
+SELECT cs.ventry_id, sc.significance
+FROM clinical_sig_coded cs
+JOIN significance_code sc ON sc.code = cs.significance_code
+"""
+,
+"""
+CREATE VIEW IF NOT EXISTS review_status AS
+SELECT rs.ventry_id, stc.status
+FROM review_status_coded rs
+JOIN status_code stc ON stc.code = rs.status_code
+"""
+,
+"""
+CREATE VIEW IF NOT EXISTS variant_phenotypes AS
+SELECT vp.ventry_id, vp.phen_group_id, pc.phen_ns, vp.phen_id
+FROM variant_phenotypes_coded vp
+JOIN phen_ns_code pc ON pc.code = vp.phen_ns_code
+"""
+]
+
+# Columns holding a text_id of the text_store, as (table, column)
+# pairs. Short texts go instead to the _inline columns next to them
+CLINVAR_TEXT_REFERENCES = [
+	("variant_coded", "name_text_id"),
+	("variant_coded", "phenotype_list_text_id"),
+]
+
+# Dictionary encoded columns, as (lookup table, value column) pairs.
+# The codes are handed out by an InternCache while loading
+CLINVAR_CODE_TABLES = {
+	"assembly": ("assembly_code", "assembly"),
+	"type": ("type_code", "type"),
+	"chro": ("chro_code", "chro"),
+	"significance": ("significance_code", "significance"),
+	"status": ("status_code", "status"),
+	"phen_ns": ("phen_ns_code", "phen_ns"),
+}
+
+# Indexes are declared apart, as they are built once the data is loaded
+CLINVAR_INDEX_DEFS = [
+"""
+CREATE INDEX IF NOT EXISTS coords_variant ON variant_coded(chro_start,chro_stop,chro_code)
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS assembly_variant ON variant_coded(assembly_code)
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS gene_symbol_variant ON variant_coded(gene_symbol)
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS gene_symbol_gene2variant ON gene2variant(gene_symbol,ventry_id)
+"""
+,
+# Removing a text from text_store looks for the variants still using
+# it, as their foreign key asks. Most texts are inline, so the indexes
+# only hold the variants with a stored one
+"""
+CREATE INDEX IF NOT EXISTS name_text_variant ON variant_coded(name_text_id) WHERE name_text_id IS NOT NULL
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS phenotype_list_text_variant ON variant_coded(phenotype_list_text_id) WHERE phenotype_list_text_id IS NOT NULL
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS significance_clinical_sig ON clinical_sig_coded(significance_code,ventry_id)
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS status_review_status ON review_status_coded(status_code,ventry_id)
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS phen_variant_phenotypes ON variant_phenotypes_coded(phen_ns_code,phen_id,ventry_id)
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS type_gene_type_counts ON gene_type_counts_coded(assembly_code,type_code)
+"""
+,
+"""
+CREATE INDEX IF NOT EXISTS key_variant_hash ON variant_hash(variation_id,allele_id,assembly,occurrence)
+"""
+]
+
+# Full-text indexes, as (fts table, content table, key column,
+# [columns], physical table)
+CLINVAR_FTS_DEFS = [
+	("variant_fts", "variant", "ventry_id", ["name", "phenotype_list"], "variant_coded"),
+]
+
+# Aggregate tables, as (aggregate table, source table, [key columns],
+# condition on the {row} counted)
+CLINVAR_AGGREGATE_DEFS = [
+	("gene_type_counts_coded", "gene2variant", ["gene_symbol",
+		("assembly_code", "(SELECT assembly_code FROM variant_coded WHERE ventry_id = {row}.ventry_id)"),
+		("type_code", "(SELECT type_code FROM variant_coded WHERE ventry_id = {row}.ventry_id)")], None),
+	("chro_counts_coded", "variant_coded", ["assembly_code", "chro_code"], None),
+	("snv_allele_counts_coded", "variant_coded", ["assembly_code", "type_code", "ref_allele", "alt_allele"],
+		"{row}.type_code IN (SELECT code FROM type_code WHERE type = 'single nucleotide variant')"),
+]
+
+# Loci kept in the R*Tree coordinate indexes, as (assembly,
+# chromosome, start, stop) columns of the variant table
+CLINVAR_COORD_LOCI = [
+	("assembly", "chro", "chro_start", "chro_stop"),
+]
+
+# Approximate size of a variant_summary row, once gzipped, used to
+# guess how many rows a load will bring
+CLINVAR_GZ_BYTES_PER_ROW = 60
+
+# Child tables clustered on their primary key, led by ventry_id, as
+# (table, primary key columns) pairs
+CLINVAR_CLUSTERED_TABLES = [
+	("clinical_sig_coded", "ventry_id, significance_code"),
+	("review_status_coded", "ventry_id, status_code"),
+	("variant_phenotypes_coded", "ventry_id, phen_group_id, phen_ns_code, phen_id"),
+	("gene2variant", "ventry_id, gene_symbol"),
 ]
 
+def set_aside_rowid_tables(cur):
+	"""
+		Renames the child tables of databases loaded before they
+		were WITHOUT ROWID ones, so they can be declared again.
+		Returns the tables set aside
+	"""
+	aside = []
+	for table, _ in CLINVAR_CLUSTERED_TABLES:
+		cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+		found = cur.fetchone()
+		if found is not None and "WITHOUT ROWID" not in found[0].upper():
+			# The views keep pointing to the table name, not to the
+			# renamed table
+			cur.execute("PRAGMA legacy_alter_table=ON")
+			cur.execute("ALTER TABLE {0} RENAME TO {0}_rowid".format(table))
+			cur.execute("PRAGMA legacy_alter_table=OFF")
+			aside.append(table)
+	
+	return aside
+
+def copy_rowid_tables(db, aside):
+	"""
+		Copies the rows of the tables set aside into their new
+		declarations, in key order, and drops them with their indexes.
+		Rows repeating a key are copied once, and counted
+	"""
+	keys = dict(CLINVAR_CLUSTERED_TABLES)
+	with db:
+		for table in aside:
+			cur = db.execute("SELECT COUNT(*) FROM {}_rowid".format(table))
+			rows = cur.fetchone()[0]
+			cur = db.execute("INSERT OR IGNORE INTO {0} SELECT * FROM {0}_rowid ORDER BY {1}".format(table, keys[table]))
+			if cur.rowcount < rows:
+				print("{}: {} repeated rows dropped while clustering the table".format(table, rows - cur.rowcount), file=sys.stderr)
+			db.execute("DROP TABLE {}_rowid".format(table))
+
 # Clinvar file open function
-def open_clinvar_db(db_file):
+def open_clinvar_db(db_file,profile=DEFAULT_LOAD_PROFILE):
 	"""
 		This method creates a SQLITE3 database with the needed
 		tables to store clinvar data, or opens it if it already
-		exists
+		exists. The connection is tuned with the given load profile
 	"""
 	# SQLite3 connection
 	db = sqlite3.connect(db_file)
+	apply_load_profile(db,profile)
 	
 	cur = db.cursor()
 	try:
 		# Foreign keys integrity checks
 		cur.execute("PRAGMA FOREIGN_KEYS=ON")
 		
+		# Databases loaded before the dictionary encoding have plain
+		# tables where the views should be
+		cur.execute("SELECT type FROM sqlite_master WHERE name = 'variant'")
+		found = cur.fetchone()
+		if found is not None and found[0] == "table":
+			raise ValueError("{} holds the plain text ClinVar tables, it has to be loaded from scratch".format(db_file))
+		
+		# The gene table used to require ids, back when it was never
+		# filled. Genes only found in multi-gene rows have none, so
+		# the empty table of those databases is declared again
+		cur.execute("SELECT COUNT(*) FROM pragma_table_info('gene') WHERE name = 'HGNC_ID' AND \"notnull\"")
+		if cur.fetchone()[0] > 0:
+			cur.execute("SELECT EXISTS(SELECT 1 FROM gene)")
+			if not cur.fetchone()[0]:
+				cur.execute("DROP TABLE IF EXISTS gene2variant")
+				cur.execute("DROP TABLE gene")
+		
+		# Short texts used to go to the text_store too. The inline
+		# columns are added, and the view reading them declared again
+		cur.execute("SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'variant_coded') AND NOT EXISTS(SELECT 1 FROM pragma_table_info('variant_coded') WHERE name = 'name_inline')")
+		if cur.fetchone()[0]:
+			cur.execute("ALTER TABLE variant_coded ADD COLUMN name_inline VARCHAR(64)")
+			cur.execute("ALTER TABLE variant_coded ADD COLUMN phenotype_list_inline VARCHAR(64)")
+			cur.execute("DROP VIEW IF EXISTS variant")
+		
+		# The child tables used to be rowid tables, with an index
+		# on ventry_id
+		aside = set_aside_rowid_tables(cur)
+		
 		# Table declaration
+		create_text_store(db)
 		for tableDecl in CLINVAR_TABLE_DEFS:
 			cur.execute(tableDecl)
+		create_fts_tables(db,CLINVAR_FTS_DEFS)
+		
+		copy_rowid_tables(db,aside)
 	
 	# Exception prompt if no table is to be declared
 	except sqlite3.Error as e:
@@ -137,189 +493,780 @@ def open_clinvar_db(db_file):
 	
 	return db
 
+# Number of variant rows buffered before every flush to the database
+DEFAULT_BATCH_SIZE = 20000
+
+# Insert statements used by the batched writer. The ventry_id is
+# assigned by the loader, so child rows can be linked without
+# asking SQLite for lastrowid after every single insert. They come
+# in ventry_id order, so the child tables, clustered on it, grow at
+# their end. The children ignore a value repeated within a row,
+# so flush_clinvar_batch can count it
+INSERT_VARIANT = """
+	INSERT INTO variant_coded(
+		ventry_id,
+		allele_id,
+		name_text_id,
+		type_code,
+		dbsnp_id,
+		phenotype_list_text_id,
+		gene_id,
+		gene_symbol,
+		hgnc_id,
+		assembly_code,
+		chro_code,
+		chro_start,
+		chro_stop,
+		ref_allele,
+		alt_allele,
+		cytogenetic,
+		variation_id,
+		name_inline,
+		phenotype_list_inline)
+	VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+INSERT_CLINICAL_SIG = """
+	INSERT OR IGNORE INTO clinical_sig_coded(
+		ventry_id,
+		significance_code)
+	VALUES(?,?)
+"""
+
+INSERT_REVIEW_STATUS = """
+	INSERT OR IGNORE INTO review_status_coded(
+		ventry_id,
+		status_code)
+	VALUES(?,?)
+"""
+
+INSERT_VARIANT_PHENOTYPES = """
+	INSERT OR IGNORE INTO variant_phenotypes_coded(
+		ventry_id,
+		phen_group_id,
+		phen_ns_code,
+		phen_id)
+	VALUES(?,?,?,?)
+"""
+
+def next_ventry_id(cur):
+	"""
+		Returns the ventry_id that the AUTOINCREMENT column of
+		the variant table would hand out next
+	"""
+	# AUTOINCREMENT never reuses an id, even from deleted rows,
+	# so both the sequence and the current maximum are checked
+	cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'variant_coded'")
+	seqRow = cur.fetchone()
+	cur.execute("SELECT MAX(ventry_id) FROM variant_coded")
+	maxRow = cur.fetchone()
+	
+	last_id = max(seqRow[0] if seqRow is not None else 0, maxRow[0] or 0)
+	
+	return last_id + 1
+
+UPDATE_VARIANT = """
+	UPDATE variant_coded SET
+		allele_id = ?,
+		name_text_id = ?,
+		type_code = ?,
+		dbsnp_id = ?,
+		phenotype_list_text_id = ?,
+		gene_id = ?,
+		gene_symbol = ?,
+		hgnc_id = ?,
+		assembly_code = ?,
+		chro_code = ?,
+		chro_start = ?,
+		chro_stop = ?,
+		ref_allele = ?,
+		alt_allele = ?,
+		cytogenetic = ?,
+		variation_id = ?,
+		name_inline = ?,
+		phenotype_list_inline = ?
+	WHERE ventry_id = ?
+"""
+
+# Rows are replaced when an incremental update finds them changed
+INSERT_GENE2VARIANT = """
+	INSERT INTO gene2variant(
+		gene_symbol,
+		ventry_id)
+	VALUES(?,?)
+"""
+
+INSERT_VARIANT_HASH = """
+	INSERT OR REPLACE INTO variant_hash(
+		ventry_id,
+		variation_id,
+		allele_id,
+		assembly,
+		occurrence,
+		row_hash)
+	VALUES(?,?,?,?,?,?)
+"""
+
+SELECT_VARIANT_HASH = """
+	SELECT ventry_id, row_hash
+	FROM variant_hash
+	WHERE variation_id = ?
+	AND allele_id = ?
+	AND assembly IS ?
+	AND occurrence = ?
+"""
+
+# Tables whose rows hang from a variant, and are rewritten with it
+CLINVAR_CHILD_TABLES = ["clinical_sig_coded", "review_status_coded", "variant_phenotypes_coded", "gene2variant"]
+
+# Tables whose rows are counted by the load stats
+CLINVAR_LOADED_TABLES = ["variant_coded"] + CLINVAR_CHILD_TABLES + ["gene", "variant_hash", "text_store"]
+
+# Separator of the symbols of a variant spanning several genes
+GENE_SYMBOL_SEP = ";"
+
+def new_clinvar_batch():
+	"""
+		Empty buffers for the rows waiting to be flushed
+	"""
+	return {
+		# New variants, and changed ones (with ventry_id at the end)
+		"variant": [],
+		"variant_update": [],
+		# Variants whose child rows are replaced
+		"rewritten": [],
+		"clinical_sig_coded": [],
+		"review_status_coded": [],
+		"variant_phenotypes_coded": [],
+		"gene2variant": [],
+		"variant_hash": [],
+		# Already known variants found again in the file
+		"seen": [],
+	}
+
+class InternCache(object):
+	"""
+		In-memory copy of a lookup table. It hands out the code of
+		a value, adding the value to the table the first time it
+		is seen, so the strings of each row are never written
+	"""
+	def __init__(self, db, table, column):
+		self.cur = db.cursor()
+		self.insert = "INSERT INTO {}({}) VALUES(?)".format(table, column)
+		self.cur.execute("SELECT {}, code FROM {}".format(column, table))
+		self.codes = dict(self.cur.fetchall())
+	
+	def code(self, value):
+		if value is None:
+			return None
+		code = self.codes.get(value)
+		if code is None:
+			self.cur.execute(self.insert, (value,))
+			code = self.cur.lastrowid
+			self.codes[value] = code
+		
+		return code
+
+class GeneCache(object):
+	"""
+		In-memory copy of the gene table. It hands out the symbols of
+		the genes of a row, adding each gene to the table the first
+		time it is seen. Rows of variants spanning several genes list
+		all their symbols, and have neither GeneID nor HGNC_ID, which
+		are filled in later when a row of a single gene brings them
+	"""
+	def __init__(self, db):
+		self.cur = db.cursor()
+		self.cur.execute("SELECT gene_symbol, gene_id, HGNC_ID FROM gene")
+		self.genes = { symbol: (gene_id, hgnc_id)  for symbol, gene_id, hgnc_id in self.cur }
+	
+	def symbols(self, gene_id, gene_symbol, hgnc_id):
+		if gene_symbol is None:
+			return []
+		# Repeated symbols are listed once
+		symbols = [ symbol  for symbol in dict.fromkeys(gene_symbol.split(GENE_SYMBOL_SEP)) if symbol != "" ]
+		if len(symbols) > 1 or (gene_id is not None and gene_id < 0):
+			gene_id = None
+			hgnc_id = None
+		
+		for symbol in symbols:
+			known = self.genes.get(symbol)
+			if known is None:
+				self.cur.execute("INSERT INTO gene(gene_id, gene_symbol, HGNC_ID) VALUES(?,?,?)", (gene_id, symbol, hgnc_id))
+				self.genes[symbol] = (gene_id, hgnc_id)
+			elif known[0] is None and gene_id is not None:
+				self.cur.execute("UPDATE gene SET gene_id = ?, HGNC_ID = ? WHERE gene_symbol = ?", (gene_id, hgnc_id, symbol))
+				self.genes[symbol] = (gene_id, hgnc_id)
+		
+		return symbols
+
+def backfill_gene2variant(cur, genes):
+	"""
+		Links the genes of the variants loaded before gene2variant
+		was filled, so later loads find them as a new load leaves them
+	"""
+	cur.execute("SELECT EXISTS(SELECT 1 FROM variant_coded WHERE gene_symbol IS NOT NULL) AND NOT EXISTS(SELECT 1 FROM gene2variant)")
+	if not cur.fetchone()[0]:
+		return
+	
+	cur.execute("SELECT ventry_id, gene_id, gene_symbol, HGNC_ID FROM variant_coded WHERE gene_symbol IS NOT NULL ORDER BY ventry_id")
+	links = [ (symbol, ventry_id)  for ventry_id, gene_id, gene_symbol, hgnc_id in cur.fetchall() for symbol in genes.symbols(gene_id, gene_symbol, hgnc_id) ]
+	cur.executemany(INSERT_GENE2VARIANT, links)
+
+def has_variant_references(cur):
+	"""
+		Tells whether the citations of clinvar_reference_parser.py are
+		in the database, linked to the variants through variant_reference
+	"""
+	cur.execute("SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'variant_reference')")
+	return cur.fetchone()[0] != 0
+
+def link_variant_references(cur, after_id, last_id):
+	"""
+		Links the new variants, those with a ventry_id in
+		(after_id, last_id], to the citations of their allele
+	"""
+	cur.execute("""
+		INSERT OR IGNORE INTO variant_reference(ventry_id, reference_id)
+		SELECT v.ventry_id, r.ventry_id
+		FROM variant_coded v
+		JOIN reference r ON r.allele_id = v.allele_id
+		WHERE v.ventry_id > ?
+		AND v.ventry_id <= ?
+	""", (after_id, last_id))
+
+def open_intern_caches(db):
+	"""
+		One InternCache per dictionary encoded column
+	"""
+	return { domain: InternCache(db, table, column)  for domain, (table, column) in CLINVAR_CODE_TABLES.items() }
+
+def encode_variant_values(variant_values, caches, texts):
+	"""
+		Replaces type, assembly and chromosome with their codes, and
+		the name and the phenotype list with their text_id, or moves
+		them to the inline columns at the end when they are short
+	"""
+	name_inline, name_text_id = texts.reference(variant_values[1])
+	phenotype_list_inline, phenotype_list_text_id = texts.reference(variant_values[4])
+	return (variant_values[0],
+		name_text_id,
+		caches["type"].code(variant_values[2]),
+		variant_values[3],
+		phenotype_list_text_id) + variant_values[5:8] + (
+		caches["assembly"].code(variant_values[8]),
+		caches["chro"].code(variant_values[9])) + variant_values[10:] + (
+		name_inline,
+		phenotype_list_inline)
+
+def add_clinvar_children(batch, ventry_id, record, caches, genes):
+	"""
+		Buffers the child rows of a parsed record, already encoded
+	"""
+	variant_values, significances, statuses, phenotypes = record
+	batch["gene2variant"].extend( (symbol, ventry_id)  for symbol in genes.symbols(variant_values[5], variant_values[6], variant_values[7]) )
+	sigCode = caches["significance"].code
+	statusCode = caches["status"].code
+	nsCode = caches["phen_ns"].code
+	batch["clinical_sig_coded"].extend( (ventry_id, sigCode(sig))  for sig in significances )
+	batch["review_status_coded"].extend( (ventry_id, statusCode(status))  for status in statuses )
+	batch["variant_phenotypes_coded"].extend( (ventry_id, phen_group_id, nsCode(phen_ns), phen_id)  for phen_group_id, phen_ns, phen_id in phenotypes )
+
+def clinvar_row_hash(record):
+	"""
+		Content hash of a parsed record, used to tell whether a
+		variant changed between two releases
+	"""
+	return hashlib.blake2b(repr(record).encode("utf-8"), digest_size=16).digest()
+
+def flush_clinvar_batch(cur, batch):
+	"""
+		Writes the buffered rows, one executemany per table and
+		kind of change, and empties the buffers so they can be reused.
+		Returns the child rows dropped as repeats within a variant
+	"""
+	# Old children of changed variants go first, while the variants
+	# still hold the assembly and type their gene counts were kept by
+	for childTable in CLINVAR_CHILD_TABLES:
+		cur.executemany("DELETE FROM {} WHERE ventry_id = ?".format(childTable), batch["rewritten"])
+	
+	# Then the parents, so the foreign keys of the children are satisfied
+	cur.executemany(INSERT_VARIANT, batch["variant"])
+	cur.executemany(UPDATE_VARIANT, batch["variant_update"])
+	
+	repeated = 0
+	for insert, childTable in ((INSERT_CLINICAL_SIG, "clinical_sig_coded"), (INSERT_REVIEW_STATUS, "review_status_coded"), (INSERT_VARIANT_PHENOTYPES, "variant_phenotypes_coded")):
+		cur.executemany(insert, batch[childTable])
+		repeated += len(batch[childTable]) - cur.rowcount
+	cur.executemany(INSERT_GENE2VARIANT, batch["gene2variant"])
+	cur.executemany(INSERT_VARIANT_HASH, batch["variant_hash"])
+	cur.executemany("INSERT INTO temp.seen_ventry(ventry_id) VALUES(?)", batch["seen"])
+	
+	for rows in batch.values():
+		rows.clear()
+	
+	return repeated
+
+def allele_occurrences(cur, ventry_id):
+	"""
+		Returns the allele of a loaded variant and, for each key
+		already loaded for that allele, its next occurrence number
+	"""
+	cur.execute("SELECT allele_id FROM variant_hash WHERE ventry_id = ?", (ventry_id,))
+	allele_id = cur.fetchone()[0]
+	cur.execute("""
+		SELECT variation_id, allele_id, assembly, MAX(occurrence) + 1
+		FROM variant_hash
+		WHERE allele_id = ?
+		GROUP BY variation_id, allele_id, assembly
+	""", (allele_id,))
+	
+	return allele_id, { tuple(row[:3]): row[3]  for row in cur }
+
+def delete_retired_variants(cur, last_known_id):
+	"""
+		Removes the variants, up to last_known_id, which were not
+		found again by an incremental update, with all their rows.
+		Returns the ventry_id of those removed
+	"""
+	cur.execute("DROP TABLE IF EXISTS temp.retired_ventry")
+	cur.execute("""
+		CREATE TEMP TABLE retired_ventry AS
+		SELECT ventry_id
+		FROM variant_hash
+		WHERE ventry_id <= ?
+		AND ventry_id NOT IN (SELECT ventry_id FROM temp.seen_ventry)
+	""", (last_known_id,))
+	
+	for table in CLINVAR_CHILD_TABLES + ["variant_hash", "variant_coded"]:
+		cur.execute("DELETE FROM {} WHERE ventry_id IN (SELECT ventry_id FROM temp.retired_ventry)".format(table))
+	
+	cur.execute("SELECT ventry_id FROM temp.retired_ventry")
+	retired = [ ventry_id  for ventry_id, in cur ]
+	cur.execute("DROP TABLE temp.retired_ventry")
+	
+	return retired
+
+# Lines handed to a worker process at a time in parallel mode
+PARALLEL_CHUNK_LINES = 2000
+
+# Columns of variant_summary used by the loader. The first ones go,
+# in this same order, to the variant table
+CLINVAR_COLUMNS = [
+	("AlleleID", INT),
+	("Name", TEXT),
+	("Type", TEXT),
+	("RS# (dbSNP)", NULLABLE_INT),
+	("PhenotypeList", TEXT),
+	("GeneID", NULLABLE_INT),
+	("GeneSymbol", TEXT),
+	("HGNC_ID", TEXT),
+	("Assembly", TEXT),
+	("Chromosome", TEXT),
+	("Start", NULLABLE_INT),
+	("Stop", NULLABLE_INT),
+	# Files with VCF coordinates have their own reference and
+	# alternate allele columns, which are preferred. 'PositionVCF'
+	# might be more important than 'Start', but it is ignored for now
+	(("ReferenceAlleleVCF", "ReferenceAllele"), TEXT),
+	(("AlternateAlleleVCF", "AlternateAllele"), TEXT),
+	("Cytogenetic", TEXT),
+	("VariationID", INT),
+	("ClinicalSignificance", TEXT),
+	("ReviewStatus", TEXT),
+	("PhenotypeIDS", TEXT),
+]
+
+VARIANT_COLUMN_COUNT = 16
+
+# Phenotype groups are separated by ';' or '|'
+PHENO_GROUP_SEP_RE = re.compile(r"[;|]")
+# Placeholder ClinVar uses instead of listing too many phenotypes
+LONG_PHENOTYPES_RE = re.compile(r"^[1-9][0-9]* conditions$")
+
+def compile_clinvar_decoder(columnNames):
+	"""
+		Compiles the row decoder for a variant_summary header
+	"""
+	return compile_row_decoder(columnNames, CLINVAR_COLUMNS, CLINVAR_NULLS)
+
+def parse_clinvar_line(line, decode_row, stats=NULL_LOAD_STATS):
+	"""
+		Parses a data line of variant_summary into a record with
+		the variant values (without ventry_id), the clinical
+		significances, the review statuses and the phenotypes
+	"""
+	previous = stats.switch("decode")
+	row = decode_row(line)
+	
+	# Table variation
+	variant_values = row[:VARIANT_COLUMN_COUNT]
+	allele_id = row[0]
+	assembly = row[8]
+	
+	significance, status_str, variant_pheno_str = row[VARIANT_COLUMN_COUNT:]
+	
+	# Clinical significance
+	significances = []
+	if significance is not None:
+		significances = significance.split("/")
+	
+	# Review status
+	statuses = []
+	if status_str is not None:
+		statuses = status_str.split(", ")
+	
+	# Variant Phenotypes
+	stats.switch("phenotypes")
+	phenotypes = []
+	if variant_pheno_str is not None:
+		variant_pheno_list = PHENO_GROUP_SEP_RE.split(variant_pheno_str)
+		for phen_group_id, variant_pheno in enumerate(variant_pheno_list):
+			if len(variant_pheno) == 0:
+				continue
+			if LONG_PHENOTYPES_RE.search(variant_pheno):
+				print("INFO: Long PhenotypeIDs {} {}: {}".format(allele_id, assembly, variant_pheno))
+				stats.quarantine("long_phenotype_ids")
+				continue
+			variant_annots = variant_pheno.split(",")
+			for variant_annot in variant_annots:
+				phen = variant_annot.split(":")
+				if len(phen) > 1:
+					phen_ns , phen_id = phen[0:2]
+					phenotypes.append((phen_group_id,phen_ns,phen_id))
+				elif variant_annot != "na":
+					print("DEBUG: {} {} {}\n\t{}\n\t{}".format(allele_id,assembly,variant_annot,variant_pheno_str,line),file=sys.stderr)
+					stats.quarantine("unparsed_phenotype_annotation")
+	stats.switch(previous)
+	
+	return variant_values, significances, statuses, phenotypes
+
+# Row decoder of the file being parsed, compiled by each worker process
+_worker_decoder = None
+
+def _init_parse_worker(columnNames):
+	global _worker_decoder
+	_worker_decoder = compile_clinvar_decoder(columnNames)
+
+def _parse_clinvar_chunk(lines):
+	return [ parse_clinvar_line(line, _worker_decoder) for line in lines ]
+
+def read_line_chunks(cf, chunk_lines=PARALLEL_CHUNK_LINES):
+	"""
+		Groups the lines of the file into lists of chunk_lines lines
+	"""
+	chunk = []
+	for line in cf:
+		chunk.append(line)
+		if len(chunk) >= chunk_lines:
+			yield chunk
+			chunk = []
+	if len(chunk) > 0:
+		yield chunk
+
+def parse_clinvar_records(cf, columnNames, workers=1, stats=NULL_LOAD_STATS):
+	"""
+		Yields the parsed records of the data lines, in file order.
+		With more than one worker, the parsing is spread over a pool
+		of processes, while the caller keeps being the only writer.
+		Only a serial parse tells the decoding and the phenotypes
+		apart in the stats, as the workers do not keep any
+	"""
+	if workers <= 1:
+		decode_row = compile_clinvar_decoder(columnNames)
+		for line in cf:
+			yield parse_clinvar_line(line, decode_row, stats)
+		return
+	
+	with multiprocessing.Pool(workers, initializer=_init_parse_worker, initargs=(columnNames,)) as pool:
+		# A bounded window of chunks is in flight, so memory does not
+		# grow with the file, and results are consumed in submission
+		# order, so the ventry_id assignment matches a serial run
+		pending = collections.deque()
+		for chunk in read_line_chunks(cf):
+			pending.append(pool.apply_async(_parse_clinvar_chunk, (chunk,)))
+			if len(pending) >= 2 * workers:
+				yield from pending.popleft().get()
+		while len(pending) > 0:
+			yield from pending.popleft().get()
+
+def pipelined_clinvar_records(cf, columnNames, pipeline_stats):
+	"""
+		Yields the parsed records of a binary variant_summary
+		stream, decompressed and parsed by the pipeline threads
+	"""
+	decode_row = compile_clinvar_decoder(columnNames)
+	
+	def parse_block(block):
+		return [ parse_clinvar_line(line, decode_row) for line in block_lines(block) ]
+	
+	for records in run_pipeline(cf, parse_block, pipeline_stats):
+		yield from records
+
 # Main data input function	
-def store_clinvar_file(db,clinvar_file):
+def store_clinvar_file(db,clinvar_file,batch_size=DEFAULT_BATCH_SIZE,workers=1,pipeline=False,incremental=False,checkpoint_rows=DEFAULT_CHECKPOINT_ROWS,resume=False,stats=NULL_LOAD_STATS,progress=False,decompression=DEFAULT_DECOMPRESSION):
+	"""
+		Loads a variant_summary file. In incremental mode, the rows
+		already in the database are matched by (VariationID, AlleleID,
+		Assembly): new rows are inserted, changed ones are rewritten,
+		unchanged ones are left alone and the missing ones are removed.
+		The work is committed every checkpoint_rows rows, and a resumed
+		load starts from the last commit of the previous one.
+		stats receives the figures of a LoadStats report, and with
+		progress the rows, speed and ETA are shown as the load goes.
+		decompression is the backend which decompresses the file
+	"""
+	
+	# The retired variants are only known at the end of an incremental
+	# update, but running it again after a crash gives the same result
+	if resume and incremental:
+		raise ValueError("Incremental updates cannot be resumed, they can be run again instead")
+	
+	stats.begin(db,CLINVAR_LOADED_TABLES)
+	line_offset, last_ventry_id = start_checkpoint(db,"variant","ventry_id",clinvar_file,resume)
+	
+	# Open the file, decompressed by the chosen backend. The pipeline
+	# decodes the text itself, in big blocks, so it reads raw bytes
+	gz = open_decompressed(clinvar_file,decompression)
+	cf = gz if pipeline else wrap_text_input(gz,stats,"decompress")
 	
-	# Open file in gzip format, stablish encoding
-	with gzip.open(clinvar_file,"rt",encoding="utf-8") as cf:
+	with cf:
 		
-		# Set header as none, in order to map it afterwards
-		headerMapping = None
+		# The first line is the header, which tells where each column is
+		header = next(cf)
 		
-		# This variable teaches the code that the file being
-		# parsed has new VCF coordinate, reference and alternate
-		# allele columns
-		newVCFCoords = False
+		# Lines already loaded by the run being resumed
+		with stats.stage("skip"):
+			skip_lines(cf,line_offset)
+		stats.count("skipped_rows",line_offset)
+		
+		tracker = start_progress("variant_summary",clinvar_file,gz.compressed_position,stats,show=progress)
+		
+		if pipeline:
+			columnNames = header_columns(header.decode("utf-8"))
+			pipeline_stats = {}
+			records = stats.timed(pipelined_clinvar_records(cf,columnNames,pipeline_stats),"parse")
+		elif workers > 1:
+			columnNames = header_columns(header)
+			records = stats.timed(parse_clinvar_records(cf,columnNames,workers),"parse")
+		else:
+			columnNames = header_columns(header)
+			records = parse_clinvar_records(stats.timed(cf,"decode"),columnNames,stats=stats)
 		
 		cur = db.cursor()
 		
+		# Rows waiting to be flushed
+		batch = new_clinvar_batch()
+		counts = { "new": 0, "changed": 0, "unchanged": 0, "retired": 0 }
+		# Variants whose loci changed or went away in an incremental update
+		changed_ids = []
+		retired_ids = []
+		# Significances, review statuses and phenotypes repeated within
+		# a variant, kept once
+		repeated_rows = 0
+		
 		with db:
-			for line in cf:
-				# First, let's remove the newline
-				wline = line.rstrip("\n")
+			if incremental:
+				# Rows are looked up by key, so every index has to be there,
+				# and the full-text index and the counts follow the changes
+				# as they happen
+				create_indexes(db,CLINVAR_INDEX_DEFS)
+				sync_fts(db,CLINVAR_FTS_DEFS)
+				sync_aggregates(db,CLINVAR_AGGREGATE_DEFS)
+				cur.execute("SELECT EXISTS(SELECT 1 FROM variant_coded) AND NOT EXISTS(SELECT 1 FROM variant_hash)")
+				if cur.fetchone()[0]:
+					raise ValueError("The variants of {} have no row hashes, so it needs a full load".format(clinvar_file))
+			else:
+				# Indexes are only kept during the load when it is a small
+				# append to a bigger table, otherwise they are rebuilt later
+				incoming_rows = estimate_incoming_rows(clinvar_file,CLINVAR_GZ_BYTES_PER_ROW)
+				if should_rebuild_indexes(db,"variant_coded",incoming_rows):
+					drop_indexes(db,CLINVAR_INDEX_DEFS)
+					drop_fts_triggers(db,CLINVAR_FTS_DEFS)
+					drop_aggregate_triggers(db,CLINVAR_AGGREGATE_DEFS)
+			
+			cur.execute("CREATE TEMP TABLE IF NOT EXISTS seen_ventry(ventry_id INTEGER PRIMARY KEY)")
+			cur.execute("DELETE FROM temp.seen_ventry")
+			
+			ventry_id = next_ventry_id(cur) - 1
+			last_known_id = ventry_id
+			
+			# Codes of the dictionary encoded columns, genes and ids of the texts
+			caches = open_intern_caches(db)
+			genes = GeneCache(db)
+			texts = TextStore(db)
+			
+			# Variants loaded before gene2variant was filled get their genes
+			backfill_gene2variant(cur,genes)
+			
+			# Citations loaded before the variants get linked to the new
+			# ones at every checkpoint, so a resumed load misses none
+			link_references = has_variant_references(cur)
+			linked_id = ventry_id
+			
+			# Rows of an allele are contiguous in the file. Repeated
+			# keys within them are told apart by their occurrence
+			group_allele_id = None
+			group_keys = {}
+			if last_ventry_id is not None:
+				# The checkpoint may fall in the middle of an allele
+				group_allele_id, group_keys = allele_occurrences(cur,last_ventry_id)
+			
+			loaded_rows = 0
+			stats.switch("encode")
+			for record in records:
+				variant_values = record[0]
+				allele_id = variant_values[0]
+				key = (variant_values[15], allele_id, variant_values[8])
+				if allele_id != group_allele_id:
+					group_allele_id = allele_id
+					group_keys = {}
+				occurrence = group_keys.get(key, 0)
+				group_keys[key] = occurrence + 1
 				
-				# Now, detecting the header
-				if (headerMapping is None) and (wline[0] == '#'):
-					wline = wline.lstrip("#")
-					columnNames = re.split(r"\t",wline)
-					
-					headerMapping = {}
-					# And we are saving the correspondence of column name and id
-					for columnId, columnName in enumerate(columnNames):
-						headerMapping[columnName] = columnId
+				row_hash = clinvar_row_hash(record)
+				
+				known = None
+				if incremental:
+					cur.execute(SELECT_VARIANT_HASH, key + (occurrence,))
+					known = cur.fetchone()
+				
+				if known is None:
+					# The ventry_id is assigned here, following the same
+					# sequence AUTOINCREMENT would have used
+					ventry_id += 1
 					
-					newVCFCoords = 'PositionVCF' in headerMapping
-					if newVCFCoords:
-						refAlleleCol = headerMapping["ReferenceAlleleVCF"]
-						altAlleleCol = headerMapping["AlternateAlleleVCF"]
-						# 'PositionVCF' might be more important than 'Start'
-						# but the program is ignoring it for now
+					batch["variant"].append((ventry_id,) + encode_variant_values(variant_values, caches, texts))
+					add_clinvar_children(batch, ventry_id, record, caches, genes)
+					batch["variant_hash"].append((ventry_id,) + key + (occurrence, row_hash))
+					counts["new"] += 1
+				else:
+					known_id, known_hash = known
+					batch["seen"].append((known_id,))
+					if known_hash == row_hash:
+						counts["unchanged"] += 1
 					else:
-						refAlleleCol = headerMapping["ReferenceAllele"]
-						altAlleleCol = headerMapping["AlternateAllele"]
+						batch["variant_update"].append(encode_variant_values(variant_values, caches, texts) + (known_id,))
+						batch["rewritten"].append((known_id,))
+						add_clinvar_children(batch, known_id, record, caches, genes)
+						batch["variant_hash"].append((known_id,) + key + (occurrence, row_hash))
+						changed_ids.append(known_id)
+						counts["changed"] += 1
+				loaded_rows += 1
+				
+				if loaded_rows % PROGRESS_CHECK_ROWS == 0:
+					tracker.update(loaded_rows,loaded_rows % checkpoint_rows)
+				
+				# Once the batch is full, it is written in one go
+				if loaded_rows % batch_size == 0:
+					with stats.stage("insert"):
+						repeated_rows += flush_clinvar_batch(cur,batch)
+				
+				# And every so often, the work done so far is committed
+				if loaded_rows % checkpoint_rows == 0:
+					with stats.stage("insert"):
+						repeated_rows += flush_clinvar_batch(cur,batch)
+						if link_references:
+							link_variant_references(cur,linked_id,ventry_id)
+							linked_id = ventry_id
+						save_checkpoint(cur,"variant",line_offset + loaded_rows,ventry_id)
+					stats.commit(db)
+			
+			# And the last, partial batch
+			with stats.stage("insert"):
+				repeated_rows += flush_clinvar_batch(cur,batch)
+				if link_references:
+					link_variant_references(cur,linked_id,ventry_id)
+			
+			if incremental:
+				with stats.stage("retire"):
+					retired_ids = delete_retired_variants(cur,last_known_id)
+					counts["retired"] = len(retired_ids)
+					purge_unreferenced_texts(db,CLINVAR_TEXT_REFERENCES)
+				print("Incremental update: {new} new, {changed} changed, {unchanged} unchanged, {retired} retired".format(**counts), file=sys.stderr)
+				for kind, count in counts.items():
+					stats.count("{}_rows".format(kind),count)
+			
+			if repeated_rows > 0:
+				print("{} significances, review statuses or phenotypes repeated within a variant were kept once".format(repeated_rows), file=sys.stderr)
+			stats.count("repeated_child_rows",repeated_rows)
+			
+			save_checkpoint(cur,"variant",line_offset + loaded_rows,ventry_id,completed=True)
+			stats.commit(db)
+		
+		tracker.close(loaded_rows)
+		
+		if pipeline:
+			print_pipeline_report(pipeline_stats,loaded_rows)
+			stats.add_pipeline(pipeline_stats)
+		print_text_store_report(texts)
+		
+		# Now the data is in, the missing indexes are built in bulk,
+		# and so are the coordinate and full-text ones, and the counts.
+		# An incremental update only rewrites the loci of the variants
+		# it added, changed or removed
+		with db:
+			with stats.stage("index"):
+				create_indexes(db,CLINVAR_INDEX_DEFS)
+				sync_fts(db,CLINVAR_FTS_DEFS)
+				sync_aggregates(db,CLINVAR_AGGREGATE_DEFS)
+				if incremental:
+					delta_ids = changed_ids + retired_ids + list(range(last_known_id + 1, ventry_id + 1))
+					update_coord_index(db,"variant","ventry_id",CLINVAR_COORD_LOCI,delta_ids)
 				else:
-					# We are reading the file contents	
-					columnValues = re.split(r"\t",wline)
-					
-					# As these values can contain "nulls", which are
-					# designed as '-', substitute them for None
-					for iCol, vCol in enumerate(columnValues):
-						if len(vCol) == 0 or vCol == "-":
-							columnValues[iCol] = None
-					
-					# And extracting what we really need
-					# Table variation
-					allele_id = int(columnValues[headerMapping["AlleleID"]])
-					name = columnValues[headerMapping["Name"]]
-					allele_type = columnValues[headerMapping["Type"]]
-					dbSNP_id = columnValues[headerMapping["RS# (dbSNP)"]]
-					phenotype_list = columnValues[headerMapping["PhenotypeList"]]
-					assembly = columnValues[headerMapping["Assembly"]]
-					chro = columnValues[headerMapping["Chromosome"]]
-					chro_start = columnValues[headerMapping["Start"]]
-					chro_stop = columnValues[headerMapping["Stop"]]
-					ref_allele = columnValues[refAlleleCol]
-					alt_allele = columnValues[altAlleleCol]
-					cytogenetic = columnValues[headerMapping["Cytogenetic"]]
-					variation_id = int(columnValues[headerMapping["VariationID"]])
-					
-					gene_id = columnValues[headerMapping["GeneID"]]
-					gene_symbol = columnValues[headerMapping["GeneSymbol"]]
-					HGNC_ID = columnValues[headerMapping["HGNC_ID"]]
-					
-					#if assembly is None:
-					#	print("DEBUGAN: "+line,file=sys.stderr)
-					#	sys.stderr.flush()
-					#	#continue
-					
-					
-					cur.execute("""
-						INSERT INTO variant(
-							allele_id,
-							name,
-							type,
-							dbsnp_id,
-							phenotype_list,
-							gene_id,
-							gene_symbol,
-							hgnc_id,
-							assembly,
-							chro,
-							chro_start,
-							chro_stop,
-							ref_allele,
-							alt_allele,
-							cytogenetic,
-							variation_id)
-						VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-					""", (allele_id,name,allele_type,dbSNP_id,phenotype_list,gene_id,gene_symbol,HGNC_ID,assembly,chro,chro_start,chro_stop,ref_allele,alt_allele,cytogenetic,variation_id))
-					
-					# The autoincremented value is got here
-					### WTF is going on here
-					ventry_id = cur.lastrowid
-					
-					## Table gene
-					#gene_id = columnValues[headerMapping["GeneID"]]
-					#gene_symbol = columnValues[headerMapping["GeneSymbol"]]
-					#HGNC_ID = columnValues[headerMapping["HGNC_ID"]]
-					#
-					#if gene_id not in known_genes:
-					#	cur.execute("""
-					#		INSERT INTO gene(
-					#			gene_id,
-					#			gene_symbol,
-					#			hgnc_id)
-					#		VALUES(?,?,?)
-					#	""", (gene_id,gene_symbol,HGNC_ID))
-					#	known_genes.add(gene_id)
-					
-					# Clinical significance
-					significance = columnValues[headerMapping["ClinicalSignificance"]]
-					if significance is not None:
-						prep_sig = [ (ventry_id, sig)  for sig in re.split(r"/",significance) ]
-						cur.executemany("""
-							INSERT INTO clinical_sig(
-								ventry_id,
-								significance)
-							VALUES(?,?)
-						""", prep_sig)
-					
-					# Review status
-					### GOTTA REVISE WHAT THIS **executemany** does
-					status_str = columnValues[headerMapping["ReviewStatus"]]
-					if status_str is not None:
-						prep_status = [ (ventry_id, status)  for status in re.split(r", ",status_str) ]
-						cur.executemany("""
-							INSERT INTO review_status(
-								ventry_id,
-								status)
-							VALUES(?,?)
-						""", prep_status)
-					
-					# Variant Phenotypes
-					variant_pheno_str = columnValues[headerMapping["PhenotypeIDS"]]
-					if variant_pheno_str is not None:
-						variant_pheno_list = re.split(r"[;|]",variant_pheno_str)
-						prep_pheno = []
-						for phen_group_id, variant_pheno in enumerate(variant_pheno_list):
-							if len(variant_pheno) == 0:
-								continue
-							if re.search("^[1-9][0-9]* conditions$", variant_pheno):
-								print("INFO: Long PhenotypeIDs {} {}: {}".format(allele_id, assembly, variant_pheno))
-								continue
-							variant_annots = re.split(r",",variant_pheno)
-							for variant_annot in variant_annots:
-								phen = variant_annot.split(":")
-								if len(phen) > 1:
-									phen_ns , phen_id = phen[0:2]
-									prep_pheno.append((ventry_id,phen_group_id,phen_ns,phen_id))
-								elif variant_annot != "na":
-									print("DEBUG: {} {} {}\n\t{}\n\t{}".format(allele_id,assembly,variant_annot,variant_pheno_str,line),file=sys.stderr)
-						
-						cur.executemany("""
-							INSERT INTO variant_phenotypes(
-								ventry_id,
-								phen_group_id,
-								phen_ns,
-								phen_id)
-							VALUES(?,?,?,?)
-						""", prep_pheno)
+					rebuild_coord_index(db,"variant","ventry_id",CLINVAR_COORD_LOCI)
+			stats.commit(db)
 		
 		cur.close()
+	
+	stats.finish(db)
 
 if __name__ == '__main__':
-	if len(sys.argv) < 3:
-		print("Usage: {0} {{database_file}} {{compressed_clinvar_file}}".format(sys.argv[0]), file=sys.stderr)
-		sys.exit(1)
+	parser = argparse.ArgumentParser(description="Loads a ClinVar variant_summary file into a SQLite database")
+	parser.add_argument("db_file", metavar="database_file", help="SQLite database to create or update")
+	parser.add_argument("clinvar_file", metavar="compressed_clinvar_file", help="gzipped variant_summary file")
+	parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="variant rows written per executemany batch (default: %(default)s)")
+	mode = parser.add_mutually_exclusive_group()
+	mode.add_argument("--workers", type=int, default=1, help="processes parsing the file in parallel, 0 for one per CPU (default: %(default)s)")
+	mode.add_argument("--pipeline", action="store_true", help="overlap decompression, parsing and inserts in threads, and report each stage")
+	parser.add_argument("--incremental", action="store_true", help="update a database loaded from a previous release instead of appending")
+	parser.add_argument("--checkpoint-rows", type=int, default=DEFAULT_CHECKPOINT_ROWS, help="rows committed at a time, each commit being a checkpoint (default: %(default)s)")
+	parser.add_argument("--resume", action="store_true", help="resume a broken load of the same file from its last checkpoint")
+	parser.add_argument("--profile", choices=sorted(LOAD_PROFILES), default=DEFAULT_LOAD_PROFILE, help="PRAGMA profile used while loading (default: %(default)s)")
+	parser.add_argument("--decompression", choices=DECOMPRESSION_BACKENDS, default=DEFAULT_DECOMPRESSION, help="how the file is decompressed, auto picking the fastest backend available (default: %(default)s)")
+	parser.add_argument("--progress", action="store_true", help="show the rows loaded, their speed and the ETA while loading")
+	parser.add_argument("--stats-file", help="write the time per stage and the row counts of the load to this JSON file")
+	parser.add_argument("--snapshot-dir", help="write a columnar NumPy snapshot of the variants to this directory once loaded")
+	args = parser.parse_args()
+	if args.resume and args.incremental:
+		parser.error("--resume cannot be used with --incremental, an incremental update can be run again instead")
 
-	# Only the first and second parameters are considered
-	db_file = sys.argv[1]
-	clinvar_file = sys.argv[2]
+	workers = args.workers if args.workers > 0 else os.cpu_count()
 
 	# First, let's create or open the database
-	db = open_clinvar_db(db_file)
+	db = open_clinvar_db(args.db_file,profile=args.profile)
+
+	stats = LoadStats("clinvar",args.clinvar_file) if args.stats_file is not None else NULL_LOAD_STATS
 
 	# Second
-	store_clinvar_file(db,clinvar_file)
+	store_clinvar_file(db,args.clinvar_file,batch_size=args.batch_size,workers=workers,pipeline=args.pipeline,incremental=args.incremental,checkpoint_rows=args.checkpoint_rows,resume=args.resume,stats=stats,progress=args.progress,decompression=args.decompression)
+
+	# And back to safe settings for the readers
+	restore_read_profile(db)
+
+	# The columnar copy of the variants, for whole-table scans.
+	# NumPy is only needed when it is asked for
+	if args.snapshot_dir is not None:
+		from column_snapshot import write_snapshot
+		with stats.stage("snapshot"):
+			# The load is committed by now, so a failed export only
+			# leaves the snapshot to be written with column_snapshot.py
+			try:
+				write_snapshot(db,args.snapshot_dir,"clinvar")
+			except (ValueError,OSError) as e:
+				print("The snapshot could not be written, the load is kept: {}".format(str(e)), file=sys.stderr)
 
 	db.close()
+
+	if args.stats_file is not None:
+		stats.write_report(args.stats_file)
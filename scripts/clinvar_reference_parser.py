@@ -14,8 +14,15 @@
 
 import sys
 import os
+import argparse
+import itertools
 import sqlite3
-import re
+
+from sqlite_tuning import LOAD_PROFILES, DEFAULT_LOAD_PROFILE, apply_load_profile, restore_read_profile
+from sqlite_tuning import estimate_incoming_rows, should_rebuild_indexes, drop_indexes, create_indexes
+from tsv_reader import TEXT, INT, CLINVAR_NULLS, read_tsv_rows
+from load_stats import LoadStats, NULL_LOAD_STATS, open_text_input
+from load_checkpoint import DEFAULT_CHECKPOINT_ROWS, start_checkpoint, save_checkpoint
 
 CLINVAR_REFERENCE_DEFS = [
     """
@@ -27,17 +34,40 @@ CREATE TABLE IF NOT EXISTS reference (
 )
 """,
     """
-CREATE INDEX all_id ON reference(allele_id)
+CREATE TABLE IF NOT EXISTS variant_reference (
+    ventry_id INTEGER NOT NULL,
+    reference_id INTEGER NOT NULL,
+    PRIMARY KEY (ventry_id, reference_id),
+    FOREIGN KEY (ventry_id) REFERENCES variant_coded(ventry_id)
+        ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (reference_id) REFERENCES reference(ventry_id)
+        ON DELETE CASCADE ON UPDATE CASCADE
+) WITHOUT ROWID
+"""
+]
+
+# Indexes are declared apart, as they are built once the data is loaded
+CLINVAR_REFERENCE_INDEX_DEFS = [
+    """
+CREATE INDEX IF NOT EXISTS all_id ON reference(allele_id)
+""",
+    """
+CREATE INDEX IF NOT EXISTS cit_id ON reference(citation_id)
 """,
     """
-CREATE INDEX cit_id ON reference(citation_id)
+CREATE INDEX IF NOT EXISTS reference_variant_reference ON variant_reference(reference_id, ventry_id)
 """
 ]
 
+# Approximate size of a var_citations row, used to guess how many
+# rows a load will bring
+REFERENCE_BYTES_PER_ROW = 40
 
-def open_clinvar_db(db_file):
+
+def open_clinvar_db(db_file, profile=DEFAULT_LOAD_PROFILE):
 
     db = sqlite3.connect(db_file)
+    apply_load_profile(db, profile)
 
     cur = db.cursor()
     try:
@@ -52,53 +82,145 @@ def open_clinvar_db(db_file):
     return db
 
 
-def store_clinvar_ref(db, reference_file):
-    with open(reference_file, "rt") as ref:
-        headerMapping = None  # no need?
-        cur = db.cursor()
+# Columns of var_citations used by the loader, in the order of
+# the reference table
+REFERENCE_COLUMNS = [
+    ("AlleleID", INT),
+    ("citation_source", TEXT),
+    ("citation_id", TEXT),
+]
 
-        with db:
-            for line in ref:
-                wline = line.rstrip("\n")
+INSERT_REFERENCE = """
+    INSERT INTO reference(
+        ventry_id,
+        allele_id,
+        citation_source,
+        citation_id)
+    VALUES(?,?,?,?)
+"""
+
+INSERT_VARIANT_REFERENCE = """
+    INSERT INTO variant_reference(
+        ventry_id,
+        reference_id)
+    VALUES(?,?)
+"""
 
-                if (headerMapping is None) and (wline[0] == '#'):
-                    wline = wline.lstrip("#")
-                    columnNames = re.split(r"\t", wline)
 
-                    headerMapping = {}
-                    for columnId, columnName in enumerate(columnNames):
-                        headerMapping[columnName] = columnId
+def next_reference_id(cur):
+    """
+        Returns the id that the AUTOINCREMENT column of the reference
+        table would hand out next
+    """
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'reference'")
+    seqRow = cur.fetchone()
+    cur.execute("SELECT MAX(ventry_id) FROM reference")
+    maxRow = cur.fetchone()
 
-                else:
-                    columnValues = re.split(r"\t", wline)
+    return max(seqRow[0] if seqRow is not None else 0, maxRow[0] or 0) + 1
 
-                    for iCol, vCol in enumerate(columnValues):
-                        if len(vCol) == 0 or vCol == "-":
-                            columnValues[iCol] = None
 
-                    allele_id = int(columnValues[headerMapping["AlleleID"]])
-                    citation_source = columnValues[headerMapping["citation_source"]]
-                    citation_id = columnValues[headerMapping["citation_id"]]
+def allele_ventries(cur):
+    """
+        Maps every AlleleID to the ventry_id of its variant rows, one
+        per assembly. It is empty when no variants were loaded
+    """
+    cur.execute("SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'variant_coded')")
+    if not cur.fetchone()[0]:
+        return {}
 
-                    cur.execute("""
-                        INSERT INTO reference(
-                            allele_id,
-                            citation_source,
-                            citation_id)
-                        VALUES(?,?,?)
-                        """, (allele_id, citation_source, citation_id))
+    ventries = {}
+    cur.execute("SELECT allele_id, ventry_id FROM variant_coded")
+    for allele_id, ventry_id in cur:
+        ventries.setdefault(allele_id, []).append(ventry_id)
 
-                    ventry_id = cur.lastrowid
+    return ventries
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print("Usage: {0} {{database_file}} {{txt_clinvar_reference_file}}".format(
-            sys.argv[0]), file=sys.stderr)
-        sys.exit(1)
 
-    db_file = sys.argv[1]
-    clinvar_file = sys.argv[2]
+def store_clinvar_ref(db, reference_file, checkpoint_rows=DEFAULT_CHECKPOINT_ROWS, resume=False, stats=NULL_LOAD_STATS):
+    stats.begin(db, ["reference", "variant_reference"])
+    line_offset, last_ventry_id = start_checkpoint(db, "reference", "ventry_id", reference_file, resume)
+    stats.count("skipped_rows", line_offset)
 
-    db = open_clinvar_db(db_file)
-    store_clinvar_ref(db, clinvar_file)
-    db.close()
\ No newline at end of file
+    with open_text_input(reference_file, stats) as ref:
+        cur = db.cursor()
+
+        with db:
+            incoming_rows = estimate_incoming_rows(reference_file, REFERENCE_BYTES_PER_ROW)
+            if should_rebuild_indexes(db, "reference", incoming_rows):
+                drop_indexes(db, CLINVAR_REFERENCE_INDEX_DEFS)
+
+            # Each citation is linked to the variant rows of its allele,
+            # found in memory, so the links are written with the citations
+            with stats.stage("allele_map"):
+                ventries = allele_ventries(cur)
+            if len(ventries) == 0:
+                print("INFO: No ClinVar variants in the database, the citations are not linked to them")
+            reference_id = next_reference_id(cur) - 1
+
+            # The decoded rows go straight to the database, committing
+            # every checkpoint_rows of them
+            rows = stats.timed(read_tsv_rows(ref, REFERENCE_COLUMNS, CLINVAR_NULLS, skip=line_offset), "decode")
+            while True:
+                chunk = list(itertools.islice(rows, checkpoint_rows))
+                if len(chunk) == 0:
+                    break
+
+                with stats.stage("link"):
+                    references = []
+                    links = []
+                    for allele_id, citation_source, citation_id in chunk:
+                        reference_id += 1
+                        references.append((reference_id, allele_id, citation_source, citation_id))
+                        variant_ids = ventries.get(allele_id)
+                        if variant_ids is None:
+                            stats.count("unlinked_citations")
+                        else:
+                            links.extend((ventry_id, reference_id) for ventry_id in variant_ids)
+
+                with stats.stage("insert"):
+                    cur.executemany(INSERT_REFERENCE, references)
+                    # Without variants, there is no variant_coded table
+                    # for the foreign key either
+                    if len(links) > 0:
+                        cur.executemany(INSERT_VARIANT_REFERENCE, links)
+                    line_offset += len(chunk)
+
+                    last_ventry_id = reference_id
+                    save_checkpoint(cur, "reference", line_offset, last_ventry_id)
+                stats.commit(db)
+
+            save_checkpoint(cur, "reference", line_offset, last_ventry_id, completed=True)
+            stats.commit(db)
+
+        # Missing indexes are built in bulk, once the data is in
+        with db:
+            with stats.stage("index"):
+                create_indexes(db, CLINVAR_REFERENCE_INDEX_DEFS)
+            stats.commit(db)
+
+    stats.finish(db)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Loads the ClinVar var_citations file into a SQLite database")
+    parser.add_argument("db_file", metavar="database_file", help="SQLite database to create or update")
+    parser.add_argument("clinvar_file", metavar="txt_clinvar_reference_file", help="var_citations.txt file")
+    parser.add_argument("--checkpoint-rows", type=int, default=DEFAULT_CHECKPOINT_ROWS,
+                        help="rows committed at a time, each commit being a checkpoint (default: %(default)s)")
+    parser.add_argument("--resume", action="store_true",
+                        help="resume a broken load of the same file from its last checkpoint")
+    parser.add_argument("--profile", choices=sorted(LOAD_PROFILES), default=DEFAULT_LOAD_PROFILE,
+                        help="PRAGMA profile used while loading (default: %(default)s)")
+    parser.add_argument("--stats-file",
+                        help="write the time per stage and the row counts of the load to this JSON file")
+    args = parser.parse_args()
+
+    stats = LoadStats("reference", args.clinvar_file) if args.stats_file is not None else NULL_LOAD_STATS
+
+    db = open_clinvar_db(args.db_file, profile=args.profile)
+    store_clinvar_ref(db, args.clinvar_file, checkpoint_rows=args.checkpoint_rows, resume=args.resume, stats=stats)
+    restore_read_profile(db)
+    db.close()
+
+    if args.stats_file is not None:
+        stats.write_report(args.stats_file)
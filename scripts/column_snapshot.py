@@ -0,0 +1,398 @@
+# ------------------------------------------------------------------------------
+# column_snapshot.py
+# Columnar NumPy snapshots of the ClinVar and CIViC variants, and their query API
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Whole-table scans, like the variants per chromosome or the
+# substitutions of the SNVs, pay for every row SQLite hands to Python.
+# A snapshot keeps the columns those scans need in a directory, one
+# .npy file per column, which np.load maps in memory, so a scan is a
+# handful of vectorised operations. Text columns are dictionary
+# encoded: the array holds the position of the value in its dictionary,
+# or -1 for NULL, and the dictionaries go to a JSON sidecar, written
+# last. The significances of a variant are a bitmask, bit i standing
+# for the i-th value of their dictionary. The mask is a row of 64 bit
+# words, as many as the dictionary needs, so there is no limit on the
+# number of significances. The sidecar also keeps the fingerprint of
+# the database, which tells a stale snapshot apart
+
+import sys
+import os
+import argparse
+import json
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+from load_checkpoint import database_fingerprint
+
+SNAPSHOT_FORMAT_VERSION = 2
+
+SNAPSHOT_SIDECAR = "dictionaries.json"
+
+# Columns of a snapshot, as (column, kind) pairs. int columns keep -1
+# for NULL, and code columns are dictionary encoded
+SNAPSHOT_COLUMNS = [
+	("entry_id", "int"),
+	("assembly", "code"),
+	("chro", "code"),
+	("start", "int"),
+	("stop", "int"),
+	("type", "code"),
+	("gene_id", "int"),
+	("ref_allele", "code"),
+	("alt_allele", "code"),
+]
+
+# Significance bitmask column, next to those above
+SIGNIFICANCE_COLUMN = "significance"
+
+# Separators of the modifiers of a significance, like "Pathogenic, low
+# penetrance" or "Benign; drug response", whose parts get a bit each
+SIGNIFICANCE_SPLIT_RE = re.compile(r"\s*[,;]\s*")
+
+# Separator of the significances of a bitmask, once decoded. CIViC
+# ones, like Sensitivity/Response, have slashes of their own
+SIGNIFICANCE_SEP = "; "
+
+# Alleles longer than this are kept as NULL, so the allele
+# dictionaries do not fill up with the long indels
+SNAPSHOT_MAX_ALLELE = 64
+
+# Queries of each source, as (variant query, significance query, table
+# the significances come from) tuples. The variant query returns the
+# SNAPSHOT_COLUMNS in order, and the significance one (entry_id,
+# significance) pairs
+SNAPSHOT_SOURCES = {
+	"clinvar": ("""
+		SELECT v.ventry_id, a.assembly, c.chro, v.chro_start, v.chro_stop, t.type, v.gene_id,
+			CASE WHEN length(v.ref_allele) <= :max_allele THEN v.ref_allele END,
+			CASE WHEN length(v.alt_allele) <= :max_allele THEN v.alt_allele END
+		FROM variant_coded v
+		LEFT JOIN assembly_code a ON a.code = v.assembly_code
+		JOIN chro_code c ON c.code = v.chro_code
+		JOIN type_code t ON t.code = v.type_code
+		ORDER BY v.ventry_id
+	""", """
+		SELECT cs.ventry_id, sc.significance
+		FROM clinical_sig_coded cs
+		JOIN significance_code sc ON sc.code = cs.significance_code
+	""", "clinical_sig_coded"),
+	# CIViC variants get their significances from the evidence,
+	# when civic_evidence_parser.py has loaded it
+	"civic": ("""
+		SELECT v.variant_id, v.ref_build, v.chr_1, v.chr_start, v.chr_stop, v.var_types, v.entrez_id,
+			CASE WHEN length(v.ref_bases) <= :max_allele THEN v.ref_bases END,
+			CASE WHEN length(v.var_bases) <= :max_allele THEN v.var_bases END
+		FROM variant_coded v
+		ORDER BY v.variant_id
+	""", """
+		SELECT DISTINCT variant_id, clinical_significance
+		FROM evidence_coded
+		WHERE clinical_significance IS NOT NULL
+	""", "evidence_coded"),
+}
+
+# Rows fetched from SQLite at a time while exporting
+SNAPSHOT_FETCH_ROWS = 100000
+
+def _has_table(cur, table):
+	cur.execute("SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?)", (table,))
+	return cur.fetchone()[0] != 0
+
+def _encode(values, dictionary):
+	"""
+		Codes of a chunk of text values, adding the new ones to the
+		dictionary, a value to code dict
+	"""
+	codes = []
+	for value in values:
+		if value is None:
+			codes.append(-1)
+		else:
+			code = dictionary.get(value)
+			if code is None:
+				code = len(dictionary)
+				dictionary[value] = code
+			codes.append(code)
+	return codes
+
+def _split_significances(ids, values):
+	"""
+		(entry_id, significance) pairs of a chunk, with the modifiers
+		of every significance as values of their own
+	"""
+	pairs = []
+	for entry_id, value in zip(ids, values):
+		pairs.extend( (entry_id, part)  for part in SIGNIFICANCE_SPLIT_RE.split(value) if part != "" )
+	return pairs
+
+def _mask_bits(codes, words):
+	"""
+		Bitmask, as a row of words, with the bits of the codes set
+	"""
+	bits = np.zeros(words, dtype=np.uint64)
+	for code in codes:
+		bits[code // 64] |= np.left_shift(np.uint64(1), np.uint64(code % 64))
+	return bits
+
+def write_snapshot(db, snapshot_dir, source):
+	"""
+		Writes the snapshot of the variants of a database loaded by
+		the ClinVar or CIViC loaders, replacing any previous one in
+		snapshot_dir. Returns the number of variants written
+	"""
+	variantQuery, significanceQuery, significanceTable = SNAPSHOT_SOURCES[source]
+	os.makedirs(snapshot_dir, exist_ok=True)
+	# Without the sidecar, the directory does not hold a snapshot
+	sidecar_file = os.path.join(snapshot_dir, SNAPSHOT_SIDECAR)
+	if os.path.exists(sidecar_file):
+		os.unlink(sidecar_file)
+
+	cur = db.cursor()
+	try:
+		if not _has_table(cur, "variant_coded"):
+			raise ValueError("There are no {} variants in the database".format(source))
+		cur.execute("SELECT COUNT(*) FROM variant_coded")
+		rows = cur.fetchone()[0]
+
+		arrays = {
+			column: np.full(rows, -1, dtype=np.int64 if kind == "int" else np.int32)
+			for column, kind in SNAPSHOT_COLUMNS
+		}
+		dictionaries = { column: {}  for column, kind in SNAPSHOT_COLUMNS if kind == "code" }
+
+		cur.execute(variantQuery, { "max_allele": SNAPSHOT_MAX_ALLELE })
+		offset = 0
+		while True:
+			chunk = cur.fetchmany(SNAPSHOT_FETCH_ROWS)
+			if len(chunk) == 0:
+				break
+			for (column, kind), values in zip(SNAPSHOT_COLUMNS, zip(*chunk)):
+				if kind == "code":
+					values = _encode(values, dictionaries[column])
+				else:
+					values = [ -1 if value is None else value  for value in values ]
+				arrays[column][offset:offset + len(chunk)] = values
+			offset += len(chunk)
+
+		# Each significance sets its bit on the variants having it, and
+		# a word is added to every mask when the dictionary outgrows them
+		significances = {}
+		significance = np.zeros((rows, 1), dtype=np.uint64)
+		if _has_table(cur, significanceTable):
+			entry_ids = arrays["entry_id"]
+			cur.execute(significanceQuery)
+			while True:
+				chunk = cur.fetchmany(SNAPSHOT_FETCH_ROWS)
+				if len(chunk) == 0:
+					break
+				pairs = _split_significances(*zip(*chunk))
+				if len(pairs) == 0:
+					continue
+				ids, values = zip(*pairs)
+				codes = np.array(_encode(values, significances), dtype=np.int64)
+				words = (len(significances) + 63) // 64
+				if words > significance.shape[1]:
+					significance = np.hstack((significance, np.zeros((rows, words - significance.shape[1]), dtype=np.uint64)))
+				# Evidence may point to variants which are not loaded
+				ids = np.array(ids, dtype=np.int64)
+				positions = np.minimum(np.searchsorted(entry_ids, ids), max(rows - 1, 0))
+				found = entry_ids[positions] == ids if rows > 0 else np.zeros(len(ids), dtype=bool)
+				codes = codes[found]
+				np.bitwise_or.at(significance, (positions[found], codes // 64), np.left_shift(np.uint64(1), (codes % 64).astype(np.uint64)))
+		arrays[SIGNIFICANCE_COLUMN] = significance
+		dictionaries[SIGNIFICANCE_COLUMN] = significances
+
+		fingerprint = database_fingerprint(db)
+	finally:
+		cur.close()
+
+	for column, array in arrays.items():
+		np.save(os.path.join(snapshot_dir, "{}.npy".format(column)), array)
+
+	with open(sidecar_file, "w", encoding="utf-8") as sideF:
+		json.dump({
+			"version": SNAPSHOT_FORMAT_VERSION,
+			"source": source,
+			"rows": rows,
+			"fingerprint": fingerprint,
+			# Dictionaries as lists, the code being the position
+			"dictionaries": { column: sorted(dictionary, key=dictionary.get)  for column, dictionary in dictionaries.items() },
+		}, sideF, indent=1)
+
+	return rows
+
+class VariantSnapshot(object):
+	"""
+		Read only view of a snapshot, whose columns are mapped in
+		memory the first time they are used
+	"""
+	def __init__(self, snapshot_dir):
+		self.snapshot_dir = snapshot_dir
+		with open(os.path.join(snapshot_dir, SNAPSHOT_SIDECAR), "r", encoding="utf-8") as sideF:
+			sidecar = json.load(sideF)
+		if sidecar["version"] != SNAPSHOT_FORMAT_VERSION:
+			raise ValueError("{} is a version {} snapshot, it has to be written again".format(snapshot_dir, sidecar["version"]))
+
+		self.source = sidecar["source"]
+		self.rows = sidecar["rows"]
+		self.fingerprint = sidecar["fingerprint"]
+		self.dictionaries = sidecar["dictionaries"]
+		self.kinds = dict(SNAPSHOT_COLUMNS)
+		self.kinds[SIGNIFICANCE_COLUMN] = "bits"
+		self.arrays = {}
+
+	def is_current(self, db):
+		"""
+			Tells whether the database was not loaded again since
+			the snapshot was written
+		"""
+		return database_fingerprint(db) == self.fingerprint
+
+	def column(self, column):
+		array = self.arrays.get(column)
+		if array is None:
+			if column not in self.kinds:
+				raise ValueError("Unknown snapshot column {}".format(column))
+			array = np.load(os.path.join(self.snapshot_dir, "{}.npy".format(column)), mmap_mode="r")
+			self.arrays[column] = array
+		return array
+
+	def _codes(self, column, values):
+		dictionary = self.dictionaries[column]
+		return [ dictionary.index(value)  for value in values if value in dictionary ]
+
+	def mask(self, **conditions):
+		"""
+			Rows matching all the conditions, as a boolean array. A
+			code column matches a value or any of a list of them, the
+			significance bitmask any of the significances given, and
+			an int column a value, a list of them or an inclusive
+			(low, high) range, where None leaves that end open
+		"""
+		selected = np.ones(self.rows, dtype=bool)
+		for column, value in conditions.items():
+			array = self.column(column)
+			kind = self.kinds[column]
+			if kind == "code":
+				values = [value] if isinstance(value, str) else value
+				selected &= np.isin(array, self._codes(column, values))
+			elif kind == "bits":
+				values = [value] if isinstance(value, str) else value
+				bits = _mask_bits(self._codes(column, values), array.shape[1])
+				selected &= np.any(array & bits, axis=1)
+			elif isinstance(value, list):
+				selected &= np.isin(array, value)
+			elif isinstance(value, tuple):
+				low, high = value
+				if low is not None:
+					selected &= array >= low
+				if high is not None:
+					selected &= array <= high
+			else:
+				selected &= array == value
+		return selected
+
+	def _decode(self, column, value):
+		if self.kinds[column] == "code":
+			return self.dictionaries[column][value] if value >= 0 else None
+		if self.kinds[column] == "bits":
+			return SIGNIFICANCE_SEP.join(significance  for code, significance in enumerate(self.dictionaries[column]) if int(value[code // 64]) >> code % 64 & 1) or None
+		return int(value) if value >= 0 else None
+
+	def count(self, group_by=[], selected=None):
+		"""
+			Counts the selected rows by the values of the group_by
+			columns, as (values..., count) tuples, the biggest
+			groups first
+		"""
+		if selected is None:
+			selected = np.ones(self.rows, dtype=bool)
+		if len(group_by) == 0:
+			return [ (int(np.count_nonzero(selected)),) ]
+
+		# The distinct values of every column are numbered, and the
+		# numbers combined in a single key per row
+		uniques = []
+		keys = np.zeros(np.count_nonzero(selected), dtype=np.int64)
+		for column in group_by:
+			# Masks are grouped by their whole row of words
+			values = self.column(column)[selected]
+			unique, inverse = np.unique(values, axis=0 if values.ndim > 1 else None, return_inverse=True)
+			keys = keys * len(unique) + inverse.reshape(-1)
+			uniques.append(unique)
+		groups, counts = np.unique(keys, return_counts=True)
+
+		order = np.argsort(-counts, kind="stable")
+		result = []
+		for key, count in zip(groups[order], counts[order]):
+			values = []
+			for column, unique in zip(reversed(group_by), reversed(uniques)):
+				key, position = divmod(int(key), len(unique))
+				values.append(self._decode(column, unique[position]))
+			result.append(tuple(reversed(values)) + (int(count),))
+		return result
+
+def parse_condition(condition):
+	"""
+		Parses a column=value or column=low:high command line
+		condition, where either end of the range may be left empty
+	"""
+	column, sep, value = condition.partition("=")
+	if sep == "":
+		raise argparse.ArgumentTypeError("{} is not a column=value condition".format(condition))
+	if dict(SNAPSHOT_COLUMNS).get(column) == "int":
+		low, sep, high = value.partition(":")
+		if sep == "":
+			return column, int(value)
+		return column, (int(low) if low != "" else None, int(high) if high != "" else None)
+	return column, value
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Counts the variants of a columnar snapshot, optionally writing it first from a database")
+	parser.add_argument("snapshot_dir", help="directory of the snapshot")
+	parser.add_argument("--from-db", metavar="DATABASE_FILE", help="write the snapshot from this database first")
+	parser.add_argument("--source", choices=sorted(SNAPSHOT_SOURCES), default="clinvar", help="loader of the database given with --from-db (default: %(default)s)")
+	parser.add_argument("--where", action="append", type=parse_condition, default=[], help="column=value, or column=low:high for the numeric columns, can be repeated. Repeating a column matches any of its values")
+	parser.add_argument("--group-by", action="append", default=[], help="column whose values group the counts, can be repeated")
+	args = parser.parse_args()
+
+	if args.from_db is not None:
+		start = time.perf_counter()
+		db = sqlite3.connect(args.from_db)
+		rows = write_snapshot(db, args.snapshot_dir, args.source)
+		db.close()
+		print("Snapshot of {} variants written in {:.2f} s".format(rows, time.perf_counter() - start), file=sys.stderr)
+
+	snapshot = VariantSnapshot(args.snapshot_dir)
+	conditions = {}
+	for column, value in args.where:
+		if column in conditions and not isinstance(value, tuple):
+			previous = conditions[column]
+			conditions[column] = (previous if isinstance(previous, list) else [previous]) + [value]
+		else:
+			conditions[column] = value
+
+	start = time.perf_counter()
+	try:
+		counts = snapshot.count(args.group_by, snapshot.mask(**conditions))
+	except ValueError as e:
+		parser.error(str(e))
+	elapsed = time.perf_counter() - start
+
+	print("\t".join(args.group_by + ["count"]))
+	for row in counts:
+		print("\t".join("" if value is None else str(value)  for value in row))
+	print("{} groups of {} variants in {:.1f} ms".format(len(counts), snapshot.rows, elapsed * 1000), file=sys.stderr)
@@ -0,0 +1,226 @@
+# ------------------------------------------------------------------------------
+# coord_index.py
+# R*Tree coordinate indexes of the ClinVar and CIViC variants
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# A B-tree over (start, stop) can only bound one end of an interval,
+# so overlap lookups end up scanning. Instead, the loci of a table are
+# kept in one R*Tree per assembly and chromosome, listed in coord_rtree.
+# Coordinates are integers, so the trees are rtree_i32 ones, where 32
+# bits are plenty for a chromosome. A variant may have several loci,
+# like the two partners of a fusion, so the R*Tree entry id is
+# entry_id * LOCI_PER_ENTRY + locus, and both are kept as auxiliary
+# columns. The trees are rebuilt in bulk at the end of a full load,
+# while an incremental update only rewrites the loci of the entries it
+# added, changed or removed
+
+import argparse
+import sqlite3
+
+COORD_INDEX_DEFS = [
+"""
+CREATE TABLE IF NOT EXISTS coord_rtree (
+	rtree_id INTEGER PRIMARY KEY,
+	source_table VARCHAR(64) NOT NULL,
+	assembly VARCHAR(16) NULL,
+	chro VARCHAR(16) NOT NULL,
+	entries INTEGER NOT NULL
+)
+"""
+]
+
+# Room for the loci of a single entry in the R*Tree ids
+LOCI_PER_ENTRY = 4
+
+# Rows written to the trees at a time
+COORD_BATCH_SIZE = 50000
+
+def rtree_name(source_table, rtree_id):
+	return "{}_rtree_{}".format(source_table, rtree_id)
+
+def _create_registry(cur):
+	for tableDecl in COORD_INDEX_DEFS:
+		cur.execute(tableDecl)
+
+def drop_coord_index(db, source_table):
+	"""
+		Drops all the R*Trees of source_table
+	"""
+	cur = db.cursor()
+	try:
+		_create_registry(cur)
+		cur.execute("SELECT rtree_id FROM coord_rtree WHERE source_table = ?", (source_table,))
+		for rtree_id, in cur.fetchall():
+			cur.execute("DROP TABLE IF EXISTS {}".format(rtree_name(source_table, rtree_id)))
+		cur.execute("DELETE FROM coord_rtree WHERE source_table = ?", (source_table,))
+	finally:
+		cur.close()
+
+def _select_loci(source_table, key_column, loci):
+	return "SELECT {}, {} FROM {}".format(key_column, ", ".join("{}, {}, {}, {}".format(*locus) for locus in loci), source_table)
+
+def _index_loci(db, source_table, loci, rows):
+	"""
+		Adds the loci of the rows, as returned by _select_loci, to the
+		R*Trees of source_table, creating the missing ones, and keeps
+		their number of entries
+	"""
+	cur = db.cursor()
+	writeCur = db.cursor()
+	try:
+		# Trees already created, by (assembly, chromosome)
+		trees = {}
+		# Rows waiting to be written, and entries, by tree
+		pending = {}
+		counts = {}
+		cur.execute("SELECT rtree_id, assembly, chro, entries FROM coord_rtree WHERE source_table = ?", (source_table,))
+		for rtree_id, assembly, chro, entries in cur.fetchall():
+			name = rtree_name(source_table, rtree_id)
+			trees[(assembly, chro)] = name
+			pending[name] = []
+			counts[name] = entries
+
+		def flush(name):
+			writeCur.executemany("INSERT INTO {}(id, start, stop, entry_id, locus) VALUES(?,?,?,?,?)".format(name), pending[name])
+			pending[name].clear()
+
+		for row in rows:
+			entry_id = row[0]
+			for locus in range(len(loci)):
+				assembly, chro, start, stop = row[1 + 4 * locus: 5 + 4 * locus]
+				if chro is None or start is None:
+					continue
+				if stop is None:
+					stop = start
+				elif stop < start:
+					start, stop = stop, start
+
+				name = trees.get((assembly, chro))
+				if name is None:
+					writeCur.execute("INSERT INTO coord_rtree(source_table, assembly, chro, entries) VALUES(?,?,?,0)", (source_table, assembly, chro))
+					name = rtree_name(source_table, writeCur.lastrowid)
+					writeCur.execute("CREATE VIRTUAL TABLE {} USING rtree_i32(id, start, stop, +entry_id INTEGER, +locus INTEGER)".format(name))
+					trees[(assembly, chro)] = name
+					pending[name] = []
+					counts[name] = 0
+
+				pending[name].append((entry_id * LOCI_PER_ENTRY + locus, start, stop, entry_id, locus))
+				counts[name] += 1
+				if len(pending[name]) >= COORD_BATCH_SIZE:
+					flush(name)
+
+		for (assembly, chro), name in trees.items():
+			flush(name)
+			writeCur.execute("UPDATE coord_rtree SET entries = ? WHERE source_table = ? AND assembly IS ? AND chro = ?", (counts[name], source_table, assembly, chro))
+	finally:
+		writeCur.close()
+		cur.close()
+
+def rebuild_coord_index(db, source_table, key_column, loci):
+	"""
+		Rebuilds the R*Trees of source_table from scratch. loci is a
+		list of (assembly, chromosome, start, stop) column names, one
+		per locus of a row. Loci without chromosome or start are left
+		out, and a missing stop means a single position
+	"""
+	drop_coord_index(db, source_table)
+
+	cur = db.cursor()
+	try:
+		cur.execute(_select_loci(source_table, key_column, loci))
+		_index_loci(db, source_table, loci, cur)
+	finally:
+		cur.close()
+
+def update_coord_index(db, source_table, key_column, loci, entry_ids):
+	"""
+		Rewrites in the R*Trees of source_table the loci of the given
+		entries, those added, changed or removed since the trees were
+		built: their old loci are removed, and those of the entries
+		still in source_table are added back. Without trees, they
+		are built from scratch
+	"""
+	cur = db.cursor()
+	try:
+		_create_registry(cur)
+		cur.execute("SELECT rtree_id FROM coord_rtree WHERE source_table = ?", (source_table,))
+		rtree_ids = [ rtree_id  for rtree_id, in cur.fetchall() ]
+		if len(rtree_ids) == 0:
+			rebuild_coord_index(db, source_table, key_column, loci)
+			return
+
+		cur.execute("DROP TABLE IF EXISTS temp.coord_delta")
+		cur.execute("CREATE TEMP TABLE coord_delta(entry_id INTEGER PRIMARY KEY)")
+		cur.executemany("INSERT OR IGNORE INTO temp.coord_delta(entry_id) VALUES(?)", ( (entry_id,)  for entry_id in entry_ids ))
+
+		# The R*Tree ids of every locus an entry may have
+		deltaIds = " UNION ALL ".join("SELECT entry_id * {} + {} FROM temp.coord_delta".format(LOCI_PER_ENTRY, locus) for locus in range(len(loci)))
+		for rtree_id in rtree_ids:
+			cur.execute("DELETE FROM {} WHERE id IN ({})".format(rtree_name(source_table, rtree_id), deltaIds))
+			if cur.rowcount > 0:
+				cur.execute("UPDATE coord_rtree SET entries = entries - ? WHERE rtree_id = ?", (cur.rowcount, rtree_id))
+
+		cur.execute("{} WHERE {} IN (SELECT entry_id FROM temp.coord_delta)".format(_select_loci(source_table, key_column, loci), key_column))
+		_index_loci(db, source_table, loci, cur)
+		cur.execute("DROP TABLE temp.coord_delta")
+	finally:
+		cur.close()
+
+def _find_rtree(cur, source_table, assembly, chro):
+	cur.execute("SELECT rtree_id FROM coord_rtree WHERE source_table = ? AND assembly IS ? AND chro = ?", (source_table, assembly, chro))
+	found = cur.fetchone()
+
+	return rtree_name(source_table, found[0]) if found is not None else None
+
+def query_coord_index(db, source_table, assembly, chro, start, stop=None, within=False):
+	"""
+		Returns the (entry_id, locus) pairs of source_table whose
+		locus overlaps the [start, stop] range of a chromosome. A
+		missing stop looks for a single position, and within only
+		accepts loci which fall completely inside the range
+	"""
+	if stop is None:
+		stop = start
+
+	cur = db.cursor()
+	try:
+		name = _find_rtree(cur, source_table, assembly, chro)
+		if name is None:
+			return []
+
+		if within:
+			condition = "start >= ? AND stop <= ?"
+			params = (start, stop)
+		else:
+			condition = "start <= ? AND stop >= ?"
+			params = (stop, start)
+		cur.execute("SELECT entry_id, locus FROM {} WHERE {} ORDER BY entry_id, locus".format(name, condition), params)
+
+		return cur.fetchall()
+	finally:
+		cur.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Looks up the variants of a database by their coordinates")
+	parser.add_argument("db_file", metavar="database_file", help="SQLite database loaded by the ClinVar or CIViC loaders")
+	parser.add_argument("assembly", help="assembly, like GRCh38")
+	parser.add_argument("chro", metavar="chromosome", help="chromosome, like 13")
+	parser.add_argument("start", type=int, help="first position")
+	parser.add_argument("stop", type=int, nargs="?", help="last position, when looking for a range")
+	parser.add_argument("--table", default="variant", help="indexed table (default: %(default)s)")
+	parser.add_argument("--within", action="store_true", help="only report loci completely inside the range")
+	args = parser.parse_args()
+
+	db = sqlite3.connect(args.db_file)
+	for entry_id, locus in query_coord_index(db, args.table, args.assembly, args.chro, args.start, args.stop, within=args.within):
+		print("{}\t{}".format(entry_id, locus))
+	db.close()
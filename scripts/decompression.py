@@ -0,0 +1,243 @@
+# ------------------------------------------------------------------------------
+# decompression.py
+# Decompression backends of the gzipped inputs, picking the fastest one at hand
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# gzip.open decompresses in the loader process, in small reads. Every
+# backend here returns a binary stream of the decompressed input
+# instead, which also tells how far it is in the compressed file:
+#   gzip:  the gzip module, as the loaders always did
+#   zlib:  zlib fed directly with reads of the file, sized so that
+#          each decompressed chunk stays in the CPU cache, following
+#          the members of multi-member files like the bgzip ones
+#   pipe:  an external decompressor, like pigz, running in its own
+#          process and reading the file itself, so decompression runs
+#          on another CPU while the loader parses
+#   plain: input which is not compressed at all
+# The auto backend picks plain for uncompressed input, an external
+# decompressor when there is a spare CPU for it, and zlib otherwise
+
+import os
+import io
+import gzip
+import shutil
+import subprocess
+import zlib
+
+DECOMPRESSION_BACKENDS = ["auto", "gzip", "zlib", "pipe", "plain"]
+
+DEFAULT_DECOMPRESSION = "auto"
+
+# External decompressors, in order of preference, as (tool, arguments,
+# only for BGZF input) tuples. {threads} is replaced by the threads
+# the tool may use
+EXTERNAL_DECOMPRESSORS = [
+	("pigz", ["-dc", "-p", "{threads}"], False),
+	("igzip", ["-dc"], False),
+	("bgzip", ["-dc", "-@", "{threads}"], True),
+	("gzip", ["-dc"], False),
+]
+
+# Compressed bytes fed to zlib at a time. variant_summary inflates
+# about ten times, and reads of a megabyte, whose output no longer fits
+# in the cache, were slower than these
+ZLIB_READ_SIZE = 64 * 1024
+
+# Buffer of the decompressed stream, read by the loaders
+READ_BUFFER_SIZE = 128 * 1024
+
+# zlib window bits value which expects a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+def is_gzip(input_file):
+	with open(input_file, "rb") as inF:
+		return inF.read(2) == GZIP_MAGIC
+
+def is_bgzf(input_file):
+	"""
+		Tells BGZF files, whose members carry their size in a BC
+		extra field, from other gzip files
+	"""
+	with open(input_file, "rb") as inF:
+		header = inF.read(16)
+	return len(header) == 16 and header[:2] == GZIP_MAGIC and header[3] & 4 != 0 and header[12:14] == b"BC"
+
+def external_decompressor(input_file, threads=None):
+	"""
+		Command line of the preferred external decompressor which is
+		installed, or None
+	"""
+	if threads is None:
+		threads = os.cpu_count() or 1
+	bgzf = None
+	for tool, arguments, bgzf_only in EXTERNAL_DECOMPRESSORS:
+		if bgzf_only:
+			if bgzf is None:
+				bgzf = is_bgzf(input_file)
+			if not bgzf:
+				continue
+		path = shutil.which(tool)
+		if path is not None:
+			return [path] + [ argument.format(threads=threads)  for argument in arguments ]
+
+	return None
+
+def select_backend(input_file, backend=DEFAULT_DECOMPRESSION):
+	"""
+		Resolves the auto backend for an input file
+	"""
+	if backend != "auto":
+		return backend
+	if not is_gzip(input_file):
+		return "plain"
+	if (os.cpu_count() or 1) > 1 and external_decompressor(input_file) is not None:
+		return "pipe"
+
+	return "zlib"
+
+class _ZlibRaw(io.RawIOBase):
+	"""
+		Raw stream of the decompressed content of a gzip file, member
+		after member
+	"""
+	def __init__(self, input_file, read_size=ZLIB_READ_SIZE):
+		super().__init__()
+		self.file = open(input_file, "rb", buffering=0)
+		self.read_size = read_size
+		self.decompressor = None
+		self.pending = memoryview(b"")
+		self.offset = 0
+		self.finished = False
+
+	def readable(self):
+		return True
+
+	def _fill(self):
+		data = self.file.read(self.read_size)
+		if not data:
+			if self.decompressor is not None:
+				raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+			self.finished = True
+			return
+
+		chunks = []
+		while data:
+			if self.decompressor is None:
+				self.decompressor = zlib.decompressobj(GZIP_WBITS)
+			chunks.append(self.decompressor.decompress(data))
+			data = b""
+			# The bytes after the end of a member start the next one
+			if self.decompressor.eof:
+				data = self.decompressor.unused_data
+				self.decompressor = None
+		self.pending = memoryview(b"".join(chunks))
+		self.offset = 0
+
+	def readinto(self, buffer):
+		while self.offset >= len(self.pending):
+			if self.finished:
+				return 0
+			self._fill()
+
+		size = min(len(buffer), len(self.pending) - self.offset)
+		buffer[:size] = self.pending[self.offset:self.offset + size]
+		self.offset += size
+
+		return size
+
+	def position(self):
+		return self.file.tell()
+
+	def close(self):
+		if not self.closed:
+			self.file.close()
+		super().close()
+
+class _PipeRaw(io.RawIOBase):
+	"""
+		Raw stream of the output of an external decompressor. The
+		decompressor reads the input file through a file description
+		shared with this process, so its offset is known here too
+	"""
+	def __init__(self, input_file, command):
+		super().__init__()
+		self.input_file = input_file
+		self.command = command
+		self.file = open(input_file, "rb", buffering=0)
+		self.process = subprocess.Popen(command, stdin=self.file, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		size = self.process.stdout.readinto(buffer)
+		if size == 0:
+			# A decompressor which failed also ends its output
+			returncode = self.process.wait()
+			if returncode != 0:
+				raise OSError("{} failed on {}: {}".format(os.path.basename(self.command[0]), self.input_file,
+					self.process.stderr.read().decode("utf-8", "replace").strip()))
+
+		return size
+
+	def position(self):
+		return os.lseek(self.file.fileno(), 0, os.SEEK_CUR)
+
+	def close(self):
+		if not self.closed:
+			# The decompressor is not waited for when the load stops early
+			if self.process.poll() is None:
+				self.process.kill()
+			self.process.stdout.close()
+			self.process.stderr.close()
+			self.process.wait()
+			self.file.close()
+		super().close()
+
+class DecompressedInput(io.BufferedReader):
+	"""
+		Buffered stream of the decompressed input, which also tells
+		the compressed bytes read so far
+	"""
+	def __init__(self, raw, position, backend, buffer_size=READ_BUFFER_SIZE):
+		super().__init__(raw, buffer_size)
+		self.position = position
+		self.backend = backend
+
+	def compressed_position(self):
+		return self.position()
+
+def open_decompressed(input_file, backend=DEFAULT_DECOMPRESSION):
+	"""
+		Opens a gzipped, or plain, input file with one of the
+		backends, as a binary stream of its decompressed content
+	"""
+	backend = select_backend(input_file, backend)
+	if backend == "gzip":
+		raw = gzip.open(input_file, "rb")
+		return DecompressedInput(raw, raw.fileobj.tell, backend)
+	if backend == "zlib":
+		raw = _ZlibRaw(input_file)
+		return DecompressedInput(raw, raw.position, backend)
+	if backend == "pipe":
+		command = external_decompressor(input_file)
+		if command is None:
+			raise ValueError("No external decompressor found, tried {}".format(", ".join(tool for tool, _, _ in EXTERNAL_DECOMPRESSORS)))
+		raw = _PipeRaw(input_file, command)
+		return DecompressedInput(raw, raw.position, backend)
+	if backend == "plain":
+		raw = open(input_file, "rb", buffering=0)
+		return DecompressedInput(raw, raw.tell, backend)
+
+	raise ValueError("Unknown decompression backend {}".format(backend))
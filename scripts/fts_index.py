@@ -0,0 +1,129 @@
+# ------------------------------------------------------------------------------
+# fts_index.py
+# FTS5 full-text indexes over the free text columns of ClinVar and CIViC
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# A LIKE with a leading wildcard scans the whole table. The free text
+# columns are also kept in FTS5 external-content tables, which store
+# only the index, and read the text from the content table, usually
+# the view which joins the text back. Triggers on the physical table
+# under it keep them in sync with small changes, while bulk loads drop
+# the triggers, as they do with the indexes, and rebuild the full-text
+# index at the end. Each index is declared as an (fts table, content
+# table, key column, [indexed columns], physical table) tuple
+
+import argparse
+import sqlite3
+
+FTS_TRIGGER_SUFFIXES = ["ai", "ad", "bu", "au"]
+
+def fts_table_decl(fts_spec):
+	fts_table, content_table, key_column, columns, table = fts_spec
+	return "CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5({}, content='{}', content_rowid='{}')".format(
+		fts_table, ", ".join(columns), content_table, key_column)
+
+def fts_trigger_decls(fts_spec):
+	fts_table, content_table, key_column, columns, table = fts_spec
+	names = ", ".join(columns)
+
+	# The values are read through the content table, so the old ones
+	# are taken before the row changes, and the new ones after
+	insertNew = "INSERT INTO {0}(rowid, {1}) SELECT {2}, {1} FROM {3} WHERE {2} = new.{2};".format(
+		fts_table, names, key_column, content_table)
+	deleteOld = "INSERT INTO {0}({0}, rowid, {1}) SELECT 'delete', {2}, {1} FROM {3} WHERE {2} = old.{2};".format(
+		fts_table, names, key_column, content_table)
+
+	return [
+		"CREATE TRIGGER IF NOT EXISTS {}_ai AFTER INSERT ON {} BEGIN {} END".format(fts_table, table, insertNew),
+		"CREATE TRIGGER IF NOT EXISTS {}_ad BEFORE DELETE ON {} BEGIN {} END".format(fts_table, table, deleteOld),
+		"CREATE TRIGGER IF NOT EXISTS {}_bu BEFORE UPDATE ON {} BEGIN {} END".format(fts_table, table, deleteOld),
+		"CREATE TRIGGER IF NOT EXISTS {}_au AFTER UPDATE ON {} BEGIN {} END".format(fts_table, table, insertNew),
+	]
+
+def create_fts_tables(db, fts_specs):
+	"""
+		Creates the full-text tables which are missing. Their
+		triggers are only created by sync_fts, once they are in sync
+	"""
+	cur = db.cursor()
+	try:
+		for fts_spec in fts_specs:
+			cur.execute(fts_table_decl(fts_spec))
+	finally:
+		cur.close()
+
+def drop_fts_triggers(db, fts_specs):
+	"""
+		Stops the maintenance of the full-text indexes, before a bulk load
+	"""
+	cur = db.cursor()
+	try:
+		for fts_spec in fts_specs:
+			fts_table = fts_spec[0]
+			for suffix in FTS_TRIGGER_SUFFIXES:
+				cur.execute("DROP TRIGGER IF EXISTS {}_{}".format(fts_table, suffix))
+	finally:
+		cur.close()
+
+def sync_fts(db, fts_specs):
+	"""
+		Rebuilds the full-text indexes whose triggers are missing, and
+		creates their triggers back, so later changes are followed
+	"""
+	cur = db.cursor()
+	try:
+		for fts_spec in fts_specs:
+			fts_table = fts_spec[0]
+			cur.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({})".format(
+				",".join("?" * len(FTS_TRIGGER_SUFFIXES))), [ fts_table + "_" + suffix  for suffix in FTS_TRIGGER_SUFFIXES ])
+			if cur.fetchone()[0] < len(FTS_TRIGGER_SUFFIXES):
+				drop_fts_triggers(db,[fts_spec])
+				cur.execute("INSERT INTO {0}({0}) VALUES('rebuild')".format(fts_table))
+				for triggerDecl in fts_trigger_decls(fts_spec):
+					cur.execute(triggerDecl)
+	finally:
+		cur.close()
+
+def search_fts(db, fts_table, match, column=None, limit=None):
+	"""
+		Returns the keys of the rows matching an FTS5 query, best
+		ranked first. column restricts the query to a single column
+	"""
+	if column is not None:
+		match = "{} : ({})".format(column, match)
+
+	query = "SELECT rowid FROM {0} WHERE {0} MATCH ? ORDER BY rank".format(fts_table)
+	params = [match]
+	if limit is not None:
+		query += " LIMIT ?"
+		params.append(limit)
+
+	cur = db.cursor()
+	try:
+		cur.execute(query, params)
+		return [ row[0]  for row in cur ]
+	finally:
+		cur.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Full-text search over the variants and evidences of a database")
+	parser.add_argument("db_file", metavar="database_file", help="SQLite database loaded by the ClinVar or CIViC loaders")
+	parser.add_argument("match", help="FTS5 query, like 'breast AND cancer'")
+	parser.add_argument("--table", default="variant_fts", help="full-text table (default: %(default)s)")
+	parser.add_argument("--column", help="only search this column")
+	parser.add_argument("--limit", type=int, help="best matches reported")
+	args = parser.parse_args()
+
+	db = sqlite3.connect(args.db_file)
+	for key in search_fts(db, args.table, args.match, column=args.column, limit=args.limit):
+		print(key)
+	db.close()
@@ -0,0 +1,184 @@
+# ------------------------------------------------------------------------------
+# interval_engine.py
+# In-memory batch overlap of genomic regions with the variants of a columnar snapshot
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# The loci of a snapshot (column_snapshot.py) are kept, by assembly
+# and chromosome, in arrays sorted by start, along with the running
+# maximum of their stops. A batch of regions sorted by start sweeps
+# those arrays: the loci starting after the end of a region are past
+# the sweep, those whose running maximum stop is before its start are
+# behind it, and np.searchsorted finds both bounds for every region
+# at once. Only the loci between the bounds are checked. A long locus,
+# like a copy number gain, would keep the running maximum high and
+# widen every window after it, so loci are split in tiers by length,
+# each one swept on its own. Regions, like the loci, are 1-based and
+# closed. BED regions are 0-based and half open, and read as such
+
+import sys
+import os
+import argparse
+import time
+
+import numpy as np
+
+from column_snapshot import VariantSnapshot
+
+# Upper length of the loci of each tier, the last one taking the rest
+LENGTH_TIERS = [1000, 100000]
+
+# Regions of a chromosome overlapped at a time, which bounds the
+# memory of the candidate pairs
+REGION_CHUNK = 10000
+
+class _Tier(object):
+	"""
+		Loci of a chromosome within a length tier, sorted by start
+	"""
+	def __init__(self, starts, stops, entry_ids):
+		self.starts = starts
+		self.stops = stops
+		self.entry_ids = entry_ids
+		self.max_stops = np.maximum.accumulate(stops)
+
+	def overlaps(self, region_starts, region_stops):
+		"""
+			Overlapping (region position, entry_id) arrays of a chunk
+			of regions, sorted by region start
+		"""
+		first = np.searchsorted(self.max_stops, region_starts, side="left")
+		last = np.searchsorted(self.starts, region_stops, side="right")
+		counts = np.maximum(last - first, 0)
+		total = int(counts.sum())
+		if total == 0:
+			return None, None
+
+		# Every candidate locus, next to the region it is checked against
+		region_of = np.repeat(np.arange(len(counts)), counts)
+		ends = np.cumsum(counts)
+		candidates = np.arange(total) - np.repeat(ends - counts, counts) + np.repeat(first, counts)
+		found = self.stops[candidates] >= region_starts[region_of]
+
+		return region_of[found], self.entry_ids[candidates[found]]
+
+class IntervalEngine(object):
+	"""
+		Loci of the variants of a snapshot, by (assembly,
+		chromosome), ready for batch overlap queries
+	"""
+	def __init__(self, snapshot, length_tiers=LENGTH_TIERS):
+		self.source = snapshot.source
+		assemblies = snapshot.dictionaries["assembly"]
+		chromosomes = snapshot.dictionaries["chro"]
+
+		entry_ids = np.asarray(snapshot.column("entry_id"))
+		assembly = np.asarray(snapshot.column("assembly"), dtype=np.int64)
+		chro = np.asarray(snapshot.column("chro"), dtype=np.int64)
+		start = np.asarray(snapshot.column("start"))
+		stop = np.asarray(snapshot.column("stop"))
+
+		# A missing stop is a single position, and reversed loci are
+		# put right, as the R*Tree coordinate indexes do
+		stop = np.where(stop < 0, start, stop)
+		start, stop = np.minimum(start, stop), np.maximum(start, stop)
+		placed = np.flatnonzero((stop >= 1) & (chro >= 0))
+		lengthTier = np.searchsorted(np.array(length_tiers), stop - start + 1, side="left")
+
+		# Loci sorted by assembly, chromosome, tier and start, and the
+		# bounds of each (assembly, chromosome, tier) group
+		order = placed[np.lexsort((start[placed], lengthTier[placed], chro[placed], assembly[placed]))]
+		groups = np.stack((assembly[order], chro[order], lengthTier[order]))
+		bounds = np.concatenate(([0], np.flatnonzero(np.any(groups[:, 1:] != groups[:, :-1], axis=0)) + 1, [len(order)]))
+
+		self.tiers = {}
+		for begin, end in zip(bounds[:-1], bounds[1:]):
+			if begin == end:
+				continue
+			first = order[begin]
+			key = (assemblies[assembly[first]] if assembly[first] >= 0 else None, chromosomes[chro[first]])
+			rows = order[begin:end]
+			self.tiers.setdefault(key, []).append(_Tier(start[rows], stop[rows], entry_ids[rows]))
+		self.loci = len(order)
+
+	def overlaps(self, assembly, regions):
+		"""
+			Streams the (region position, entry_id) pairs of the
+			regions, (chromosome, start, stop) tuples, overlapping a
+			locus, chromosome by chromosome
+		"""
+		byChro = {}
+		for position, (chro, start, stop) in enumerate(regions):
+			byChro.setdefault(chro, []).append((start, stop, position))
+
+		for chro, chroRegions in byChro.items():
+			tiers = self.tiers.get((assembly, chro))
+			if tiers is None:
+				continue
+			chroRegions.sort()
+			region_array = np.array(chroRegions, dtype=np.int64)
+			for begin in range(0, len(region_array), REGION_CHUNK):
+				chunk = region_array[begin:begin + REGION_CHUNK]
+				for tier in tiers:
+					region_of, entry_ids = tier.overlaps(chunk[:, 0], chunk[:, 1])
+					if region_of is not None:
+						yield from zip(chunk[region_of, 2].tolist(), entry_ids.tolist())
+
+def normalize_chromosome(chro):
+	"""
+		Chromosome name of a BED file, as ClinVar and CIViC name them
+	"""
+	if chro.lower().startswith("chr"):
+		chro = chro[3:]
+	return "MT" if chro == "M" else chro
+
+def read_bed_regions(bed_file):
+	"""
+		Regions of a BED file, as (name, chromosome, start, stop)
+		tuples with 1-based closed coordinates. Unnamed regions are
+		named after their coordinates
+	"""
+	regions = []
+	with open(bed_file, "r", encoding="utf-8") as bedF:
+		for line in bedF:
+			if line.startswith(("#", "track", "browser")) or len(line.strip()) == 0:
+				continue
+			fields = line.rstrip("\n").split("\t")
+			chro = normalize_chromosome(fields[0])
+			start = int(fields[1]) + 1
+			stop = int(fields[2])
+			name = fields[3] if len(fields) > 3 and fields[3] != "" else "{}:{}-{}".format(chro, start, stop)
+			regions.append((name, chro, start, stop))
+	return regions
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Lists the variants of columnar snapshots overlapping the regions of a BED file")
+	parser.add_argument("bed_file", help="BED file of the regions, like a gene panel or an exome")
+	parser.add_argument("snapshot_dir", nargs="+", help="snapshot written by column_snapshot.py or by the loaders, like a ClinVar and a CIViC one")
+	parser.add_argument("--assembly", default="GRCh38", help="assembly of the regions (default: %(default)s)")
+	args = parser.parse_args()
+
+	regions = read_bed_regions(args.bed_file)
+	spans = [ (chro, start, stop)  for name, chro, start, stop in regions ]
+
+	print("region\tsnapshot\tentry_id")
+	for snapshot_dir in args.snapshot_dir:
+		label = os.path.basename(os.path.normpath(snapshot_dir))
+		start = time.perf_counter()
+		engine = IntervalEngine(VariantSnapshot(snapshot_dir))
+		loaded = time.perf_counter()
+		pairs = 0
+		for position, entry_id in engine.overlaps(args.assembly, spans):
+			print("{}\t{}\t{}".format(regions[position][0], label, entry_id))
+			pairs += 1
+		elapsed = time.perf_counter() - loaded
+		print("{}: {} loci loaded in {:.2f} s, {} regions and {} overlaps in {:.2f} s, {:.0f} regions/s".format(
+			label, engine.loci, loaded - start, len(regions), pairs, elapsed, len(regions) / elapsed if elapsed > 0 else 0.0), file=sys.stderr)
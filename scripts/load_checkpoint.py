@@ -0,0 +1,148 @@
+# ------------------------------------------------------------------------------
+# load_checkpoint.py
+# Checkpoints of the ClinVar and CIViC loaders, so a broken load can be resumed
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Loaders commit every so many rows. Each commit updates the row of
+# the loaded table in load_checkpoint within the same transaction, so
+# after a crash the database holds exactly the rows accounted for by
+# the checkpoint, and a resumed load skips that many input lines.
+# The bulk PRAGMA profile commits to a write-ahead log, so a load
+# killed in the middle of a commit is also back at its last checkpoint
+
+import hashlib
+import itertools
+import os
+
+LOAD_CHECKPOINT_DEFS = [
+"""
+CREATE TABLE IF NOT EXISTS load_checkpoint (
+	target VARCHAR(64) PRIMARY KEY,
+	input_file VARCHAR(1024) NOT NULL,
+	fingerprint VARCHAR(64) NOT NULL,
+	line_offset INTEGER NOT NULL,
+	last_ventry_id INTEGER NULL,
+	completed BOOLEAN NOT NULL DEFAULT 0,
+	updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+]
+
+# Data rows between two commits
+DEFAULT_CHECKPOINT_ROWS = 200000
+
+# Bytes read from each end of an input file to fingerprint it
+FINGERPRINT_SAMPLE_BYTES = 1024 * 1024
+
+def file_fingerprint(input_file):
+	"""
+		Cheap fingerprint of an input file: its size, plus a hash of
+		its first and last megabytes. A new release changes the size
+		or, being compressed, the bytes all over the file
+	"""
+	size = os.path.getsize(input_file)
+	digest = hashlib.blake2b(str(size).encode("utf-8"), digest_size=16)
+	with open(input_file, "rb") as inF:
+		digest.update(inF.read(FINGERPRINT_SAMPLE_BYTES))
+		if size > FINGERPRINT_SAMPLE_BYTES:
+			inF.seek(max(FINGERPRINT_SAMPLE_BYTES, size - FINGERPRINT_SAMPLE_BYTES))
+			digest.update(inF.read())
+
+	return digest.hexdigest()
+
+def start_checkpoint(db, target, key_column, input_file, resume=False):
+	"""
+		Prepares the checkpoint of a load of input_file into the
+		target table. When resuming, it returns the lines already
+		loaded and the last key written by the previous run, after
+		checking both the input file and the table still match it.
+		Otherwise, the checkpoint is reset and (0, None) is returned
+	"""
+	fingerprint = file_fingerprint(input_file)
+
+	cur = db.cursor()
+	try:
+		for tableDecl in LOAD_CHECKPOINT_DEFS:
+			cur.execute(tableDecl)
+
+		cur.execute("SELECT fingerprint, line_offset, last_ventry_id FROM load_checkpoint WHERE target = ?", (target,))
+		checkpoint = cur.fetchone()
+
+		if resume and checkpoint is not None:
+			checkpoint_fingerprint, line_offset, last_ventry_id = checkpoint
+			if checkpoint_fingerprint != fingerprint:
+				raise ValueError("The checkpoint of {} belongs to another input file, it cannot be resumed with {}".format(target, input_file))
+			if last_ventry_id is not None:
+				cur.execute("SELECT EXISTS(SELECT 1 FROM {} WHERE {} = ?)".format(target, key_column), (last_ventry_id,))
+				if not cur.fetchone()[0]:
+					raise ValueError("Row {} of {} is not in the database, so its checkpoint cannot be trusted".format(last_ventry_id, target))
+
+			return line_offset, last_ventry_id
+
+		with db:
+			cur.execute("""
+				INSERT OR REPLACE INTO load_checkpoint(
+					target,
+					input_file,
+					fingerprint,
+					line_offset,
+					last_ventry_id,
+					completed)
+				VALUES(?,?,?,0,NULL,0)
+			""", (target, os.path.abspath(input_file), fingerprint))
+	finally:
+		cur.close()
+
+	return 0, None
+
+def save_checkpoint(cur, target, line_offset, last_ventry_id, completed=False):
+	"""
+		Records how far the load of target went. It must run within
+		the transaction which writes those rows, just before its commit
+	"""
+	cur.execute("""
+		UPDATE load_checkpoint SET
+			line_offset = ?,
+			last_ventry_id = ?,
+			completed = ?,
+			updated = CURRENT_TIMESTAMP
+		WHERE target = ?
+	""", (line_offset, last_ventry_id, completed, target))
+
+def skip_lines(lines, count):
+	"""
+		Consumes the first count lines of an iterator
+	"""
+	next(itertools.islice(lines, count, count), None)
+
+def database_fingerprint(db):
+	"""
+		Fingerprint of the loads a database went through: every load
+		leaves its input file fingerprint and how far it went in
+		load_checkpoint, so a different or further load changes it.
+		Schema changes, like new tables or indexes, change it too
+	"""
+	digest = hashlib.blake2b(digest_size=16)
+
+	cur = db.cursor()
+	try:
+		cur.execute("PRAGMA schema_version")
+		digest.update(repr(cur.fetchone()).encode("utf-8"))
+		cur.execute("SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'load_checkpoint')")
+		if cur.fetchone()[0]:
+			cur.execute("SELECT * FROM load_checkpoint ORDER BY target")
+			for row in cur:
+				digest.update(repr(row).encode("utf-8"))
+	finally:
+		cur.close()
+
+	return digest.hexdigest()
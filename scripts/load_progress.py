@@ -0,0 +1,142 @@
+# ------------------------------------------------------------------------------
+# load_progress.py
+# Live progress and ETA of the gzipped loads, from the compressed byte offset
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# The number of rows of a gzipped file is unknown until it has been
+# read, but its compressed size is not, and the compressed bytes read
+# so far tell how far the load is. The loaders call update every
+# PROGRESS_CHECK_ROWS rows, which only looks at the clock, and the
+# progress line is refreshed at most once per interval. Each refresh is
+# also kept as a sample in the load stats, when there are any
+
+import sys
+import os
+import itertools
+import time
+
+from load_stats import NULL_LOAD_STATS
+
+# Rows between two looks at the clock
+PROGRESS_CHECK_ROWS = 1000
+
+# Seconds between two refreshes of the progress line
+DEFAULT_PROGRESS_INTERVAL = 1.0
+
+def format_duration(seconds):
+	seconds = int(seconds)
+	return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class LoadProgress(object):
+	"""
+		Reports the rows loaded, the rows and megabytes per second,
+		the ETA and the rows of the open transaction. position is a
+		function returning the compressed bytes read so far
+	"""
+	def __init__(self, label, input_file, position, stats=NULL_LOAD_STATS, show=True, interval=DEFAULT_PROGRESS_INTERVAL, file=sys.stderr):
+		self.label = label
+		self.total_bytes = os.path.getsize(input_file)
+		self.position = position
+		self.stats = stats
+		self.show = show
+		self.interval = interval
+		self.file = file
+		# A terminal gets one line, rewritten, and a log one per refresh
+		self.line_end = "\r" if show and file.isatty() else "\n"
+
+		# Resumed loads start past the beginning of the file
+		self.started = time.monotonic()
+		self.start_offset = position()
+		self.next_refresh = self.started + interval
+		self.shown = False
+		self.rows = 0
+
+	def update(self, rows, transaction_rows):
+		self.rows = rows
+		now = time.monotonic()
+		if now >= self.next_refresh:
+			self.next_refresh = now + self.interval
+			self.refresh(now, rows, transaction_rows)
+
+	def refresh(self, now, rows, transaction_rows):
+		offset = self.position()
+		elapsed = now - self.started
+		bytes_rate = (offset - self.start_offset) / elapsed if elapsed > 0 else 0.0
+		rows_rate = rows / elapsed if elapsed > 0 else 0.0
+		eta = (self.total_bytes - offset) / bytes_rate if bytes_rate > 0 else None
+
+		self.stats.record_progress({
+			"elapsed_seconds": elapsed,
+			"rows": rows,
+			"compressed_offset": offset,
+			"rows_per_second": rows_rate,
+			"mb_per_second": bytes_rate / 1e6,
+			"eta_seconds": eta,
+			"transaction_rows": transaction_rows,
+		})
+
+		if self.show:
+			print("{}: {:5.1f}% {} rows, {:.0f} rows/s, {:.2f} compressed MB/s, ETA {}, {} rows in transaction".format(
+				self.label, 100.0 * offset / self.total_bytes if self.total_bytes > 0 else 100.0,
+				rows, rows_rate, bytes_rate / 1e6,
+				format_duration(eta) if eta is not None else "-", transaction_rows),
+				end=self.line_end, file=self.file, flush=True)
+			self.shown = True
+
+	def counted(self, rows):
+		"""
+			Iterates over rows which all go in one transaction, as an
+			executemany does, updating the progress as they go
+		"""
+		iterator = iter(rows)
+		count = 0
+		while True:
+			chunk = list(itertools.islice(iterator, PROGRESS_CHECK_ROWS))
+			if len(chunk) == 0:
+				break
+			yield from chunk
+			count += len(chunk)
+			self.update(count, count)
+
+	def close(self, rows=None):
+		"""
+			Shows the final figures, leaving the terminal on a new line.
+			Without rows, those of the last update are shown
+		"""
+		self.refresh(time.monotonic(), rows if rows is not None else self.rows, 0)
+		if self.shown and self.line_end == "\r":
+			print(file=self.file)
+
+class NullLoadProgress(object):
+	"""
+		Stands for LoadProgress when there is nothing to report to
+	"""
+	def update(self, rows, transaction_rows):
+		pass
+
+	def counted(self, rows):
+		return rows
+
+	def close(self, rows=None):
+		pass
+
+NULL_LOAD_PROGRESS = NullLoadProgress()
+
+def start_progress(label, input_file, position, stats=NULL_LOAD_STATS, show=False):
+	"""
+		Progress of a load, shown when asked to and sampled in the
+		load stats when they are kept
+	"""
+	if not show and stats is NULL_LOAD_STATS:
+		return NULL_LOAD_PROGRESS
+
+	return LoadProgress(label, input_file, position, stats=stats, show=show)
@@ -0,0 +1,293 @@
+# ------------------------------------------------------------------------------
+# load_stats.py
+# Optional per-stage timings and counters of the loaders, written as a JSON report
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# The loader is always in exactly one stage, and switching to another
+# one charges the time elapsed since the last switch to the stage being
+# left. So the stage times are exclusive and add up to the whole load:
+# the decompression of a block read while decoding a line is charged
+# to the decompression, not to the decoding. Switches only happen in
+# the loader thread. The loaders get NULL_LOAD_STATS when no report is
+# wanted, whose methods do nothing, so the cost of the instrumentation
+# is a few empty method calls per row
+
+import io
+import gzip
+import json
+import contextlib
+import collections
+import datetime
+import time
+
+# Stage the loader is in until it says otherwise
+INITIAL_STAGE = "setup"
+
+class _TimedStream(io.BufferedIOBase):
+	"""
+		Binary stream whose reads are charged to a stage. Text
+		wrappers read it in blocks, so the switches are few
+	"""
+	def __init__(self, stream, stats, stage):
+		super().__init__()
+		self.stream = stream
+		self.stats = stats
+		self.stage = stage
+
+	def readable(self):
+		return True
+
+	def read(self, size=-1):
+		previous = self.stats.switch(self.stage)
+		try:
+			return self.stream.read(size)
+		finally:
+			self.stats.switch(previous)
+
+	def read1(self, size=-1):
+		previous = self.stats.switch(self.stage)
+		try:
+			return self.stream.read1(size)
+		finally:
+			self.stats.switch(previous)
+
+	def close(self):
+		self.stream.close()
+		super().close()
+
+class LoadStats(object):
+	"""
+		Time per stage, rows per table, skipped and quarantined rows
+		and commit latencies of one load
+	"""
+	def __init__(self, loader, input_file):
+		self.loader = loader
+		self.input_file = input_file
+		self.started = datetime.datetime.now()
+
+		self.stages = collections.defaultdict(float)
+		self.stage_name = INITIAL_STAGE
+		self.stage_since = time.perf_counter()
+
+		self.counters = collections.Counter()
+		self.quarantined = collections.Counter()
+		self.commits = []
+		self.pipeline = None
+		self.progress = []
+
+		# Rows of the loaded tables before and after the load
+		self.tables = []
+		self.rows_before = {}
+		self.rows_after = {}
+
+	def switch(self, stage):
+		"""
+			Enters a stage, returning the one being left
+		"""
+		now = time.perf_counter()
+		previous = self.stage_name
+		self.stages[previous] += now - self.stage_since
+		self.stage_name = stage
+		self.stage_since = now
+
+		return previous
+
+	@contextlib.contextmanager
+	def stage(self, stage):
+		previous = self.switch(stage)
+		try:
+			yield
+		finally:
+			self.switch(previous)
+
+	def timed(self, iterable, stage):
+		"""
+			Iterates over iterable, charging the wait for each item to
+			the stage
+		"""
+		iterator = iter(iterable)
+		while True:
+			previous = self.switch(stage)
+			try:
+				item = next(iterator)
+			except StopIteration:
+				return
+			finally:
+				self.switch(previous)
+			yield item
+
+	def stream(self, stream, stage):
+		return _TimedStream(stream, self, stage)
+
+	def commit(self, db):
+		previous = self.switch("commit")
+		started = time.perf_counter()
+		try:
+			db.commit()
+		finally:
+			self.commits.append(time.perf_counter() - started)
+			self.switch(previous)
+
+	def count(self, counter, value=1):
+		self.counters[counter] += value
+
+	def quarantine(self, reason, value=1):
+		self.quarantined[reason] += value
+
+	def record_progress(self, sample):
+		"""
+			Keeps a progress sample, taken by a LoadProgress
+		"""
+		self.progress.append(sample)
+
+	def add_pipeline(self, pipeline_stats):
+		"""
+			Keeps the figures of a run_pipeline, whose reader and
+			parser stages run in their own threads
+		"""
+		self.pipeline = {
+			"decompressed_bytes": pipeline_stats["bytes"],
+			"elapsed_seconds": pipeline_stats["elapsed"],
+			"queues": {
+				monitoredQueue.name: {
+					"mean_occupancy": monitoredQueue.occupancy_sum / monitoredQueue.samples if monitoredQueue.samples > 0 else 0.0,
+					"max_occupancy": monitoredQueue.occupancy_max,
+					"producer_wait_seconds": monitoredQueue.put_wait,
+					"consumer_wait_seconds": monitoredQueue.get_wait,
+				}
+				for monitoredQueue in pipeline_stats["queues"]
+			},
+		}
+
+	def _table_rows(self, db):
+		cur = db.cursor()
+		try:
+			rows = {}
+			for table in self.tables:
+				cur.execute("SELECT COUNT(*) FROM {}".format(table))
+				rows[table] = cur.fetchone()[0]
+			return rows
+		finally:
+			cur.close()
+
+	def begin(self, db, tables):
+		"""
+			Counts the rows of the loaded tables before the load
+		"""
+		with self.stage("table_counts"):
+			self.tables = list(tables)
+			self.rows_before = self._table_rows(db)
+
+	def finish(self, db):
+		"""
+			Counts them again once the load is over, and closes the
+			stage the loader was in
+		"""
+		with self.stage("table_counts"):
+			self.rows_after = self._table_rows(db)
+		self.switch(INITIAL_STAGE)
+
+	def report(self):
+		commits = sorted(self.commits)
+		elapsed = sum(self.stages.values())
+		return {
+			"loader": self.loader,
+			"input_file": self.input_file,
+			"started": self.started.isoformat(timespec="seconds"),
+			"elapsed_seconds": elapsed,
+			"stages": {
+				stage: { "seconds": seconds, "share": seconds / elapsed if elapsed > 0 else 0.0 }
+				for stage, seconds in sorted(self.stages.items(), key=lambda item: item[1], reverse=True)
+			},
+			"rows": {
+				table: {
+					"before": self.rows_before.get(table),
+					"after": self.rows_after.get(table),
+					"added": self.rows_after.get(table, 0) - self.rows_before.get(table, 0),
+				}
+				for table in self.tables
+			},
+			"counters": dict(self.counters),
+			"skipped_rows": self.counters.get("skipped_rows", 0),
+			"quarantined": dict(self.quarantined),
+			"commits": {
+				"count": len(commits),
+				"total_seconds": sum(commits),
+				"mean_seconds": sum(commits) / len(commits) if commits else 0.0,
+				"median_seconds": commits[len(commits) // 2] if commits else 0.0,
+				"max_seconds": commits[-1] if commits else 0.0,
+			},
+			"pipeline": self.pipeline,
+			"progress": self.progress,
+		}
+
+	def write_report(self, stats_file):
+		with open(stats_file, "w", encoding="utf-8") as statsF:
+			json.dump(self.report(), statsF, indent=1)
+
+class NullLoadStats(object):
+	"""
+		Stands for LoadStats when no report is wanted
+	"""
+	_nullcontext = contextlib.nullcontext()
+
+	def switch(self, stage):
+		return None
+
+	def stage(self, stage):
+		return self._nullcontext
+
+	def timed(self, iterable, stage):
+		return iterable
+
+	def stream(self, stream, stage):
+		return stream
+
+	def commit(self, db):
+		db.commit()
+
+	def count(self, counter, value=1):
+		pass
+
+	def quarantine(self, reason, value=1):
+		pass
+
+	def record_progress(self, sample):
+		pass
+
+	def add_pipeline(self, pipeline_stats):
+		pass
+
+	def begin(self, db, tables):
+		pass
+
+	def finish(self, db):
+		pass
+
+NULL_LOAD_STATS = NullLoadStats()
+
+def wrap_text_input(stream, stats=NULL_LOAD_STATS, stage="read"):
+	"""
+		Reads the lines of a binary input stream. The reads of its
+		blocks are charged to the stage
+	"""
+	return io.TextIOWrapper(stats.stream(stream, stage), encoding="utf-8")
+
+def open_text_input(input_file, stats=NULL_LOAD_STATS, compressed=False):
+	"""
+		Opens an input file to be read line by line. Reading its blocks
+		is charged to the decompress stage, or to the read stage when
+		it is not compressed
+	"""
+	if compressed:
+		return wrap_text_input(gzip.open(input_file, "rb"), stats, "decompress")
+	return wrap_text_input(open(input_file, "rb"), stats, "read")
@@ -0,0 +1,201 @@
+# ------------------------------------------------------------------------------
+# pipeline.py
+# Threaded read / parse / write pipeline for the gzipped ClinVar loaders
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# The reader stage decompresses big blocks, the parser stage turns
+# them into rows, and the writer stage is the caller, which consumes
+# the parsed blocks and runs the inserts. zlib and sqlite3 release
+# the GIL, so decompression and SQLite work overlap with parsing.
+# The stages are joined by bounded queues, so memory stays flat
+
+import sys
+import queue
+import threading
+import time
+
+# Bytes read from the decompressed stream at a time
+PIPELINE_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Blocks each queue can hold before the stage feeding it waits
+PIPELINE_QUEUE_SIZE = 8
+
+# Marks the end of the stream in the queues
+_END = object()
+
+class _Failure(object):
+	"""
+		Carries an exception raised in a stage to the writer
+	"""
+	def __init__(self, error):
+		self.error = error
+
+class MonitoredQueue(queue.Queue):
+	"""
+		Bounded queue which records how full it is every time a
+		block is put, and how long its producer and its consumer
+		had to wait on it
+	"""
+	def __init__(self, name, maxsize):
+		super().__init__(maxsize)
+		self.name = name
+		self.samples = 0
+		self.occupancy_sum = 0
+		self.occupancy_max = 0
+		self.put_wait = 0.0
+		self.get_wait = 0.0
+
+	def put(self, item, block=True, timeout=None):
+		occupancy = self.qsize()
+		started = time.perf_counter()
+		try:
+			super().put(item, block, timeout)
+		finally:
+			self.put_wait += time.perf_counter() - started
+
+		self.samples += 1
+		self.occupancy_sum += occupancy
+		if occupancy > self.occupancy_max:
+			self.occupancy_max = occupancy
+
+	def get(self, block=True, timeout=None):
+		started = time.perf_counter()
+		try:
+			return super().get(block, timeout)
+		finally:
+			self.get_wait += time.perf_counter() - started
+
+def read_blocks(stream, block_size=PIPELINE_BLOCK_SIZE):
+	"""
+		Yields blocks of complete lines read from a binary stream
+	"""
+	pending = b""
+	while True:
+		block = stream.read(block_size)
+		if not block:
+			break
+		block = pending + block
+		# Lines are never split between two blocks
+		cut = block.rfind(b"\n") + 1
+		pending = block[cut:]
+		if cut > 0:
+			yield block[:cut]
+	if len(pending) > 0:
+		yield pending
+
+def block_lines(block):
+	"""
+		Decodes a block into its lines, without the newlines
+	"""
+	lines = block.decode("utf-8").split("\n")
+	if lines[-1] == "":
+		lines.pop()
+
+	return lines
+
+def _get(inQueue, stop):
+	# Waits for a block, unless the pipeline is being stopped
+	while not stop.is_set():
+		try:
+			return inQueue.get(timeout=0.1)
+		except queue.Empty:
+			pass
+
+	return _END
+
+def _put(outQueue, item, stop):
+	# Waits for room in the queue, unless the pipeline is being stopped
+	while not stop.is_set():
+		try:
+			outQueue.put(item, timeout=0.1)
+			return True
+		except queue.Full:
+			pass
+
+	return False
+
+def _reader_stage(stream, block_size, outQueue, stats, stop):
+	try:
+		for block in read_blocks(stream, block_size):
+			stats["bytes"] += len(block)
+			if not _put(outQueue, block, stop):
+				return
+		_put(outQueue, _END, stop)
+	except BaseException as e:
+		_put(outQueue, _Failure(e), stop)
+
+def _parser_stage(parse_block, inQueue, outQueue, stop):
+	try:
+		while True:
+			block = _get(inQueue, stop)
+			if block is _END or isinstance(block, _Failure):
+				_put(outQueue, block, stop)
+				return
+			if not _put(outQueue, parse_block(block), stop):
+				return
+	except BaseException as e:
+		_put(outQueue, _Failure(e), stop)
+
+def run_pipeline(stream, parse_block, stats, block_size=PIPELINE_BLOCK_SIZE, queue_size=PIPELINE_QUEUE_SIZE):
+	"""
+		Generator of the parsed blocks of a binary stream, in order.
+		parse_block receives a block of complete lines and returns
+		anything the caller, the writer stage, knows how to store.
+		stats is filled with the figures shown by print_pipeline_report
+	"""
+	rawQueue = MonitoredQueue("decompressed blocks", queue_size)
+	parsedQueue = MonitoredQueue("parsed blocks", queue_size)
+	stop = threading.Event()
+
+	stats["bytes"] = 0
+	stats["queues"] = [rawQueue, parsedQueue]
+	stats["started"] = time.perf_counter()
+
+	threads = [
+		threading.Thread(target=_reader_stage, args=(stream, block_size, rawQueue, stats, stop), name="reader", daemon=True),
+		threading.Thread(target=_parser_stage, args=(parse_block, rawQueue, parsedQueue, stop), name="parser", daemon=True),
+	]
+	for thread in threads:
+		thread.start()
+
+	try:
+		while True:
+			parsed = parsedQueue.get()
+			if parsed is _END:
+				break
+			if isinstance(parsed, _Failure):
+				raise parsed.error
+			yield parsed
+	finally:
+		# Either the stream is over or the writer gave up, so the
+		# other stages are told to stop before waiting for them
+		stop.set()
+		for thread in threads:
+			thread.join()
+		stats["elapsed"] = time.perf_counter() - stats["started"]
+
+def print_pipeline_report(stats, rows, file=sys.stderr):
+	"""
+		Prints throughput and queue occupancy. A queue which is
+		usually full points to its consumer as the bottleneck, while
+		queues which are usually empty point to the reader
+	"""
+	elapsed = stats["elapsed"]
+	print("Pipeline: {} rows, {:.1f} MB decompressed in {:.2f} s ({:.0f} rows/s, {:.1f} MB/s)".format(
+		rows, stats["bytes"] / 1e6, elapsed,
+		rows / elapsed if elapsed > 0 else 0,
+		stats["bytes"] / 1e6 / elapsed if elapsed > 0 else 0), file=file)
+	for monitoredQueue in stats["queues"]:
+		mean = monitoredQueue.occupancy_sum / monitoredQueue.samples if monitoredQueue.samples > 0 else 0
+		print("  {}: mean occupancy {:.1f}/{}, max {}, producer waited {:.2f} s, consumer waited {:.2f} s".format(
+			monitoredQueue.name, mean, monitoredQueue.maxsize, monitoredQueue.occupancy_max,
+			monitoredQueue.put_wait, monitoredQueue.get_wait), file=file)
@@ -0,0 +1,350 @@
+# ------------------------------------------------------------------------------
+# release_compare.py
+# Differences between two releases of the ClinVar or CIViC databases
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Both databases are ATTACHed, read only, to an in-memory one, and
+# compared with joins over their keys, so the rows never go through
+# Python. ClinVar variants are grouped by (VariationID, AlleleID,
+# Assembly), from the variant_hash table. Within a group, rows with the
+# same row hash are the same variant, whatever their occurrence, so a
+# repeated row gained or lost does not shift the others. The rows left
+# are paired in occurrence order as changed ones, and the rest are
+# added or removed. CIViC rows are matched by their ids, and compared
+# column by column. The differences are kept in temp.release_diff.
+# Meanwhile, the canonical queries run against each release in their
+# own process, and their results are compared too
+
+import sys
+import argparse
+import collections
+import multiprocessing
+import sqlite3
+import time
+
+from canonical_queries import DEFAULT_CACHE_DIR, select_queries, query_database, format_row, parse_param
+
+RELEASE_DIFF_DEFS = [
+"""
+CREATE TEMP TABLE IF NOT EXISTS release_diff (
+	source_table VARCHAR(64) NOT NULL,
+	status VARCHAR(16) NOT NULL,
+	variation_id INTEGER NULL,
+	allele_id INTEGER NULL,
+	assembly VARCHAR(16) NULL,
+	occurrence INTEGER NULL,
+	old_id INTEGER NULL,
+	new_id INTEGER NULL
+)
+"""
+]
+
+# CIViC tables compared row by row, as (view, key column, column whose
+# changes are reported as reclassifications, or None)
+CIVIC_COMPARED_TABLES = [
+	("variant", "variant_id", None),
+	("evidence", "evidence_id", "clinical_significance"),
+]
+
+# Reclassifications listed in the report
+TOP_RECLASSIFICATIONS = 20
+
+def attach_releases(old_file, new_file):
+	"""
+		In-memory database with both releases ATTACHed, read only,
+		as the old and new schemas
+	"""
+	db = sqlite3.connect(":memory:", uri=True)
+	cur = db.cursor()
+	try:
+		for schema, db_file in (("old", old_file), ("new", new_file)):
+			cur.execute("ATTACH DATABASE ? AS {}".format(schema), ("file:{}?mode=ro".format(db_file),))
+		for tableDecl in RELEASE_DIFF_DEFS:
+			cur.execute(tableDecl)
+	finally:
+		cur.close()
+
+	return db
+
+def schema_names(cur, schema):
+	cur.execute("SELECT name FROM {}.sqlite_master WHERE type IN ('table', 'view')".format(schema))
+	return { row[0]  for row in cur }
+
+def status_counts(cur, source_table):
+	cur.execute("SELECT status, COUNT(*) FROM temp.release_diff WHERE source_table = ? GROUP BY status", (source_table,))
+	counts = { "added": 0, "removed": 0, "changed": 0 }
+	counts.update(cur.fetchall())
+
+	return counts
+
+def compare_clinvar(db):
+	"""
+		Added, removed and changed ClinVar variants, and the changes
+		of their clinical significance. Returns the counts, and the
+		(old significance, new significance, variants) transitions
+	"""
+	groupMatch = "o.variation_id = n.variation_id AND o.allele_id = n.allele_id AND o.assembly IS n.assembly"
+
+	cur = db.cursor()
+	try:
+		# Groups where some row has no counterpart with the same
+		# occurrence and row hash. The rows of the other groups are
+		# all unchanged
+		cur.execute("DROP TABLE IF EXISTS temp.changed_group")
+		cur.execute("""
+			CREATE TEMP TABLE changed_group AS
+			SELECT n.variation_id, n.allele_id, n.assembly
+			FROM new.variant_hash n
+			WHERE NOT EXISTS (SELECT 1 FROM old.variant_hash o WHERE {0} AND o.occurrence = n.occurrence AND o.row_hash = n.row_hash)
+			UNION
+			SELECT o.variation_id, o.allele_id, o.assembly
+			FROM old.variant_hash o
+			WHERE NOT EXISTS (SELECT 1 FROM new.variant_hash n WHERE {0} AND n.occurrence = o.occurrence AND n.row_hash = o.row_hash)
+		""".format(groupMatch))
+
+		# Rows of those groups in each release, numbered among those
+		# of their group sharing their row hash
+		for schema in ("old", "new"):
+			cur.execute("DROP TABLE IF EXISTS temp.{}_hash".format(schema))
+			cur.execute("""
+				CREATE TEMP TABLE {0}_hash AS
+				SELECT h.ventry_id, h.variation_id, h.allele_id, h.assembly, h.occurrence, h.row_hash,
+					ROW_NUMBER() OVER (PARTITION BY h.variation_id, h.allele_id, h.assembly, h.row_hash ORDER BY h.occurrence) AS hash_rank
+				FROM temp.changed_group g
+				JOIN {0}.variant_hash h ON h.variation_id = g.variation_id AND h.allele_id = g.allele_id AND h.assembly IS g.assembly
+			""".format(schema))
+			cur.execute("CREATE INDEX temp.hash_{0}_hash ON {0}_hash(variation_id, allele_id, assembly, row_hash, hash_rank)".format(schema))
+
+		# Rows without an unchanged counterpart, numbered in occurrence
+		# order within their group
+		for schema, other in (("old", "new"), ("new", "old")):
+			cur.execute("DROP TABLE IF EXISTS temp.{}_left".format(schema))
+			cur.execute("""
+				CREATE TEMP TABLE {0}_left AS
+				SELECT ventry_id, variation_id, allele_id, assembly, occurrence,
+					ROW_NUMBER() OVER (PARTITION BY variation_id, allele_id, assembly ORDER BY occurrence) AS left_rank
+				FROM temp.{0}_hash h
+				WHERE NOT EXISTS (
+					SELECT 1 FROM temp.{1}_hash x
+					WHERE x.variation_id = h.variation_id AND x.allele_id = h.allele_id AND x.assembly IS h.assembly
+					AND x.row_hash = h.row_hash AND x.hash_rank = h.hash_rank
+				)
+			""".format(schema, other))
+			cur.execute("CREATE INDEX temp.group_{0}_left ON {0}_left(variation_id, allele_id, assembly, left_rank)".format(schema))
+
+		# Rows left in both releases are changed, the others added or removed
+		cur.execute("""
+			INSERT INTO temp.release_diff
+			SELECT 'variant', CASE WHEN o.ventry_id IS NULL THEN 'added' ELSE 'changed' END,
+				n.variation_id, n.allele_id, n.assembly, n.occurrence, o.ventry_id, n.ventry_id
+			FROM temp.new_left n
+			LEFT JOIN temp.old_left o ON {} AND o.left_rank = n.left_rank
+		""".format(groupMatch))
+		cur.execute("""
+			INSERT INTO temp.release_diff
+			SELECT 'variant', 'removed', o.variation_id, o.allele_id, o.assembly, o.occurrence, o.ventry_id, NULL
+			FROM temp.old_left o
+			WHERE NOT EXISTS (SELECT 1 FROM temp.new_left n WHERE {} AND n.left_rank = o.left_rank)
+		""".format(groupMatch))
+
+		for table in ("changed_group", "old_hash", "new_hash", "old_left", "new_left"):
+			cur.execute("DROP TABLE temp.{}".format(table))
+
+		counts = status_counts(cur, "variant")
+		cur.execute("SELECT COUNT(*) FROM old.variant_hash")
+		counts["old"] = cur.fetchone()[0]
+		cur.execute("SELECT COUNT(*) FROM new.variant_hash")
+		counts["new"] = cur.fetchone()[0]
+		counts["unchanged"] = counts["new"] - counts["added"] - counts["changed"]
+
+		# The significances of a variant are compared as a sorted list,
+		# only for the changed ones, as the others kept them
+		cur.execute("""
+			SELECT old_sig, new_sig, COUNT(*) AS variants
+			FROM (
+				SELECT
+					(SELECT group_concat(significance, '|') FROM (SELECT significance FROM old.clinical_sig WHERE ventry_id = d.old_id ORDER BY significance)) AS old_sig,
+					(SELECT group_concat(significance, '|') FROM (SELECT significance FROM new.clinical_sig WHERE ventry_id = d.new_id ORDER BY significance)) AS new_sig
+				FROM temp.release_diff d
+				WHERE d.source_table = 'variant' AND d.status = 'changed'
+			)
+			WHERE old_sig IS NOT new_sig
+			GROUP BY old_sig, new_sig
+			ORDER BY variants DESC, old_sig, new_sig
+		""")
+		transitions = cur.fetchall()
+		counts["reclassified"] = sum(row[2] for row in transitions)
+	finally:
+		cur.close()
+
+	return { "variant": (counts, transitions) }
+
+def compare_civic(db):
+	"""
+		Added, removed and changed CIViC variants and evidences, by
+		table, with the counts and the transitions of the column
+		reported as reclassifications
+	"""
+	comparisons = {}
+
+	cur = db.cursor()
+	try:
+		common = schema_names(cur, "old") & schema_names(cur, "new")
+		for view, key_column, reclassified_column in CIVIC_COMPARED_TABLES:
+			if view not in common:
+				continue
+
+			cur.execute("PRAGMA new.table_info({})".format(view))
+			columns = [ row[1]  for row in cur ]
+			sameRow = " AND ".join("o.{0} IS n.{0}".format(column) for column in columns)
+
+			cur.execute("""
+				INSERT INTO temp.release_diff(source_table, status, old_id, new_id)
+				SELECT ?, CASE WHEN o.{1} IS NULL THEN 'added' ELSE 'changed' END, o.{1}, n.{1}
+				FROM new.{0} n
+				LEFT JOIN old.{0} o ON o.{1} = n.{1}
+				WHERE NOT ({2})
+			""".format(view, key_column, sameRow), (view,))
+			cur.execute("""
+				INSERT INTO temp.release_diff(source_table, status, old_id)
+				SELECT ?, 'removed', o.{1}
+				FROM old.{0} o
+				WHERE NOT EXISTS (SELECT 1 FROM new.{0} n WHERE n.{1} = o.{1})
+			""".format(view, key_column), (view,))
+
+			counts = status_counts(cur, view)
+			cur.execute("SELECT COUNT(*) FROM old.{}".format(view))
+			counts["old"] = cur.fetchone()[0]
+			cur.execute("SELECT COUNT(*) FROM new.{}".format(view))
+			counts["new"] = cur.fetchone()[0]
+			counts["unchanged"] = counts["new"] - counts["added"] - counts["changed"]
+
+			transitions = []
+			if reclassified_column is not None:
+				cur.execute("""
+					SELECT o.{1}, n.{1}, COUNT(*) AS rows
+					FROM temp.release_diff d
+					JOIN old.{0} o ON o.{2} = d.old_id
+					JOIN new.{0} n ON n.{2} = d.new_id
+					WHERE d.source_table = ? AND d.status = 'changed'
+					AND o.{1} IS NOT n.{1}
+					GROUP BY o.{1}, n.{1}
+					ORDER BY rows DESC, o.{1}, n.{1}
+				""".format(view, reclassified_column, key_column), (view,))
+				transitions = cur.fetchall()
+			counts["reclassified"] = sum(row[2] for row in transitions)
+
+			comparisons[view] = (counts, transitions)
+	finally:
+		cur.close()
+
+	return comparisons
+
+def compare_releases(db):
+	"""
+		Compares the attached releases, as ClinVar ones when both have
+		the variant_hash table, and as CIViC ones otherwise
+	"""
+	cur = db.cursor()
+	try:
+		clinvar = all("variant_hash" in schema_names(cur, schema) for schema in ("old", "new"))
+	finally:
+		cur.close()
+
+	return compare_clinvar(db) if clinvar else compare_civic(db)
+
+def write_release_diff(db, diff_file):
+	"""
+		Writes the rows of temp.release_diff as a tab separated file
+	"""
+	cur = db.cursor()
+	try:
+		cur.execute("SELECT * FROM temp.release_diff ORDER BY source_table, status, old_id, new_id")
+		with open(diff_file, "w", encoding="utf-8") as diffF:
+			print("\t".join(description[0] for description in cur.description), file=diffF)
+			for row in cur:
+				print(format_row(row), file=diffF)
+	finally:
+		cur.close()
+
+def print_comparison(comparisons, file=sys.stdout):
+	for table, (counts, transitions) in comparisons.items():
+		print("# {}: {old} old, {new} new: {added} added, {removed} removed, {changed} changed, {unchanged} unchanged, {reclassified} reclassified".format(
+			table, **counts), file=file)
+		for old_value, new_value, rows in transitions[:TOP_RECLASSIFICATIONS]:
+			print("{}\t->\t{}\t{}".format(old_value, new_value, rows), file=file)
+
+def print_query_differences(old_results, new_results, file=sys.stdout):
+	"""
+		Prints, for each query run on both releases, the rows only
+		found in the old one (-) and those only found in the new one (+)
+	"""
+	new_by_name = { name: (result, cached)  for name, description, result, cached in new_results }
+	for name, description, old_result, old_cached in old_results:
+		if name not in new_by_name:
+			continue
+		new_result, new_cached = new_by_name[name]
+
+		old_rows = collections.Counter(tuple(row) for row in old_result["rows"])
+		new_rows = collections.Counter(tuple(row) for row in new_result["rows"])
+		print("# {} ({}): {:.1f} ms old, {:.1f} ms new, {}".format(
+			name, description, old_result["elapsed"] * 1000, new_result["elapsed"] * 1000,
+			"same result" if old_rows == new_rows else "different results"), file=file)
+		if old_rows != new_rows:
+			print("\t" + "\t".join(old_result["columns"]), file=file)
+			for row in sorted((old_rows - new_rows).elements(), key=repr):
+				print("-\t" + format_row(row), file=file)
+			for row in sorted((new_rows - old_rows).elements(), key=repr):
+				print("+\t" + format_row(row), file=file)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Compares two releases loaded by the ClinVar or CIViC loaders")
+	parser.add_argument("old_db_file", metavar="old_database_file", help="database of the older release")
+	parser.add_argument("new_db_file", metavar="new_database_file", help="database of the newer release")
+	parser.add_argument("--diff-file", help="tab separated file listing every added, removed and changed row")
+	parser.add_argument("--query", action="append", default=[], help="canonical query compared, by name or number, can be repeated (default: all)")
+	parser.add_argument("--param", action="append", type=parse_param, default=[], help="name=value replacing a default query parameter, can be repeated")
+	parser.add_argument("--no-queries", action="store_true", help="only compare the rows, without running the canonical queries")
+	parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="directory of the cached query results (default: %(default)s)")
+	parser.add_argument("--no-cache", action="store_true", help="always run the queries, and do not store their results")
+	args = parser.parse_args()
+
+	try:
+		queries = select_queries(args.query)
+	except ValueError as e:
+		parser.error(str(e))
+
+	start = time.perf_counter()
+
+	# The queries of each release run in their own process, while
+	# this one compares the rows
+	pool = None
+	if not args.no_queries:
+		pool = multiprocessing.Pool(2)
+		pending = pool.starmap_async(query_database, [
+			(db_file, queries, dict(args.param), args.cache_dir, not args.no_cache)  for db_file in (args.old_db_file, args.new_db_file)
+		])
+
+	db = attach_releases(args.old_db_file, args.new_db_file)
+	comparisons = compare_releases(db)
+	print_comparison(comparisons)
+	if args.diff_file is not None:
+		write_release_diff(db, args.diff_file)
+	db.close()
+
+	if pool is not None:
+		old_results, new_results = pending.get()
+		pool.close()
+		pool.join()
+		print_query_differences(old_results, new_results)
+
+	print("Compared in {:.1f} s".format(time.perf_counter() - start), file=sys.stderr)
@@ -0,0 +1,149 @@
+# ------------------------------------------------------------------------------
+# sqlite_tuning.py
+# Shared SQLite settings for the ClinVar and CIViC loaders
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+import os
+import re
+
+# PRAGMA profiles. Each one is a list of (pragma, value) pairs, applied
+# in order, so locking_mode always goes before journal_mode
+
+# Bulk load: durability is traded for speed. Commits go to a
+# write-ahead log, which is only fsync'ed when it is copied back into
+# the database, so a crash of the machine may lose the last commits.
+# As the database is never written in place during a commit, a killed
+# load still leaves it intact, at its last checkpoint. The exclusive
+# lock spares the log its shared memory file
+BULK_LOAD_PRAGMAS = [
+	("locking_mode", "EXCLUSIVE"),
+	("journal_mode", "WAL"),
+	("synchronous", "NORMAL"),
+	# Negative values are KiB, so this is a 1 GiB page cache
+	("cache_size", -1048576),
+	("temp_store", "MEMORY"),
+	("mmap_size", 1073741824),
+]
+
+# Safe, read-optimised settings, restored once the load is over
+READ_PRAGMAS = [
+	("locking_mode", "NORMAL"),
+	("journal_mode", "DELETE"),
+	("synchronous", "FULL"),
+	("cache_size", -262144),
+	("temp_store", "DEFAULT"),
+	("mmap_size", 268435456),
+]
+
+# Profiles selectable from the command line of every loader.
+# 'default' keeps the SQLite defaults, as the loaders always did
+LOAD_PROFILES = {
+	"default": [],
+	"bulk": BULK_LOAD_PRAGMAS,
+}
+
+DEFAULT_LOAD_PROFILE = "default"
+
+def apply_pragmas(db, pragmas):
+	"""
+		Applies a list of (pragma, value) pairs to the connection
+	"""
+	cur = db.cursor()
+	try:
+		for pragma, value in pragmas:
+			cur.execute("PRAGMA {} = {}".format(pragma, value))
+			# journal_mode answers with a row, it has to be consumed
+			cur.fetchall()
+	finally:
+		cur.close()
+
+def apply_load_profile(db, profile=DEFAULT_LOAD_PROFILE):
+	"""
+		Applies one of the LOAD_PROFILES before the ingestion starts
+	"""
+	apply_pragmas(db, LOAD_PROFILES[profile])
+
+def restore_read_profile(db):
+	"""
+		Switches the connection back to the safe, read-optimised
+		settings, once all the data has been committed
+	"""
+	apply_pragmas(db, READ_PRAGMAS)
+
+	cur = db.cursor()
+	try:
+		# Going back to locking_mode NORMAL only releases the
+		# exclusive lock on the next access to the database
+		cur.execute("SELECT COUNT(*) FROM sqlite_master").fetchall()
+		# Let SQLite refresh the statistics the planner relies on
+		cur.execute("PRAGMA optimize")
+	finally:
+		cur.close()
+
+# Deferred index build. The loaders create their tables first and
+# their indexes only once the rows are in, so SQLite builds each
+# index in a single sorted pass instead of updating it per insert
+
+# When appending to a populated table, the indexes are dropped and
+# rebuilt only if the load brings at least this fraction of the rows
+# already present. Smaller appends keep the indexes in place
+INDEX_REBUILD_RATIO = 0.25
+
+INDEX_NAME_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+def index_names(index_defs):
+	"""
+		Returns the names of the indexes declared in index_defs
+	"""
+	return [ INDEX_NAME_RE.search(indexDecl).group(1) for indexDecl in index_defs ]
+
+def estimate_incoming_rows(input_file, bytes_per_row):
+	"""
+		Rough number of rows in an input file, from its size on disk
+	"""
+	return os.path.getsize(input_file) // bytes_per_row
+
+def should_rebuild_indexes(db, table, incoming_rows):
+	"""
+		Decides whether the indexes of table are worth dropping
+		before loading incoming_rows more rows into it
+	"""
+	cur = db.cursor()
+	try:
+		cur.execute("SELECT COUNT(*) FROM {}".format(table))
+		existing_rows = cur.fetchone()[0]
+	finally:
+		cur.close()
+	
+	return incoming_rows >= existing_rows * INDEX_REBUILD_RATIO
+
+def drop_indexes(db, index_defs):
+	"""
+		Drops the indexes declared in index_defs, when they exist
+	"""
+	cur = db.cursor()
+	try:
+		for indexName in index_names(index_defs):
+			cur.execute("DROP INDEX IF EXISTS {}".format(indexName))
+	finally:
+		cur.close()
+
+def create_indexes(db, index_defs):
+	"""
+		Creates the indexes declared in index_defs which are missing
+	"""
+	cur = db.cursor()
+	try:
+		for indexDecl in index_defs:
+			cur.execute(indexDecl)
+	finally:
+		cur.close()
@@ -0,0 +1,383 @@
+# ------------------------------------------------------------------------------
+# synthetic_data.py
+# Synthetic ClinVar and CIViC release files, to exercise the loaders at any scale
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# The files follow the headers and conventions of the real releases
+# (null markers, '|' and ';' separated lists, rows of an allele next
+# to each other, one per assembly), with skewed distributions, so a
+# few genes and phenotypes hold most of the variants as they do in
+# ClinVar. The same seed always gives the same files
+
+import sys
+import os
+import argparse
+import gzip
+import random
+
+from chromosome_lengths import CHROMOSOME_LENGTHS
+
+VARIANT_SUMMARY_HEADER = [
+	"AlleleID", "Type", "Name", "GeneID", "GeneSymbol", "HGNC_ID", "ClinicalSignificance",
+	"ClinSigSimple", "LastEvaluated", "RS# (dbSNP)", "nsv/esv (dbVar)", "RCVaccession",
+	"PhenotypeIDS", "PhenotypeList", "Origin", "OriginSimple", "Assembly", "ChromosomeAccession",
+	"Chromosome", "Start", "Stop", "ReferenceAllele", "AlternateAllele", "Cytogenetic",
+	"ReviewStatus", "NumberSubmitters", "Guidelines", "TestedInGTR", "OtherIDs",
+	"SubmitterCategories", "VariationID", "PositionVCF", "ReferenceAlleleVCF", "AlternateAlleleVCF",
+]
+
+VAR_CITATIONS_HEADER = ["AlleleID", "VariationID", "rs", "nsv", "citation_source", "citation_id"]
+
+GENE_SPECIFIC_SUMMARY_TITLE = "Overview of interpretation, clinical significance, and review status by gene"
+
+GENE_SPECIFIC_SUMMARY_HEADER = [
+	"Symbol", "GeneID", "Total_submissions", "Total_alleles", "Submissions_reporting_this_gene",
+	"Alleles_reported_Pathogenic_Likely_pathogenic", "Gene_MIM_number", "Number_uncertain",
+	"Number_with_conflicts",
+]
+
+CIVIC_VARIANT_HEADER = [
+	"variant_id", "variant_civic_url", "gene", "entrez_id", "variant", "summary", "variant_groups",
+	"chromosome", "start", "stop", "reference_bases", "variant_bases", "representative_transcript",
+	"ensembl_version", "reference_build", "chromosome2", "start2", "stop2",
+	"representative_transcript2", "variant_types", "hgvs_expressions", "last_review_date",
+	"civic_variant_evidence_score", "allele_registry_id", "clinvar_ids", "variant_aliases",
+	"assertion_ids", "assertion_civic_urls", "is_flagged",
+]
+
+CIVIC_EVIDENCE_HEADER = [
+	"gene", "entrez_id", "variant", "disease", "doid", "phenotypes", "drugs", "drug_interaction_type",
+	"evidence_type", "evidence_direction", "evidence_level", "clinical_significance",
+	"evidence_statement", "citation_id", "source_type", "asco_abstract_id", "citation", "nct_ids",
+	"rating", "evidence_status", "evidence_id", "variant_id", "assertion_ids", "evidence_civic_url",
+	"variant_civic_url", "gene_civic_url",
+]
+
+# File names of the releases, as the loaders are usually given them
+RELEASE_FILES = {
+	"variant_summary": "variant_summary.txt.gz",
+	"var_citations": "var_citations.txt",
+	"gene_specific_summary": "gene_specific_summary.txt.gz",
+	"civic_variants": "VariantSummaries.tsv",
+	"civic_evidence": "ClinicalEvidenceSummaries.tsv",
+}
+
+# GRCh38 chromosome sizes, which weight where the variants fall
+CHROMOSOME_SIZES = CHROMOSOME_LENGTHS["GRCh38"]
+
+CHROMOSOME_ACCESSIONS = { chro: "NC_{:06d}".format(i + 1)  for i, (chro, size) in enumerate(CHROMOSOME_SIZES) }
+
+# Genes which lead the real releases, before the made up ones
+KNOWN_GENES = [
+	("BRCA2", 675, "HGNC:1101"), ("BRCA1", 672, "HGNC:1100"), ("TTN", 7273, "HGNC:12403"),
+	("ATM", 472, "HGNC:795"), ("APC", 324, "HGNC:583"), ("NF1", 4763, "HGNC:7765"),
+	("TP53", 7157, "HGNC:11998"), ("MSH6", 2956, "HGNC:7329"), ("PALB2", 79728, "HGNC:26144"),
+	("HBB", 3043, "HGNC:4827"), ("CFTR", 1080, "HGNC:1884"), ("MLH1", 4292, "HGNC:7127"),
+]
+
+KNOWN_PHENOTYPES = [
+	"not provided", "not specified", "Hereditary cancer-predisposing syndrome",
+	"Breast-ovarian cancer, familial 2", "Hereditary breast ovarian cancer syndrome",
+	"Glioblastoma", "Cystic fibrosis", "beta Thalassemia", "Li-Fraumeni syndrome",
+	"Acute infantile liver failure due to synthesis defect of mtDNA-encoded proteins",
+]
+
+# (value, weight) pairs of the categorical columns
+VARIANT_TYPES = [
+	("single nucleotide variant", 80), ("Deletion", 8), ("Duplication", 4), ("copy number loss", 2),
+	("copy number gain", 2), ("Insertion", 1.5), ("Indel", 1.5), ("Microsatellite", 1),
+]
+
+SIGNIFICANCES = [
+	("Uncertain significance", 40), ("Likely benign", 22), ("Benign", 10), ("Pathogenic", 9),
+	("Likely pathogenic", 4), ("Conflicting interpretations of pathogenicity", 6),
+	("Benign/Likely benign", 5), ("Pathogenic/Likely pathogenic", 2), ("not provided", 2),
+]
+
+REVIEW_STATUSES = [
+	("criteria provided, single submitter", 70), ("criteria provided, multiple submitters, no conflicts", 12),
+	("criteria provided, conflicting interpretations", 6), ("no assertion criteria provided", 9),
+	("reviewed by expert panel", 2), ("no assertion provided", 1),
+]
+
+# Assemblies of the rows of an allele
+ALLELE_ASSEMBLIES = [
+	(("GRCh37", "GRCh38"), 90), (("GRCh38",), 5), (("GRCh37",), 3), (("na",), 2),
+]
+
+CITATION_SOURCES = [("PubMed", 85), ("PubMedCentral", 10), ("NCBIBookShelf", 5)]
+
+CIVIC_GENES = [
+	("EGFR", 1956), ("BRAF", 673), ("KRAS", 3845), ("ERBB2", 2064), ("TP53", 7157),
+	("ALK", 238), ("PIK3CA", 5290), ("KIT", 3815), ("ABL1", 25), ("BRCA1", 672),
+]
+
+CIVIC_VARIANT_TYPES = [
+	("missense_variant", 60), ("frameshift_truncation", 8), ("inframe_deletion", 6),
+	("transcript_fusion", 5), ("stop_gained", 6), ("gain_of_function_variant", 10), ("", 5),
+]
+
+CIVIC_DISEASES = [
+	("Breast Cancer", 3), ("Lung Non-small Cell Carcinoma", 5), ("Melanoma", 3), ("Glioblastoma", 2),
+	("Colorectal Cancer", 3), ("Chronic Myeloid Leukemia", 2), ("Hereditary Breast Ovarian Cancer", 1),
+]
+
+CIVIC_SIGNIFICANCES = [
+	("Sensitivity/Response", 45), ("Resistance", 20), ("Poor Outcome", 10), ("Better Outcome", 5),
+	("Positive", 10), ("Pathogenic", 5), ("Reduced Sensitivity", 5),
+]
+
+CIVIC_DRUGS = ["Erlotinib", "Gefitinib", "Vemurafenib", "Trastuzumab", "Lapatinib", "Imatinib", "Crizotinib", ""]
+
+BASES = "ACGT"
+
+class WeightedChoice(object):
+	"""
+		Draws values from (value, weight) pairs
+	"""
+	def __init__(self, rng, pairs):
+		self.rng = rng
+		self.values = [ value  for value, weight in pairs ]
+		self.weights = [ weight  for value, weight in pairs ]
+
+	def __call__(self):
+		return self.rng.choices(self.values, self.weights)[0]
+
+def zipf_weights(count, exponent=1.1):
+	return [ 1.0 / (rank ** exponent)  for rank in range(1, count + 1) ]
+
+def make_genes(count):
+	"""
+		(symbol, GeneID, HGNC_ID) of the genes of a release: the known
+		ones first, followed by made up ones
+	"""
+	genes = list(KNOWN_GENES[:count])
+	for i in range(len(genes), count):
+		genes.append(("GENE{}".format(i), 100000 + i, "HGNC:{}".format(50000 + i)))
+
+	return genes
+
+def make_phenotypes(count):
+	"""
+		(MedGen id, name) of the phenotypes of a release
+	"""
+	phenotypes = [ ("MedGen:C{:07d}".format(i), name)  for i, name in enumerate(KNOWN_PHENOTYPES[:count]) ]
+	for i in range(len(phenotypes), count):
+		phenotypes.append(("MedGen:C{:07d}".format(i), "Inherited disorder type {}".format(i)))
+
+	return phenotypes
+
+def vcf_alleles(rng, variant_type):
+	"""
+		Reference and alternate alleles of a variant of a type, or
+		'na' for those without a VCF representation
+	"""
+	first = rng.choice(BASES)
+	if variant_type == "single nucleotide variant":
+		return first, rng.choice([ base  for base in BASES  if base != first ])
+	if variant_type == "Deletion":
+		return first + "".join(rng.choice(BASES) for _ in range(rng.randint(1, 12))), first
+	if variant_type in ("Insertion", "Duplication"):
+		return first, first + "".join(rng.choice(BASES) for _ in range(rng.randint(1, 12)))
+	if variant_type == "Indel":
+		return first + rng.choice(BASES), rng.choice(BASES) + rng.choice(BASES) + rng.choice(BASES)
+
+	return "na", "na"
+
+def write_variant_summary(path, alleles, genes, phenotypes, rng):
+	"""
+		variant_summary.txt.gz with the rows of the given number of
+		alleles. Returns the (AlleleID, VariationID) pairs written
+	"""
+	geneWeights = zipf_weights(len(genes))
+	phenotypeWeights = zipf_weights(len(phenotypes))
+	chroWeights = [ size  for chro, size in CHROMOSOME_SIZES ]
+	variantType = WeightedChoice(rng, VARIANT_TYPES)
+	significance = WeightedChoice(rng, SIGNIFICANCES)
+	reviewStatus = WeightedChoice(rng, REVIEW_STATUSES)
+	assemblies = WeightedChoice(rng, ALLELE_ASSEMBLIES)
+
+	written = []
+	with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as out:
+		out.write("#" + "\t".join(VARIANT_SUMMARY_HEADER) + "\n")
+		for i in range(alleles):
+			allele_id = 15000 + i
+			# A few variations group several alleles, like haplotypes
+			variation_id = allele_id - 6000 if rng.random() > 0.02 or i == 0 else written[-1][1]
+			written.append((allele_id, variation_id))
+
+			symbol, gene_id, hgnc_id = rng.choices(genes, geneWeights)[0]
+			if rng.random() < 0.03:
+				# Variants spanning several genes have no single GeneID
+				other = rng.choice(genes)[0]
+				symbol, gene_id, hgnc_id = "{};{}".format(symbol, other), -1, "-"
+
+			vtype = variantType()
+			ref, alt = vcf_alleles(rng, vtype)
+			chro, size = rng.choices(CHROMOSOME_SIZES, chroWeights)[0]
+			start = rng.randint(1, size - 1000)
+			length = len(ref) - 1 if ref != "na" else rng.randint(1000, 200000)
+
+			if rng.random() < 0.005:
+				phenotypeIds = phenotypeList = "{} conditions".format(rng.randint(10, 40))
+			else:
+				chosen = rng.choices(phenotypes, phenotypeWeights, k=rng.choice([1, 1, 1, 2, 3]))
+				phenotypeIds = "|".join(medgen for medgen, name in chosen)
+				phenotypeList = "|".join(name for medgen, name in chosen)
+
+			sig = significance()
+			status = reviewStatus()
+			rs = rng.randint(1, 10 ** 9) if rng.random() < 0.6 else -1
+			name = "NM_{:06d}.{}({}):c.{}{}>{}".format(gene_id if gene_id > 0 else 0, rng.randint(1, 9), symbol, rng.randint(1, 9000), ref[:1], alt[:1])
+			cytogenetic = "{}{}{}".format(chro, rng.choice("pq"), rng.randint(11, 36))
+
+			for assembly in assemblies():
+				offset = 0 if assembly != "GRCh38" else rng.randint(-50000, 50000)
+				position = max(1, start + offset)
+				row = [
+					str(allele_id), vtype, name, str(gene_id), symbol, hgnc_id, sig,
+					"1" if "athogenic" in sig else "0", "Jun 01, 2022", str(rs), "-",
+					"RCV{:09d}".format(allele_id), phenotypeIds, phenotypeList, "germline", "germline",
+					assembly, "{}.11".format(CHROMOSOME_ACCESSIONS[chro]) if assembly != "na" else "na",
+					chro, str(position), str(position + length), "na", "na", cytogenetic,
+					status, str(rng.randint(1, 5)), "-", "N", "-", str(rng.randint(1, 3)),
+					str(variation_id), str(position) if ref != "na" else "-1", ref, alt,
+				]
+				out.write("\t".join(row) + "\n")
+
+	return written
+
+def write_var_citations(path, alleles_written, rng):
+	"""
+		var_citations.txt, citing about a third of the alleles
+	"""
+	source = WeightedChoice(rng, CITATION_SOURCES)
+	with open(path, "w", encoding="utf-8") as out:
+		out.write("#" + "\t".join(VAR_CITATIONS_HEADER) + "\n")
+		for allele_id, variation_id in alleles_written:
+			if rng.random() > 0.3:
+				continue
+			for _ in range(rng.choice([1, 1, 2, 3, 5])):
+				out.write("\t".join([str(allele_id), str(variation_id), "-", "-", source(), str(rng.randint(1000000, 36000000))]) + "\n")
+
+def write_gene_specific_summary(path, genes, rng):
+	"""
+		gene_specific_summary.txt.gz, with a row per gene
+	"""
+	weights = zipf_weights(len(genes))
+	with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as out:
+		out.write(GENE_SPECIFIC_SUMMARY_TITLE + "\n")
+		out.write("#" + "\t".join(GENE_SPECIFIC_SUMMARY_HEADER) + "\n")
+		for (symbol, gene_id, hgnc_id), weight in zip(genes, weights):
+			alleles = max(1, int(weight * 20000 * rng.uniform(0.5, 1.5)))
+			submissions = alleles + rng.randint(0, alleles)
+			mim = str(600000 + gene_id % 100000) if rng.random() < 0.4 else "-"
+			row = [
+				symbol, str(gene_id), str(submissions), str(alleles), str(rng.randint(0, 10)),
+				str(rng.randint(0, alleles // 5)), mim, str(rng.randint(0, alleles // 2)), str(rng.randint(0, alleles // 20)),
+			]
+			out.write("\t".join(row) + "\n")
+
+def write_civic_variants(path, variants, rng):
+	"""
+		CIViC VariantSummaries.tsv with the given number of variants
+	"""
+	variantType = WeightedChoice(rng, CIVIC_VARIANT_TYPES)
+	summaries = ["", "", "Short description of the variant."] + [
+		"Variant {} of the kinase domain, reported in several tumour types and associated with response to targeted therapy.".format(i)  for i in range(20)
+	]
+
+	with open(path, "w", encoding="utf-8") as out:
+		out.write("\t".join(CIVIC_VARIANT_HEADER) + "\n")
+		for variant_id in range(1, variants + 1):
+			gene, entrez_id = rng.choice(CIVIC_GENES)
+			vtype = variantType()
+			chro, size = rng.choice(CHROMOSOME_SIZES[:24])
+			start = rng.randint(1, size - 1000)
+			fusion = vtype == "transcript_fusion"
+			ref, alt = vcf_alleles(rng, "single nucleotide variant") if vtype == "missense_variant" else ("", "")
+			if vtype == "inframe_deletion":
+				ref, alt = vcf_alleles(rng, "Deletion")[0], ""
+			row = [
+				str(variant_id), "https://civicdb.org/links/variants/{}".format(variant_id), gene, str(entrez_id),
+				"V{}{}".format(variant_id, alt or "X"), rng.choice(summaries), "",
+				chro, str(start), str(start + max(0, len(ref) - 1)), ref, alt, "ENST{:011d}.1".format(entrez_id),
+				str(rng.choice([75, 75, 104])), rng.choice(["GRCh37", "GRCh37", "GRCh37", "GRCh38", ""]),
+				rng.choice(CHROMOSOME_SIZES[:24])[0] if fusion else "", str(start + 5000) if fusion else "",
+				str(start + 9000) if fusion else "", "ENST00000318560.5" if fusion else "",
+				vtype, "NM_{:06d}.3:c.{}G>A,NP_{:06d}.1:p.V{}E".format(entrez_id, variant_id, entrez_id, variant_id) if rng.random() < 0.6 else "",
+				"2022-06-01 00:00:00 UTC", "{:.3f}".format(rng.uniform(0, 300)), "CA{}".format(variant_id) if rng.random() < 0.5 else "",
+				str(rng.randint(10000, 900000)) if rng.random() < 0.4 else "", "", "", "", "false",
+			]
+			out.write("\t".join(row) + "\n")
+
+def write_civic_evidence(path, evidences, variants, rng):
+	"""
+		CIViC ClinicalEvidenceSummaries.tsv, with evidences of the
+		variants written by write_civic_variants
+	"""
+	disease = WeightedChoice(rng, CIVIC_DISEASES)
+	significance = WeightedChoice(rng, CIVIC_SIGNIFICANCES)
+	statements = [
+		"In a study of {} patients, the mutation conferred {} to {}.".format(n, effect, drug)
+		for n in (12, 40, 150) for effect in ("sensitivity", "resistance") for drug in CIVIC_DRUGS[:-1]
+	]
+
+	with open(path, "w", encoding="utf-8") as out:
+		out.write("\t".join(CIVIC_EVIDENCE_HEADER) + "\n")
+		for evidence_id in range(1, evidences + 1):
+			gene, entrez_id = rng.choice(CIVIC_GENES)
+			variant_id = rng.randint(1, variants)
+			drugs = rng.choice(CIVIC_DRUGS)
+			row = [
+				gene, str(entrez_id), "V{}".format(variant_id), disease(), str(rng.randint(1000, 9000)), "",
+				drugs, "Combination" if drugs and rng.random() < 0.1 else "",
+				rng.choice(["Predictive", "Prognostic", "Diagnostic", "Predisposing"]), rng.choice(["Supports", "Does Not Support"]),
+				rng.choice("ABCDE"), significance(), rng.choice(statements), str(rng.randint(1000000, 36000000)), "PubMed",
+				"", "Author et al., {}, J Clin Oncol".format(rng.randint(2000, 2022)), "NCT0{}".format(rng.randint(1000000, 9999999)) if rng.random() < 0.1 else "",
+				str(rng.randint(1, 5)), "accepted", str(evidence_id), str(variant_id), "",
+				"https://civicdb.org/links/evidence/{}".format(evidence_id), "https://civicdb.org/links/variants/{}".format(variant_id),
+				"https://civicdb.org/links/genes/{}".format(entrez_id),
+			]
+			out.write("\t".join(row) + "\n")
+
+def generate_release(out_dir, alleles, civic_variants, seed=1):
+	"""
+		Writes the five release files into out_dir, sized after the
+		number of ClinVar alleles and of CIViC variants. Returns their
+		paths, by kind of file
+	"""
+	rng = random.Random(seed)
+	os.makedirs(out_dir, exist_ok=True)
+	paths = { kind: os.path.join(out_dir, name)  for kind, name in RELEASE_FILES.items() }
+
+	genes = make_genes(max(len(KNOWN_GENES), alleles // 50))
+	phenotypes = make_phenotypes(max(len(KNOWN_PHENOTYPES), alleles // 20))
+
+	alleles_written = write_variant_summary(paths["variant_summary"], alleles, genes, phenotypes, rng)
+	write_var_citations(paths["var_citations"], alleles_written, rng)
+	write_gene_specific_summary(paths["gene_specific_summary"], genes, rng)
+	write_civic_variants(paths["civic_variants"], civic_variants, rng)
+	write_civic_evidence(paths["civic_evidence"], civic_variants * 3, civic_variants, rng)
+
+	return paths
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Writes synthetic ClinVar and CIViC release files")
+	parser.add_argument("out_dir", metavar="output_directory", help="directory where the files are written")
+	parser.add_argument("--alleles", type=int, default=100000, help="ClinVar alleles, each one in one or two rows of variant_summary (default: %(default)s)")
+	parser.add_argument("--civic-variants", type=int, default=3000, help="CIViC variants, with three evidences each (default: %(default)s)")
+	parser.add_argument("--seed", type=int, default=1, help="random seed (default: %(default)s)")
+	args = parser.parse_args()
+
+	for kind, path in generate_release(args.out_dir, args.alleles, args.civic_variants, seed=args.seed).items():
+		print("{}\t{}".format(kind, path), file=sys.stderr)
@@ -0,0 +1,155 @@
+# ------------------------------------------------------------------------------
+# text_store.py
+# Content-addressed storage of the long, repeated text fields of the loaders
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Long text fields repeat a lot: a ClinVar phenotype list appears on
+# the GRCh37 and GRCh38 rows of a variant, and on many variants of the
+# same gene. Each distinct text is stored once in text_store, found by
+# the hash of its content, and the tables keep its text_id. The views
+# over those tables join the text back. A short text costs less inline
+# than its hash, index entry and row in the store, so the tables which
+# have an inline column next to the text_id keep those there
+
+import sys
+import collections
+import hashlib
+
+TEXT_STORE_DEFS = [
+"""
+CREATE TABLE IF NOT EXISTS text_store (
+	text_id INTEGER PRIMARY KEY,
+	text_hash BLOB NOT NULL UNIQUE,
+	content TEXT NOT NULL
+)
+"""
+]
+
+# Distinct texts remembered by the loader. Repeated texts tend to be
+# close in the files, so a bounded cache catches most of them
+TEXT_CACHE_SIZE = 16384
+
+# Approximate cost of a stored text besides its content: its hash,
+# twice as it is indexed, and the row ids
+TEXT_OVERHEAD_BYTES = 48
+
+# Texts up to this size, in bytes, are kept inline where they can be
+TEXT_INLINE_MAX_BYTES = TEXT_OVERHEAD_BYTES
+
+def text_hash(encoded):
+	return hashlib.blake2b(encoded, digest_size=16).digest()
+
+def create_text_store(db):
+	cur = db.cursor()
+	try:
+		for tableDecl in TEXT_STORE_DEFS:
+			cur.execute(tableDecl)
+	finally:
+		cur.close()
+
+class TextStore(object):
+	"""
+		Hands out the text_id of a text, storing the text the first
+		time it is seen. The most recently used texts are kept in an
+		LRU cache, so most repetitions skip the hash and the lookup
+	"""
+	def __init__(self, db, cache_size=TEXT_CACHE_SIZE):
+		self.cur = db.cursor()
+		self.cache = collections.OrderedDict()
+		self.cache_size = cache_size
+
+		# Figures for the report
+		self.references = 0
+		self.referenced_bytes = 0
+		self.stored = 0
+		self.stored_bytes = 0
+		self.cache_hits = 0
+		self.inlined = 0
+
+	def reference(self, text):
+		"""
+			(inline text, text_id) pair of a text, where only one of
+			them is set: short texts stay inline, the rest are stored
+		"""
+		if text is None:
+			return None, None
+		# A character takes at least a byte, so most long texts are
+		# told apart without encoding them
+		if len(text) <= TEXT_INLINE_MAX_BYTES and len(text.encode("utf-8")) <= TEXT_INLINE_MAX_BYTES:
+			self.inlined += 1
+			return text, None
+
+		return None, self.text_id(text)
+
+	def text_id(self, text):
+		if text is None:
+			return None
+
+		entry = self.cache.get(text)
+		if entry is not None:
+			self.cache.move_to_end(text)
+			self.cache_hits += 1
+		else:
+			encoded = text.encode("utf-8")
+			digest = text_hash(encoded)
+			self.cur.execute("SELECT text_id FROM text_store WHERE text_hash = ?", (digest,))
+			found = self.cur.fetchone()
+			if found is not None:
+				entry = (found[0], len(encoded))
+			else:
+				self.cur.execute("INSERT INTO text_store(text_hash, content) VALUES(?,?)", (digest, text))
+				entry = (self.cur.lastrowid, len(encoded))
+				self.stored += 1
+				self.stored_bytes += len(encoded)
+
+			self.cache[text] = entry
+			if len(self.cache) > self.cache_size:
+				self.cache.popitem(last=False)
+
+		text_id, size = entry
+		self.references += 1
+		self.referenced_bytes += size
+
+		return text_id
+
+def purge_unreferenced_texts(db, references):
+	"""
+		Removes the texts no longer used by any of the (table,
+		column) references, like those of retired variants.
+		Returns how many were removed
+	"""
+	# A NULL among the used ids would make NOT IN match no text at all
+	used = " UNION ".join("SELECT {0} FROM {1} WHERE {0} IS NOT NULL".format(column, table) for table, column in references)
+
+	cur = db.cursor()
+	try:
+		cur.execute("DELETE FROM text_store WHERE text_id NOT IN ({})".format(used))
+		return cur.rowcount
+	finally:
+		cur.close()
+
+def saved_bytes(referenced_bytes, stored_bytes, stored_texts):
+	"""
+		Bytes the store saves, against keeping inline the texts
+		referenced through it, once its own overhead is paid
+	"""
+	return referenced_bytes - stored_bytes - stored_texts * TEXT_OVERHEAD_BYTES
+
+def print_text_store_report(store, file=sys.stderr):
+	"""
+		Prints how many bytes of text the deduplication saved in a load
+	"""
+	saved = saved_bytes(store.referenced_bytes, store.stored_bytes, store.stored)
+	print("Text store: {} values, {} kept inline, {} new distinct texts, {:.1f} MB referenced, {:.1f} MB stored, {:.1f} MB saved, LRU hit rate {:.1%}".format(
+		store.references + store.inlined, store.inlined, store.stored,
+		store.referenced_bytes / 1e6, store.stored_bytes / 1e6, saved / 1e6,
+		store.cache_hits / store.references if store.references > 0 else 0), file=file)
@@ -0,0 +1,93 @@
+# ------------------------------------------------------------------------------
+# tsv_reader.py
+# Shared tab separated row decoder for the ClinVar and CIViC loaders
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# Every loader declares the columns it needs as a list of
+# (column name, converter) pairs. The header is compiled once into
+# a function which splits a line, picks those columns in the declared
+# order, turns the null markers into None and converts the values
+
+import itertools
+
+# Column converters. They are plain strings, so column declarations
+# can be sent to worker processes
+TEXT = "text"
+INT = "int"
+NULLABLE_INT = "nullable_int"
+FLOAT = "float"
+
+# Null markers used by each source
+CLINVAR_NULLS = frozenset(["", "-"])
+CIVIC_NULLS = frozenset(["", "N/A"])
+
+# Expression template used for each kind of column. {0} is the value
+# taken from the split line. INT columns are mandatory, so a missing
+# value makes int() fail, as the loaders always did
+CONVERTER_TEMPLATES = {
+	TEXT: "(None if {0} in nulls else {0})",
+	INT: "int({0})",
+	NULLABLE_INT: "(None if {0} in nulls else int({0}))",
+	FLOAT: "(None if {0} in nulls else float({0}))",
+}
+
+def header_columns(header_line, prefix="#"):
+	"""
+		Returns the column names of a header line, without the
+		leading comment marker
+	"""
+	return header_line.rstrip("\n").lstrip(prefix).split("\t")
+
+def column_index(headerMapping, name):
+	"""
+		Position of a column in the header. name can also be a tuple
+		of alternative names, and the first one present is used
+	"""
+	names = name if isinstance(name, tuple) else (name,)
+	for alternative in names:
+		if alternative in headerMapping:
+			return headerMapping[alternative]
+
+	raise KeyError("Column {} not found in header".format(" / ".join(names)))
+
+def compile_row_decoder(columnNames, columns, nulls):
+	"""
+		Compiles a function which turns a data line into a tuple
+		with the declared columns, already converted
+	"""
+	headerMapping = {}
+	for columnId, columnName in enumerate(columnNames):
+		headerMapping[columnName] = columnId
+
+	# The projection is written out as a single tuple expression, so
+	# decoding a row is one split plus one expression evaluation
+	fields = []
+	for name, converter in columns:
+		value = "v[{}]".format(column_index(headerMapping, name))
+		fields.append(CONVERTER_TEMPLATES[converter].format(value))
+
+	source = "def decode_row(line):\n\tv = line.rstrip('\\n').split('\\t')\n\treturn ({},)\n".format(", ".join(fields))
+	namespace = {"nulls": nulls}
+	exec(source, namespace)
+
+	return namespace["decode_row"]
+
+def read_tsv_rows(lines, columns, nulls, prefix="#", skip=0):
+	"""
+		Generator of decoded rows. The first line must be the header.
+		The skip data lines after it are not even decoded
+	"""
+	decode_row = compile_row_decoder(header_columns(next(lines), prefix), columns, nulls)
+	if skip > 0:
+		next(itertools.islice(lines, skip, skip), None)
+	for line in lines:
+		yield decode_row(line)
@@ -0,0 +1,141 @@
+# ------------------------------------------------------------------------------
+# variant_density.py
+# Variants per Mb of every chromosome, and binned histograms, from the columnar snapshots
+# Copyright © 2019–2023 Eduardo Andrés & José Mª Fernández
+# All rights reserved.
+#
+# This script is licensed under the terms of the Creative Commons Attribution license.
+# For a copy, see https://creativecommons.org/licenses/by/4.0/
+#
+# ------------------------------------------------------------------------------
+
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+# The bins of all the chromosomes of both assemblies are numbered one
+# after the other, so each variant of a snapshot (column_snapshot.py)
+# gets a single bin number, the first bin of its chromosome plus its
+# start divided by the bin size, and one np.bincount counts every bin
+# in a single pass over the arrays. The variants of a chromosome are
+# the sum of its bins. Variants on a chromosome without a known length,
+# or past its end, are counted apart as unplaced. Both tables come out
+# in long form, one row per source, assembly, chromosome and bin, so
+# they can be charted as they are
+
+import sys
+import os
+import argparse
+import time
+
+import numpy as np
+
+from chromosome_lengths import CHROMOSOME_LENGTHS
+from column_snapshot import VariantSnapshot
+
+DEFAULT_BIN_SIZE = 1000000
+
+def bin_layout(bin_size):
+	"""
+		Bins of every chromosome, as (assembly, chromosome, length,
+		first bin, bins) tuples in karyotype order, and the number
+		of bins of all of them
+	"""
+	layout = []
+	total_bins = 0
+	for assembly, lengths in CHROMOSOME_LENGTHS.items():
+		for chro, length in lengths:
+			bins = (length + bin_size - 1) // bin_size
+			layout.append((assembly, chro, length, total_bins, bins))
+			total_bins += bins
+	return layout, total_bins
+
+def count_bins(snapshot, layout, total_bins, bin_size):
+	"""
+		Variants of a snapshot in every bin of the layout, and the
+		number of those which could not be placed
+	"""
+	assemblies = snapshot.dictionaries["assembly"]
+	chromosomes = snapshot.dictionaries["chro"]
+
+	# First bin and length of each (assembly code, chromosome code)
+	# pair, shifted by one so the NULL code -1 lands on row 0
+	first_bins = np.full((len(assemblies) + 1, len(chromosomes) + 1), -1, dtype=np.int64)
+	lengths = np.zeros(first_bins.shape, dtype=np.int64)
+	assembly_codes = { assembly: code  for code, assembly in enumerate(assemblies) }
+	chro_codes = { chro: code  for code, chro in enumerate(chromosomes) }
+	for assembly, chro, length, first_bin, bins in layout:
+		if assembly in assembly_codes and chro in chro_codes:
+			first_bins[assembly_codes[assembly] + 1, chro_codes[chro] + 1] = first_bin
+			lengths[assembly_codes[assembly] + 1, chro_codes[chro] + 1] = length
+
+	assembly = np.asarray(snapshot.column("assembly"), dtype=np.int64) + 1
+	chro = np.asarray(snapshot.column("chro"), dtype=np.int64) + 1
+	start = np.asarray(snapshot.column("start"))
+
+	first_bin = first_bins[assembly, chro]
+	# Positions are 1-based, and the starts of unknown loci are -1
+	placed = (first_bin >= 0) & (start >= 1) & (start <= lengths[assembly, chro])
+	counts = np.bincount(first_bin[placed] + (start[placed] - 1) // bin_size, minlength=total_bins)
+
+	return counts, snapshot.rows - int(np.count_nonzero(placed))
+
+def density_tables(snapshots, bin_size=DEFAULT_BIN_SIZE):
+	"""
+		Per chromosome and per bin tables of the variants of the
+		snapshots, as lists of tuples, and the unplaced variants of
+		each snapshot. snapshots are (label, VariantSnapshot) pairs
+	"""
+	layout, total_bins = bin_layout(bin_size)
+	chromosome_rows = []
+	bin_rows = []
+	unplaced = {}
+	for label, snapshot in snapshots:
+		counts, unplaced[label] = count_bins(snapshot, layout, total_bins, bin_size)
+		for assembly, chro, length, first_bin, bins in layout:
+			chroCounts = counts[first_bin:first_bin + bins]
+			variants = int(chroCounts.sum())
+			if variants == 0:
+				continue
+			chromosome_rows.append((label, snapshot.source, assembly, chro, length, variants, variants / length * 1e6))
+
+			bin_starts = np.arange(bins, dtype=np.int64) * bin_size + 1
+			bin_ends = np.minimum(bin_starts + bin_size - 1, length)
+			per_mb = chroCounts / (bin_ends - bin_starts + 1) * 1e6
+			bin_rows.extend(zip(
+				[label] * bins, [snapshot.source] * bins, [assembly] * bins, [chro] * bins,
+				bin_starts.tolist(), bin_ends.tolist(), chroCounts.tolist(), per_mb.tolist()))
+
+	return chromosome_rows, bin_rows, unplaced
+
+CHROMOSOME_HEADER = ["snapshot", "source", "assembly", "chro", "length", "variants", "variants_per_mb"]
+
+BIN_HEADER = ["snapshot", "source", "assembly", "chro", "bin_start", "bin_end", "variants", "variants_per_mb"]
+
+def write_table(header, rows, outF):
+	print("\t".join(header), file=outF)
+	for row in rows:
+		print("\t".join("{:.6g}".format(value) if isinstance(value, float) else str(value)  for value in row), file=outF)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Computes the variants per Mb of every chromosome, and their histograms, from columnar snapshots")
+	parser.add_argument("snapshot_dir", nargs="+", help="snapshot written by column_snapshot.py or by the loaders, like a ClinVar and a CIViC one")
+	parser.add_argument("--bin-size", type=int, default=DEFAULT_BIN_SIZE, help="bases per histogram bin (default: %(default)s)")
+	parser.add_argument("--histogram-file", help="tab separated file where the variants of every bin are written")
+	args = parser.parse_args()
+	if args.bin_size < 1:
+		parser.error("--bin-size must be positive")
+
+	snapshots = [ (os.path.basename(os.path.normpath(snapshot_dir)), VariantSnapshot(snapshot_dir))  for snapshot_dir in args.snapshot_dir ]
+
+	start = time.perf_counter()
+	chromosome_rows, bin_rows, unplaced = density_tables(snapshots, args.bin_size)
+	elapsed = time.perf_counter() - start
+
+	write_table(CHROMOSOME_HEADER, chromosome_rows, sys.stdout)
+	if args.histogram_file is not None:
+		with open(args.histogram_file, "w", encoding="utf-8") as histF:
+			write_table(BIN_HEADER, bin_rows, histF)
+
+	for label, snapshot in snapshots:
+		print("{}: {} variants, {} unplaced".format(label, snapshot.rows, unplaced[label]), file=sys.stderr)
+	print("{} chromosomes and {} bins in {:.1f} ms".format(len(chromosome_rows), len(bin_rows), elapsed * 1000), file=sys.stderr)